@@ -3,16 +3,23 @@ import asyncio
 import dataclasses
 import json
 import re
-from concurrent.futures import ThreadPoolExecutor
+import secrets
+import time
 from json import JSONDecodeError
 
 from websockets.exceptions import ConnectionClosedError, ConnectionClosedOK
 
-from container import GameState, Event, Move, ArenaState, Row
+from container import GameState, GameDelta, Event, Move, ArenaState, SearchStats
 
 from typing import TYPE_CHECKING
 
+from evaluation import FOUR_THREAT, SCORE_LENGTH, default_weights, get_score, pack_score, threat_priority, tier_sign, unpack_score
+from metrics import MESSAGE_BYTES, MESSAGE_SEND_SECONDS, MESSAGES_SENT
+from profiling import profiler
 from rule import name_of, BLACK, BLANK
+from symmetry import SymmetricHash
+from tables import NEIGHBOURHOOD_RADIUS, neighbourhood
+from watchdog import run_off_loop
 
 if TYPE_CHECKING:
     from arena import Arena
@@ -22,9 +29,10 @@ class EnhancedJSONEncoder(json.JSONEncoder):
     def default(self, o):
         if dataclasses.is_dataclass(o):
             new_dict = dict()
-            for key, value in dataclasses.asdict(o).items():
-                new_key = re.sub('_([a-z|0-9])', lambda pat: pat.group(1).upper(), key)
-                new_dict[new_key] = value
+            # values are encoded by the encoder again, so nested dataclasses get camelCase keys too
+            for f in dataclasses.fields(o):
+                new_key = re.sub('_([a-z|0-9])', lambda pat: pat.group(1).upper(), f.name)
+                new_dict[new_key] = getattr(o, f.name)
             return new_dict
         return super().default(o)
 
@@ -52,34 +60,50 @@ class Agent:
     async def request_move(self, state: GameState):
         raise NotImplementedError()
 
+    async def close(self):
+        pass
+
     def __str__(self):
         return f'{self.__class__.__name__} {name_of(self.color)}'
 
 
 class PlayerAgent(Agent):
-    def __init__(self, websocket, connection_id, spectator=False):
+    def __init__(self, websocket, connection_id, spectator=False, grace_period: float = 0):
         super(PlayerAgent, self).__init__()
         self.websocket = websocket
         self.connection_id = connection_id
         self.spectator = spectator
+        # seconds the seat is kept for a reconnect after the connection drops, 0 to give up at once
+        self.grace_period = grace_period
+        self.token = secrets.token_urlsafe(16)
+        self._forfeit_task = None
         if spectator:
             self.color = 0
 
+    @property
+    def is_disconnected(self):
+        return self._forfeit_task is not None
+
     def start_receive_message(self):
         return self._receive_message()
 
     async def _receive_message(self):
         from arena import Arena
+        websocket = self.websocket
         try:
-            async for message in self.websocket:
-                if self.spectator:
-                    print('Ignore message from spectator')
-                    continue
+            async for message in websocket:
                 try:
                     message = json.loads(message)
                 except JSONDecodeError:
                     print(f'nonJSON Message received, ignore it: {message}')
                     continue
+                if self.spectator:
+                    # spectators can ask about the game, players can't
+                    if isinstance(message, dict) and message.get('type') == 'ANALYZE':
+                        asyncio.create_task(self._analyze(message.get('data')))
+                    else:
+                        print('Ignore message from spectator')
+                    continue
                 print(f'AGENT[{self.connection_id[:6]}] Received: {message}')
                 if message['type'] == 'MOVE':
                     self.put_event(Arena.MOVE, Move(
@@ -89,23 +113,92 @@ class PlayerAgent(Agent):
                     ))
                 elif message['type'] == 'PASS':
                     self.put_event(Arena.PASS)
-        except (ConnectionClosedOK, ConnectionClosedError):
-            if not self.spectator:
-                self.put_event(Arena.GIVE_UP)
-                self.arena.detach_agent(self)
-            else:
-                self.arena.detach_spectator(self)
+        except ConnectionClosedError:
+            if self.websocket is not websocket:
+                # the client is back on another connection already
+                return
+            # dropped without a close frame, keep the seat for a while in case the client comes back
+            if self._can_resume():
+                print(f'AGENT[{self.connection_id[:6]}] Connection lost, seat kept for {self.grace_period}s')
+                self._forfeit_task = asyncio.create_task(self._forfeit_after_grace_period())
+                return
+        except ConnectionClosedOK:
+            pass
+        if self.websocket is not websocket:
+            return
+        # the loop also ends without an exception when the client closes the connection normally
+        self._leave()
+
+    async def _analyze(self, data):
+        from analysis import analyze_message
+        try:
+            analysis = await analyze_message(data if data is not None else dict(), self.arena.game)
+        except ValueError as e:
+            await self._send_message('ANALYSIS', None, str(e))
+            return
+        await self._send_message('ANALYSIS', analysis)
+
+    def _can_resume(self):
+        return (
+            not self.spectator and self.grace_period > 0
+            and self.arena.is_game_started and not self.arena.game.is_game_over
+        )
+
+    def _leave(self):
+        from arena import Arena
+        if not self.spectator:
+            self.put_event(Arena.GIVE_UP)
+            self.arena.detach_agent(self)
+        else:
+            self.arena.detach_spectator(self)
         print(f'AGENT[{self.connection_id[:6]}] Disconnected')
 
+    async def _forfeit_after_grace_period(self):
+        await asyncio.sleep(self.grace_period)
+        self._forfeit_task = None
+        print(f'AGENT[{self.connection_id[:6]}] Did not reconnect in {self.grace_period}s')
+        self._leave()
+
+    async def resume(self, websocket, known_moves: int = None):
+        """
+        Continue the game on a new connection. The client gets the moves it missed when it tells how many
+        moves it has, the whole game state otherwise, and the move request it may have lost.
+        """
+        if self._forfeit_task is not None:
+            self._forfeit_task.cancel()
+            self._forfeit_task = None
+        previous, self.websocket = self.websocket, websocket
+        if previous is not websocket:
+            # the old connection may not have noticed it is gone yet
+            asyncio.create_task(previous.close())
+        game = self.arena.game
+        await self._send_message('START_GAME', dict(color=self.color, token=self.token))
+        if known_moves is not None and 0 <= known_moves <= len(game.moves):
+            await self._send_message('GAME_DELTA', GameDelta(game, known_moves))
+        else:
+            await self._send_message('GAME_STATE', self.arena.game_state)
+        if not game.is_game_over and game.next_turn == self.color:
+            await self.request_move(self.arena.game_state)
+        print(f'AGENT[{self.connection_id[:6]}] Resumed at version {game.version}')
+        return await self._receive_message()
+
     async def _send_message(self, type: str, data: any = None, message: any = None):
+        start = time.perf_counter()
         try:
-            await self.websocket.send(json.dumps(dict(type=type, data=data, message=message), cls=EnhancedJSONEncoder))
+            encoded = await run_off_loop(json.dumps, dict(type=type, data=data, message=message), cls=EnhancedJSONEncoder)
+            await self.websocket.send(encoded)
         except (ConnectionClosedOK, ConnectionClosedError):
-            pass
+            return
+        MESSAGES_SENT.inc(type=type)
+        MESSAGE_BYTES.inc(len(encoded), type=type)
+        MESSAGE_SEND_SECONDS.observe(time.perf_counter() - start)
 
     def start_game(self, color: int):
         super().start_game(color)
-        asyncio.create_task(self._send_message('START_GAME', dict(color=color)))
+        if self.spectator:
+            asyncio.create_task(self._send_message('START_GAME', dict(color=color)))
+        else:
+            asyncio.create_task(self._send_message('START_GAME', dict(color=color, token=self.token)))
 
     async def update_arena_state(self, state: ArenaState):
         await self._send_message('ARENA_STATE', state)
@@ -116,194 +209,223 @@ class PlayerAgent(Agent):
     async def request_move(self, state: GameState):
         await self._send_message('REQUEST_MOVE', state)
 
+    async def close(self):
+        await self.websocket.close()
+
 
 class AIAgent(Agent):
-    def __init__(self):
+    # memo entries are exact values, or bounds of the value when the search of the position was cut off
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+    # moves searched at full depth before late-move reductions start
+    LMR_AFTER = 3
+    # half width of the aspiration window, in heuristic points of a packed score
+    ASPIRATION_WINDOW = 100
+
+    def __init__(self, max_depth=4, max_width=10, verbose=True, pvs=False, aspiration=False, lmr=False, weights: tuple = None):
         super(AIAgent, self).__init__()
+        self.max_depth = max_depth
+        self.max_width = max_width
+        self.verbose = verbose
+        # of the heuristic sum of get_score, in the order of evaluation.FEATURES
+        self.weights = weights if weights is not None else default_weights()
+        # principal variation search: moves after the first are searched with a null window first
+        self.pvs = pvs
+        # iterations search in a window around the score of the previous one first
+        self.aspiration = aspiration
+        # late quiet moves are searched a ply shallower first
+        self.lmr = lmr
+        self.last_nodes = 0
+        self.last_stats: SearchStats = None
 
     async def request_move(self, state: GameState):
-        from arena import Arena
-        if state.last_move is None:
-            self.put_event(Arena.MOVE, Move(len(state.board) // 2, len(state.board[len(state.board) // 2]) // 2, self.color))
-            return
-        with ThreadPoolExecutor() as pool:
-            loop = asyncio.get_running_loop()
-            type, data = await loop.run_in_executor(pool, self._calc_best_move, state.board, self.arena.game.rule)
+        type, data = await run_off_loop(self.select_move, state.board, self.arena.game.rule, state.last_move)
+        if self.last_stats is not None:
+            self.arena.record_search_stats(self, self.last_stats)
         self.put_event(type, data)
 
-    def _calc_best_move(self, board, rule, max_depth=4):
-        score_length = 6
-
-        def initial_score():
-            return [0] * score_length
-
-        def extended_initial_score():
-            return [0] * max_depth + initial_score()
-
-        extended_zero_score = tuple(extended_initial_score())
-
-        def max_score(depth=max_depth):
-            score = extended_initial_score()
-            for i in range(max_depth-depth, len(score)):
-                score[i] = 1
-            return tuple(score)
-
-        def min_score(depth=max_depth):
-            score = extended_initial_score()
-            for i in range(max_depth-depth, len(score)):
-                score[i] = -1
-            return tuple(score)
+    def select_move(self, board, rule, last_move: Move = None):
+        from arena import Arena
+        self.last_stats = None
+        if last_move is None:
+            return Arena.MOVE, Move(len(board) // 2, len(board[len(board) // 2]) // 2, self.color)
+        arena_id = getattr(self.arena, 'arena_id', 'none')
+        move_number = sum(c != BLANK for row in board for c in row) + 1
+        with profiler.profile(arena_id, move_number, 'search'):
+            type, data, stats = self._calc_best_move(board, rule, max_depth=self.max_depth, with_stats=True)
+        if self.verbose:
+            print(f'{self}: {stats}')
+        return type, data
+
+    def analyze(self, board, rule, top: int = 3):
+        """
+        SearchStats of the searches of the `top` best moves for self.color, best first. Each search after the first
+        leaves out the moves found before it, the best move is in best_move and it leads the principal_variation.
+        """
+        results = []
+        excluded = set()
+        while len(results) < top:
+            type, data, stats = self._calc_best_move(board, rule, self.max_depth, with_stats=True, excluded=excluded)
+            if data is None:
+                break
+            results.append(stats)
+            excluded.add((data.i, data.j))
+        return results
+
+    def _calc_best_move(self, board, rule, max_depth=4, progress=None, with_stats=False, excluded=()):
+        """
+        Returns (type, data) of the best move, and the SearchStats of the search if with_stats.
+        Searches to increasing depths up to max_depth. Candidates are ordered by the best move of the previous
+        iteration, killer moves and the history table, and threat_priority, only leaves get a full evaluation.
+        progress(stats) is called after each root move of the last iteration has been searched.
+        Root moves in `excluded` are not searched.
+        """
+        start = time.perf_counter()
+        stats = SearchStats.for_depth(max_depth)
+        size = len(board)
+        neighbours = neighbourhood(size)
+
+        # scores are packed integers of the tuples (win at ply 0, ..., win at ply max_depth - 1) + get_score
+        score_length = max_depth + SCORE_LENGTH
+        # a win at each ply, sooner wins are worth more, a loss is the negative
+        win_scores = [pack_score((0,) * ply + (1,) * (score_length - ply)) for ply in range(max_depth + 1)]
 
-        def get_score(board, last_move):
+        memo = dict()
+        # best move of each position searched so far, in the canonical orientation
+        hash_moves = dict()
+        # moves that caused a cutoff, by ply
+        killers = [[] for _ in range(max_depth + 1)]
+        history = dict()
+        position_hash = SymmetricHash(board)
+
+        def principal_variation(pos):
             """
-            score(BLACK) - score(WHITE)
+            Follow the best moves kept in the memo from the root.
             """
-
-            if last_move is None:
-                return tuple(initial_score())
-            color = last_move.color
-
-            def get_rows(color):
-                twos: dict[tuple, Row] = dict()
-                threes: dict[tuple, Row] = dict()
-                fours: dict[tuple, Row] = dict()
-                for i in range(len(board)):
-                    for j in range(len(board[i])):
-                        if board[i][j] != color:
-                            continue
-                        move = Move(i, j, color)
-                        _twos, _threes, _fours = rule.get_rows(board, move)
-                        for row in _twos:
-                            key = tuple(row.move_list)
-                            twos[key] = row
-                        for row in _threes:
-                            key = tuple(row.move_list)
-                            threes[key] = row
-                        for row in _fours:
-                            key = tuple(row.move_list)
-                            fours[key] = row
-                return twos, threes, fours
-
-            def get_this_score(color):
-                if rule.is_win(board, last_move):
-                    return (1,) * score_length
-                this_score = initial_score()
-                this_twos, this_threes, this_fours = get_rows(color)
-                for row in this_twos.values():
-                    this_score[-1] += 1
-                cnt_open_three = 0
-                for row in this_threes.values():
-                    if not rule.is_explicitly_closed_three(board, row, color) and rule.is_open_three(board, row, color):
-                        this_score[-1] += 100
-                        cnt_open_three += 1
-                    elif rule.is_half_open_three(board, row, color):
-                        this_score[-1] += 10
-                cnt_four = 0
-                cnt_open_four = 0
-                for row in this_fours.values():
-                    if rule.is_four(board, row, color):
-                        this_score[-1] += 150
-                        cnt_four += 1
-                        if rule.is_open_four(board, row, color):
-                            cnt_open_four += 1
-                if color == BLACK:
-                    if cnt_open_four >= 1:
-                        this_score[2] = 1
-                    if cnt_open_three == 1 and cnt_four == 1:
-                        this_score[4] = 1
-                else:
-                    if cnt_open_four >= 1 or cnt_open_three + cnt_four >= 2:
-                        if cnt_open_four >= 1 or cnt_four >= 2:
-                            this_score[2] = 1
-                        else:
-                            this_score[4] = 1
-                return tuple(this_score)
-
-            def get_next_score(color):
-                next_score = initial_score()
-                next_twos, next_threes, next_fours = get_rows(color)
-                next_score[-1] += len(next_twos)
-                cnt_open_three = 0
-                for row in next_threes.values():
-                    if rule.is_half_open_three(board, row, color):
-                        next_score[-1] += 100
-                    if not rule.is_explicitly_closed_three(board, row, color) and rule.is_open_three(board, row, color):
-                        cnt_open_three += 1
-                cnt_four = 0
-                for row in next_fours.values():
-                    if rule.is_four(board, row, -color):
-                        cnt_four += 1
-                if cnt_open_three >= 1:
-                    next_score[3] = 1
-                if cnt_four >= 1:
-                    next_score[1] = 1
-                return tuple(next_score)
-
-            score = tuple(map(lambda x: color * (x[0] - x[1]), zip(get_this_score(color), get_next_score(-color))))
-            return score
-
-        memo = dict()
-
-        def alphabeta(board: list[list[int]], depth, a, b, turn: int, last_move: Move):
-            nonlocal max_depth
-            board_string = ''.join(''.join(str(c) for c in row) for row in board)
-            if board_string in memo:
-                return memo[board_string]
+            pv = []
+            turn = self.color
+            while pos is not None and len(pv) < max_depth:
+                pv.append(Move(*pos, turn))
+                board[pos[0]][pos[1]] = turn
+                position_hash.toggle(*pos, turn)
+                turn = -turn
+                pos = memo[position_hash.key][0] if position_hash.key in memo else None
+                if pos is not None:
+                    pos = position_hash.from_canonical(*pos)
+            for move in reversed(pv):
+                position_hash.toggle(move.i, move.j, move.color)
+                board[move.i][move.j] = BLANK
+            return pv
+
+        def ordered_moves(key, ply: int, turn: int):
+            """
+            Blank positions within 2 of a stone, best first. Legality is checked when a move is searched.
+            """
+            distances = dict()
+            for si in range(size):
+                for sj in range(size):
+                    if board[si][sj] == BLANK:
+                        continue
+                    for i, j, distance in neighbours[si * size + sj]:
+                        if board[i][j] == BLANK and distance < distances.get((i, j), NEIGHBOURHOOD_RADIUS + 1):
+                            distances[(i, j)] = distance
+            hash_move = hash_moves.get(key)
+            if hash_move is not None:
+                hash_move = position_hash.from_canonical(*hash_move)
+            keys = []
+            for (i, j), distance in distances.items():
+                stats.ordering_evaluations += 1
+                threat = threat_priority(board, i, j, turn)
+                is_killer = (i, j) in killers[ply]
+                keys.append((
+                    (i, j) == hash_move,
+                    # making or stopping a four comes before the killers
+                    threat if threat >= FOUR_THREAT else 0,
+                    is_killer,
+                    threat,
+                    history.get((i, j, turn), 0),
+                    -distance,
+                    i, j,
+                    # may be reduced
+                    (i, j) != hash_move and threat < FOUR_THREAT and not is_killer,
+                ))
+            keys.sort(reverse=True)
+            return [k[-3:] for k in keys]
+
+        def child(i, j, depth, ply, a, b, turn):
+            board[i][j] = turn
+            position_hash.toggle(i, j, turn)
+            _, sv = alphabeta(depth, ply, a, b, -turn, Move(i, j, turn), False)
+            position_hash.toggle(i, j, turn)
+            board[i][j] = BLANK
+            return sv
+
+        def alphabeta(depth, ply, a, b, turn: int, last_move: Move, root_stats: bool):
+            stats.nodes += 1
+            stats.nodes_per_ply[ply] += 1
+            key = position_hash.key
+            entry = memo.get(key)
+            if entry is not None:
+                pos, v, entry_depth, bound = entry
+                if entry_depth >= depth and (bound == self.EXACT or (bound == self.LOWER and v >= b) or (bound == self.UPPER and v <= a)):
+                    stats.memo_hits += 1
+                    return (position_hash.from_canonical(*pos) if pos is not None else None), v
             if last_move is not None and rule.is_win(board, last_move):
-                memo[board_string] = None, max_score(depth) if last_move.color == BLACK else min_score(depth)
-                return memo[board_string]
+                memo[key] = None, win_scores[ply] if last_move.color == BLACK else -win_scores[ply], max_depth, self.EXACT
+                return None, memo[key][1]
             if depth == 0:
-                memo[board_string] = None, (0,) * max_depth + get_score(board, last_move)
-                return memo[board_string]
-
-            pos_list = []
-            for i in range(len(board)):
-                for j in range(len(board[i])):
-                    move = Move(i, j, turn)
-                    if not rule.is_legal_move(board, move):
-                        continue
-                    min_dst = 9999
-                    for ii in range(len(board)):
-                        for jj in range(len(board[ii])):
-                            if board[ii][jj] != BLANK:
-                                min_dst = min(min_dst, max(abs(i - ii), abs(j - jj)))
-                                if min_dst <= 1:
-                                    break
-                        if min_dst <= 1:
-                            break
-                    if min_dst > 2:
-                        continue
-                    board[i][j] = turn
-                    score = get_score(board, move)
-                    board[i][j] = BLANK
-                    pos_list.append((i, j, (score, -turn * min_dst)))
+                stats.leaf_evaluations += 1
+                memo[key] = None, pack_score(get_score(board, rule, last_move, self.weights)), 0, self.EXACT
+                return None, memo[key][1]
+            a0, b0 = a, b
 
-            if depth != 0:
-                pos_list.sort(key=lambda p: p[2], reverse=turn == BLACK)
-            if depth == max_depth:
-                print(pos_list)
+            moves = ordered_moves(key, ply, turn)
+            if root_stats:
+                stats.root_candidates = len(moves)
 
             original_index = None
             pos = None
-            expected = None
-            v = min_score() if turn == BLACK else max_score()
-            index = 0
+            v = -win_scores[0] if turn == BLACK else win_scores[0]
+            searched = 0
 
-            while index < len(pos_list):
-                i, j , _ = pos_list[index]
-                move = Move(i, j, turn)
+            for index, (i, j, quiet) in enumerate(moves):
+                if ply == 0 and (i, j) in excluded:
+                    continue
+                # candidates are blank, only fouls can make them illegal
+                if rule.has_fouls and not rule.is_legal_move(board, Move(i, j, turn)):
+                    continue
 
-                board[i][j] = turn
-                e, sv = alphabeta(board, depth - 1, a, b, -turn, move)
-                if depth == max_depth:
-                    print(i, j, f'{index+1}/{len(pos_list)}', sv)
-                board[i][j] = BLANK
+                if searched == 0 or not self.pvs:
+                    window = a, b
+                else:
+                    # only tells whether the move is better than the best so far
+                    window = (a, a + 1) if turn == BLACK else (b - 1, b)
+                if self.lmr and quiet and searched >= self.LMR_AFTER and depth >= 3:
+                    stats.reductions += 1
+                    sv = child(i, j, depth - 2, ply + 1, *window, turn)
+                    if sv > a if turn == BLACK else sv < b:
+                        # better than expected, search it again at full depth
+                        sv = child(i, j, depth - 1, ply + 1, *window, turn)
+                else:
+                    sv = child(i, j, depth - 1, ply + 1, *window, turn)
+                if window != (a, b) and a < sv < b:
+                    stats.re_searches += 1
+                    sv = child(i, j, depth - 1, ply + 1, a, b, turn)
 
                 if (v < sv) if turn == BLACK else (v > sv):
-                    original_index = index
-                    expected = e
+                    original_index = searched
                     pos = (i, j)
                     v = sv
+                searched += 1
+
+                if root_stats:
+                    stats.root_searched = searched
+                    stats.best_rank = original_index
+                    stats.best_move = Move(*pos, turn) if pos is not None else None
+                    stats.score = unpack_score(v, score_length)
+                    if progress is not None:
+                        progress(stats)
 
                 # pruning
                 if turn == BLACK:
@@ -311,22 +433,54 @@ class AIAgent(Agent):
                 else:
                     b = min(b, v)
                 if b <= a:
+                    stats.cutoffs[ply] += 1
+                    if (i, j) not in killers[ply]:
+                        killers[ply] = [(i, j)] + killers[ply][:1]
+                    history[(i, j, turn)] = history.get((i, j, turn), 0) + depth * depth
                     break
 
                 # search more if it will lose
-                index += 1
-                if index >= 10 and (depth != max_depth or ((v[:-1] >= extended_zero_score[:-1]) if turn == BLACK else (v[:-1] <= extended_zero_score[:-1]))):
+                if searched >= self.max_width and (ply != 0 or (tier_sign(v) >= 0 if turn == BLACK else tier_sign(v) <= 0)):
+                    if index + 1 < len(moves):
+                        stats.width_cutoffs[ply] += 1
                     break
 
-            if depth == max_depth:
-                print(f'Rank {original_index}/{len(pos_list)}', original_index / len(pos_list))
-                print(f'Best {pos}, expect {expected}: {v}')
-            memo[board_string] = pos, v
-            return memo[board_string]
-
-        pos, v = alphabeta(board, max_depth, min_score(), max_score(), self.color, None)
+            # the memo is shared by symmetric positions, so moves are kept in the canonical orientation
+            canonical = position_hash.to_canonical(*pos) if pos is not None else None
+            if v >= b0:
+                bound = self.LOWER
+            elif v <= a0:
+                bound = self.UPPER
+            else:
+                bound = self.EXACT
+            memo[key] = canonical, v, depth, bound
+            if canonical is not None:
+                hash_moves[key] = canonical
+            return pos, v
+
+        v = None
+        for depth in range(1, max_depth + 1):
+            # values depend on the depth left, only the move ordering tables carry over to the next iteration
+            memo = dict()
+            nodes = stats.nodes
+            last = depth == max_depth
+            if self.aspiration and v is not None:
+                window = v - self.ASPIRATION_WINDOW, v + self.ASPIRATION_WINDOW
+                pos, v = alphabeta(depth, 0, *window, self.color, None, last)
+                if not window[0] < v < window[1]:
+                    stats.re_searches += 1
+                    pos, v = alphabeta(depth, 0, -win_scores[0], win_scores[0], self.color, None, last)
+            else:
+                pos, v = alphabeta(depth, 0, -win_scores[0], win_scores[0], self.color, None, last)
+            stats.iterations.append(dict(depth=depth, nodes=stats.nodes - nodes, elapsed=time.perf_counter() - start))
+        stats.score = unpack_score(v, score_length)
+        stats.principal_variation = principal_variation(pos)
+        stats.elapsed = time.perf_counter() - start
+        self.last_nodes = stats.nodes
+        self.last_stats = stats
         from arena import Arena
         if pos is not None:
-            return Arena.MOVE, Move(*pos, self.color)
+            result = Arena.MOVE, Move(*pos, self.color)
         else:
-            return Arena.PASS, None
+            result = Arena.PASS, None
+        return result + (stats,) if with_stats else result
@@ -0,0 +1,178 @@
+"""
+Analysis of positions for clients: the best moves of a position with their scores and principal variations,
+from the search of AIAgent. Results are cached for the whole server by canonical position, rule, turn and depth,
+so repeated requests for a position, in any of its 8 orientations, share one search.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+
+from agent import AIAgent
+from container import Analysis, AnalyzedMove, Move
+from game import Game
+from metrics import ANALYSES
+from rule import BLACK, BLANK, BOARD_SIZE, MAX_BOARD_SIZE, MIN_BOARD_SIZE, WHITE, Rule, rule_of
+from symmetry import board_hashes, inverse_transform, transform_point
+from watchdog import run_off_loop
+
+ANALYSIS_CACHE_ENV = 'GOMOKU_ANALYSIS_CACHE'
+ANALYSIS_MAX_DEPTH_ENV = 'GOMOKU_ANALYSIS_MAX_DEPTH'
+# budget of a request that does not ask for one
+DEPTH = 2
+TOP = 3
+MAX_TOP = 5
+max_depth = int(os.environ.get(ANALYSIS_MAX_DEPTH_ENV, 4))
+
+
+class AnalysisCache:
+    """
+    Least recently used results of `maxsize` positions. Moves are kept in the canonical orientation of the position.
+    A search still running is shared by the requests that come in for the same position meanwhile.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        # key -> (top, task of (moves, nodes))
+        self.entries: OrderedDict = OrderedDict()
+        self.searches = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _forget(self, key, task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None:
+            if self.entries.get(key, (None, None))[1] is task:
+                del self.entries[key]
+
+    @staticmethod
+    def _covers(entry, top: int):
+        searched, task = entry
+        # fewer moves than asked for means there are no more
+        return searched >= top or (task.done() and not task.cancelled() and task.exception() is None
+                                   and len(task.result()[0]) < searched)
+
+    async def analyze(self, board: list[list[int]], rule: Rule, turn: int, depth: int, top: int) -> Analysis:
+        size = len(board)
+        hashes = board_hashes(board)
+        k = hashes.index(min(hashes))
+        key = size, rule.variant, min(hashes), turn, depth
+        entry = self.entries.get(key)
+        cached = entry is not None and self._covers(entry, top)
+        if cached:
+            ANALYSES.inc(cache='hit')
+            self.entries.move_to_end(key)
+            task = entry[1]
+        else:
+            ANALYSES.inc(cache='miss')
+            self.searches += 1
+            task = asyncio.create_task(self._search([row[:] for row in board], rule, turn, depth, top, k))
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.entries[key] = top, task
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        # a client that goes away does not cancel the search of the others
+        moves, nodes = await asyncio.shield(task)
+        back = inverse_transform(k)
+
+        def orient(move: Move):
+            return Move(*transform_point(move.i, move.j, size, back), move.color)
+
+        return Analysis(turn, depth, [
+            AnalyzedMove(orient(move.move), move.score, [orient(pv) for pv in move.principal_variation])
+            for move in moves[:top]
+        ], nodes, cached)
+
+    @staticmethod
+    async def _search(board: list[list[int]], rule: Rule, turn: int, depth: int, top: int, k: int):
+        size = len(board)
+
+        def canonical(move: Move):
+            return Move(*transform_point(move.i, move.j, size, k), move.color)
+
+        if all(c == BLANK for row in board for c in row):
+            # the search starts from the stones, AIAgent opens in the center
+            center = Move(size // 2, size // 2, turn)
+            return [AnalyzedMove(canonical(center), None, [canonical(center)])], 0
+        agent = AIAgent(max_depth=depth, verbose=False)
+        agent.color = turn
+        results = await run_off_loop(agent.analyze, board, rule, top)
+        moves = [
+            AnalyzedMove(canonical(stats.best_move), stats.score, [canonical(move) for move in stats.principal_variation])
+            for stats in results
+        ]
+        return moves, sum(stats.nodes for stats in results)
+
+
+def game_position(game: Game):
+    """
+    (board, rule, turn) of a game.
+    """
+    if game.is_game_over:
+        raise ValueError('The game is over')
+    return [row[:] for row in game.board], game.rule, game.next_turn
+
+
+def position_of(data: dict):
+    """
+    (board, rule, turn) of an ANALYZE message, from its `moves` played from an empty board of `boardSize`,
+    or from its `board`, where black moves first unless the message tells the `turn`.
+    """
+    try:
+        rule = rule_of(data.get('rule', 'renju'))
+        if data.get('moves') is not None:
+            game = Game(int(data.get('boardSize', BOARD_SIZE)), rule)
+            for move in data['moves']:
+                if game.is_game_over:
+                    raise ValueError('The game is over')
+                game.play_move(Move(int(move['i']), int(move['j']), game.next_turn))
+            return game_position(game)
+        board = [[int(c) for c in row] for row in data['board']]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f'Malformed position: {e!r}')
+    size = len(board)
+    if not MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE or any(len(row) != size for row in board):
+        raise ValueError(f'The board is not square with a size in {MIN_BOARD_SIZE}..{MAX_BOARD_SIZE}')
+    if any(c not in (BLANK, BLACK, WHITE) for row in board for c in row):
+        raise ValueError('The board has values other than stones and blanks')
+    if data.get('turn') is not None:
+        turn = int(data['turn'])
+        if turn not in (BLACK, WHITE):
+            raise ValueError(f'Turn {turn} is not a color')
+        return board, rule, turn
+    blacks = sum(c == BLACK for row in board for c in row)
+    whites = sum(c == WHITE for row in board for c in row)
+    if blacks - whites not in (0, 1):
+        raise ValueError(f'{blacks} black and {whites} white stones, tell whose turn it is')
+    return board, rule, BLACK if blacks == whites else WHITE
+
+
+def budget_of(data: dict):
+    """
+    (depth, top) of an ANALYZE message, the search depth and the number of moves.
+    """
+    try:
+        depth = int(data.get('depth', DEPTH))
+        top = int(data.get('top', TOP))
+    except TypeError as e:
+        raise ValueError(f'Malformed budget: {e!r}')
+    if not 1 <= depth <= max_depth:
+        raise ValueError(f'Depth {depth} is not in 1..{max_depth}')
+    if not 1 <= top <= MAX_TOP:
+        raise ValueError(f'Top {top} is not in 1..{MAX_TOP}')
+    return depth, top
+
+
+cache = AnalysisCache(int(os.environ.get(ANALYSIS_CACHE_ENV, 4096)))
+
+
+async def analyze_message(data: dict, game: Game = None) -> Analysis:
+    """
+    Analysis for an ANALYZE message, of the position of `game` if given, of the position in the message otherwise.
+    Raises ValueError for a message that cannot be analyzed.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('ANALYZE takes an object')
+    board, rule, turn = game_position(game) if game is not None else position_of(data)
+    depth, top = budget_of(data)
+    return await cache.analyze(board, rule, turn, depth, top)
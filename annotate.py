@@ -0,0 +1,200 @@
+"""
+Annotate stored games with the search of AIAgent. Every move is compared with the best move of its position:
+the drop of the expected result from the best move to the played one marks blunders and makes up the accuracy
+of each player. Games are read from a GameStore one at a time and written as lines of JSON in the order of the
+store, with a checkpoint every few games to resume from after an interruption.
+"""
+import argparse
+import json
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from container import Move
+from evaluation import SCORE_LENGTH, get_score
+from game import Game
+from gamestore import GameRecord, GameStore
+from rule import BLACK, BLANK, name_of, rule_of
+
+# heuristic points of a score for an expected result of about 73%, an open three is worth 100
+EXPECTED_SCALE = 200
+# drop of the expected result of a move that is a blunder
+BLUNDER = 0.3
+
+
+def expected_result(score: tuple, color: int):
+    """
+    Expected result in 0..1 for `color` of a score tuple of the search, scored for black. The first tier that
+    is set decides it, a win found by the search or a threat of get_score alike, the heuristic sum otherwise.
+    """
+    for tier in score[:-1]:
+        if tier:
+            return 1.0 if tier * color > 0 else 0.0
+    return 1 / (1 + math.exp(-max(-50.0, min(50.0, score[-1] * color / EXPECTED_SCALE))))
+
+
+def annotate_game(record: GameRecord, depth: int = 2, width: int = 10, blunder: float = BLUNDER):
+    """
+    Replays a game and searches each position to `depth`. Returns the game with a dict for each move:
+    the best move, the drop of the expected result from it to the played move, and whether that is a blunder.
+    """
+    from agent import AIAgent
+    game = Game(record.board_size, rule_of(record.rule))
+    agent = AIAgent(max_depth=depth, max_width=width, verbose=False)
+    moves = []
+    drops = {BLACK: [], -BLACK: []}
+    for move in record.moves:
+        if move.color != game.next_turn:
+            game.pass_move(game.next_turn)
+        annotation = dict(i=move.i, j=move.j, color=move.color, best=None, drop=None, blunder=False)
+        if game.moves:
+            agent.color = move.color
+            _, best, stats = agent._calc_best_move(game.board, game.rule, depth, with_stats=True)
+            drop = 0.0
+            if best is not None and (best.i, best.j) != (move.i, move.j):
+                drop = max(0.0, expected_result(stats.score, move.color) - expected_result(
+                    _played_score(agent, game, move, depth), move.color))
+            annotation.update(
+                best=dict(i=best.i, j=best.j) if best is not None else None,
+                drop=round(drop, 4),
+                blunder=drop >= blunder,
+            )
+            drops[move.color].append(drop)
+        moves.append(annotation)
+        game.play_move(move)
+    return dict(
+        game_id=record.game_id,
+        rule=record.rule,
+        board_size=record.board_size,
+        winner=record.winner,
+        depth=depth,
+        moves=moves,
+        # the mean of 1 - drop over the annotated moves of each player, in percent
+        accuracy={name_of(color).lower(): round(100 * (1 - sum(d) / len(d)), 1) if d else None for color, d in drops.items()},
+        blunders={name_of(color).lower(): sum(d >= blunder for d in drops[color]) for color in drops},
+    )
+
+
+def _played_score(agent, game: Game, move: Move, depth: int):
+    """
+    Score of the position after `move` with a search one ply shallower, as the search from before it scores it.
+    """
+    board = game.board
+    board[move.i][move.j] = move.color
+    try:
+        if game.rule.is_win(board, move):
+            score = (move.color,) * (depth + SCORE_LENGTH)
+        elif depth == 1:
+            score = get_score(board, game.rule, move, agent.weights)
+        else:
+            agent.color = -move.color
+            *_, stats = agent._calc_best_move(board, game.rule, depth - 1, with_stats=True)
+            score = stats.score
+    finally:
+        board[move.i][move.j] = BLANK
+        agent.color = move.color
+    return score
+
+
+def _annotate(args):
+    return annotate_game(*args)
+
+
+def read_checkpoint(path: str):
+    """
+    (games, offset) written so far, or (0, 0) without a checkpoint.
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path) as f:
+        checkpoint = json.load(f)
+    return checkpoint['games'], checkpoint['offset']
+
+
+def write_checkpoint(path: str, games: int, offset: int):
+    # replaced at once, so an interruption leaves the old checkpoint or the new one
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dict(games=games, offset=offset), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def annotate_store(store: GameStore, output: str, depth: int = 2, width: int = 10, blunder: float = BLUNDER,
+                   processes: int = None, checkpoint_every: int = 100, limit: int = None, on_game=None):
+    """
+    Annotate the games of `store` into the JSON lines file `output` in a process pool, continuing after the games
+    of the checkpoint at output + '.checkpoint' if there is one. At most a few games per process are read ahead.
+    Returns the number of games written, including the ones before the checkpoint.
+    """
+    checkpoint_path = output + '.checkpoint'
+    done, offset = read_checkpoint(checkpoint_path)
+    if offset > (os.path.getsize(output) if os.path.exists(output) else 0):
+        print(f'{output} is shorter than its checkpoint, starting over')
+        done, offset = 0, 0
+    entries = store.entries[done:] if limit is None else store.entries[done:max(done, limit)]
+    if done:
+        print(f'Resuming after {done} games')
+    with open(output, 'a+b') as out:
+        # drop the games written after the checkpoint, they are annotated again
+        out.truncate(offset)
+        out.seek(offset)
+        processes = processes or os.cpu_count()
+        if processes == 1:
+            annotated = (annotate_game(store.read(entry), depth, width, blunder) for entry in entries)
+        else:
+            annotated = _pooled(store, entries, depth, width, blunder, processes)
+        for annotation in annotated:
+            out.write(json.dumps(annotation).encode() + b'\n')
+            done += 1
+            if on_game is not None:
+                on_game(annotation)
+            if done % checkpoint_every == 0:
+                out.flush()
+                os.fsync(out.fileno())
+                write_checkpoint(checkpoint_path, done, out.tell())
+        out.flush()
+        os.fsync(out.fileno())
+        write_checkpoint(checkpoint_path, done, out.tell())
+    return done
+
+
+def _pooled(store: GameStore, entries, depth: int, width: int, blunder: float, processes: int):
+    """
+    Annotations of the entries in order, with at most 4 games per process in flight.
+    """
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        for entry in entries:
+            pending.append(pool.submit(_annotate, (store.read(entry), depth, width, blunder)))
+            if len(pending) >= 4 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Annotate stored games with blunders and the accuracy of each player')
+    parser.add_argument('--games', default='games', help='game store directory of the server or the coordinator')
+    parser.add_argument('--output', default='annotated.jsonl', help='JSON lines file, resumed from its checkpoint')
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--blunder', type=float, default=BLUNDER, help='drop of the expected result of a blunder')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--checkpoint-every', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=None, help='annotate only the first games of the store')
+    args = parser.parse_args()
+
+    def on_game(annotation):
+        print(f'Game[{annotation["game_id"][:8]}] {len(annotation["moves"])} moves, '
+              f'accuracy {annotation["accuracy"]}, blunders {annotation["blunders"]}')
+
+    with GameStore(args.games) as store:
+        games = annotate_store(store, args.output, args.depth, args.width, args.blunder, args.processes,
+                               args.checkpoint_every, args.limit, on_game)
+    print(f'{games} games annotated in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,25 @@
 import asyncio
+import time
 import uuid
 from asyncio import Queue
-from random import shuffle
+from random import Random, shuffle
 
 from agent import AIAgent, Agent
-from container import GameState, Move, Event, ArenaState
+from container import GameState, Move, Event, ArenaState, SearchStats
 from game import Game
-from rule import IllegalMoveError, BLACK, WHITE, BLANK
+from mcts import search_value
+from profiling import profiler
+from rule import BOARD_SIZE, IllegalMoveError, BLACK, WHITE, BLANK, Rule
+from watchdog import run_off_loop
 
 
 class Arena:
     MOVE = 'MOVE'
     PASS = 'PASS'
     GIVE_UP = 'GIVE_UP'
+    CLOSE = 'CLOSE'
 
-    def __init__(self, title: str, player_num: int, allow_spectator: bool):
+    def __init__(self, title: str, player_num: int, allow_spectator: bool, board_size: int = BOARD_SIZE, rule: Rule = None):
         self.arena_id = str(uuid.uuid4())
         self.title = title
         self.allow_spectator = allow_spectator
@@ -24,8 +29,11 @@ class Arena:
         self.spectators: list[Agent] = []
 
         self._event_queue = None
-        self.game = Game()
+        self.game = Game(board_size, rule)
         self.game_task = None
+        self.started_at = None
+        self.last_active = time.monotonic()
+        self.search_stats_listener = None
 
         self._try_start_game()
 
@@ -42,43 +50,73 @@ class Arena:
             event: Event = await self._event_queue.get()
             print(f'Process {event}')
             if event.type == Arena.MOVE:
-                move: Move = event.data
-                try:
-                    self.game.play_move(move)
-                    for agent in self.agents:
-                        if self.game.is_game_over or agent.color != self.game.next_turn:
-                            asyncio.create_task(agent.update_game_state(self.game_state))
-                    for spectator in self.spectators:
-                        asyncio.create_task(spectator.update_game_state(self.game_state))
-                except IllegalMoveError as e:
-                    print(e)
-                if self.game.is_game_over:
-                    break
-                asyncio.create_task(self._get_next_agent().request_move(self.game_state))
-            elif event.type == Arena.PASS:
-                try:
-                    self.game.pass_move(event.dispatcher.color)
-                    for agent in self.agents:
-                        if self.game.is_game_over or agent.color != self.game.next_turn:
-                            asyncio.create_task(agent.update_game_state(self.game_state))
-                    for spectator in self.spectators:
-                        asyncio.create_task(spectator.update_game_state(self.game_state))
-                except IllegalMoveError as e:
-                    print(e)
-                if self.game.is_game_over:
-                    break
-                asyncio.create_task(self._get_next_agent().request_move(self.game_state))
-            elif event.type == Arena.GIVE_UP:
-                self.game.force_win(-event.dispatcher.color)
-                for spectator in self.agents + self.spectators:
-                    asyncio.create_task(spectator.update_game_state(self.game_state))
+                await self._check_move_off_loop(event.data)
+            with profiler.profile(self.arena_id, len(self.game.moves) + 1, 'events'):
+                closed = self._process_event(event)
+            if closed:
                 break
-            else:
-                pass
             self._event_queue.task_done()
         print(f'Arena[{self.arena_id}] Closed')
         self.game_task = None
 
+    async def _check_move_off_loop(self, move: Move):
+        """
+        Runs the legality check of a move on a copy of the board in the executor, so the check in
+        `Game.play_move` is answered from the rule's memo instead of blocking the loop.
+        """
+        board = self.game.board
+        if not self.game.rule.has_fouls:
+            return
+        if not (0 <= move.i < len(board) and 0 <= move.j < len(board) and board[move.i][move.j] == BLANK):
+            return
+        await run_off_loop(self.game.rule.is_legal_move, [row[:] for row in board], move)
+
+    def _broadcast_game_state(self):
+        # one snapshot of the game shared by every agent
+        state = self.game_state
+        for agent in self.agents:
+            if self.game.is_game_over or agent.color != self.game.next_turn:
+                asyncio.create_task(agent.update_game_state(state))
+        for spectator in self.spectators:
+            asyncio.create_task(spectator.update_game_state(state))
+
+    def _process_event(self, event: Event):
+        """
+        Returns True when the game is over.
+        """
+        if event.type == Arena.MOVE:
+            move: Move = event.data
+            try:
+                self.game.play_move(move)
+                self._broadcast_game_state()
+            except IllegalMoveError as e:
+                print(e)
+            if self.game.is_game_over:
+                return True
+            asyncio.create_task(self._get_next_agent().request_move(self.game_state))
+        elif event.type == Arena.PASS:
+            try:
+                self.game.pass_move(event.dispatcher.color)
+                self._broadcast_game_state()
+            except IllegalMoveError as e:
+                print(e)
+            if self.game.is_game_over:
+                return True
+            asyncio.create_task(self._get_next_agent().request_move(self.game_state))
+        elif event.type == Arena.CLOSE:
+            self.game.force_win(None)
+            state = self.game_state
+            for agent in self.agents + self.spectators:
+                asyncio.create_task(agent.update_game_state(state))
+            return True
+        elif event.type == Arena.GIVE_UP:
+            self.game.force_win(-event.dispatcher.color)
+            state = self.game_state
+            for spectator in self.agents + self.spectators:
+                asyncio.create_task(spectator.update_game_state(state))
+            return True
+        return False
+
     def _try_start_game(self):
         if len(self.agents) == self.player_num:
             for _ in range(2 - self.player_num):
@@ -89,10 +127,25 @@ class Arena:
     def _get_next_agent(self):
         return next(agent for agent in self.agents if agent.color == self.game.next_turn)
 
+    def record_search_stats(self, agent: Agent, stats: SearchStats):
+        if self.search_stats_listener is not None:
+            self.search_stats_listener(stats)
+
     def put_event(self, event: Event):
+        self.last_active = time.monotonic()
         if self._event_queue:
             self._event_queue.put_nowait(event)
 
+    def close(self):
+        """
+        Ends a running game without a winner, or sends away the agents of an arena that never started.
+        """
+        if self.is_game_started:
+            self.put_event(Event(None, Arena.CLOSE, None))
+        else:
+            for agent in self.agents + self.spectators:
+                asyncio.create_task(agent.close())
+
     def _attach_agent(self, agent: Agent):
         if len(self.agents) >= 2:
             raise ValueError('2 agents are attached to the arena already')
@@ -125,12 +178,14 @@ class Arena:
         self._update_arena_state()
 
     def _update_arena_state(self):
+        self.last_active = time.monotonic()
         state = ArenaState(self)
         for agent in self.agents + self.spectators:
             asyncio.create_task(agent.update_arena_state(state))
 
     def _start_game(self):
         self._event_queue = Queue()
+        self.started_at = time.time()
         shuffle(self.agents)
         colors = [BLACK, WHITE]
         for agent, color in zip(self.agents, colors):
@@ -138,10 +193,87 @@ class Arena:
         for spectator in self.spectators:
             spectator.start_game(BLANK)
         next_agent = self._get_next_agent()
-        for agent in self.agents:
-            if next_agent is not agent:
-                asyncio.create_task(agent.update_game_state(self.game_state))
-        for spectator in self.spectators:
-            asyncio.create_task(spectator.update_game_state(self.game_state))
+        self._broadcast_game_state()
+        # the agent to move gets its own copy, a search places stones on the board it is given
         asyncio.create_task(next_agent.request_move(self.game_state))
         self.game_task = asyncio.create_task(self._process_events())
+
+
+class AIVAIArena:
+    """
+    Headless arena that plays two AIAgents against each other directly on Game, without event queues.
+    """
+
+    def __init__(self, black: AIAgent = None, white: AIAgent = None, seed: int = None, opening_moves: int = 0,
+                 max_moves: int = None, opening: list[tuple[int, int]] = None, board_size: int = BOARD_SIZE, rule: Rule = None):
+        self.arena_id = str(uuid.uuid4())
+        self.seed = seed
+        self.opening = opening or []
+        self.opening_moves = opening_moves
+        self.max_moves = max_moves
+        self.random = Random(seed)
+        self.agents: list[AIAgent] = [black or AIAgent(verbose=False), white or AIAgent(verbose=False)]
+        self.game = Game(board_size, rule)
+        self.move_times: list[float] = []
+        self.move_nodes: list[int] = []
+        # value of the root search in [-1, 1] for the player who moved, None for moves that were not searched
+        self.move_scores: list[float] = []
+
+    @property
+    def game_state(self):
+        return GameState(self.game)
+
+    def put_event(self, event: Event):
+        pass
+
+    def _get_next_agent(self):
+        return next(agent for agent in self.agents if agent.color == self.game.next_turn)
+
+    def _play_opening(self):
+        board = self.game.board
+        center = len(board) // 2
+        for i, j in self.opening:
+            self.game.play_move(Move(center + i, center + j, self.game.next_turn))
+            self._record_move(0.0, 0, None)
+        for _ in range(self.opening_moves):
+            candidates = [
+                Move(i, j, self.game.next_turn)
+                for i in range(center - 2, center + 3)
+                for j in range(center - 2, center + 3)
+                if self.game.rule.is_legal_move(board, Move(i, j, self.game.next_turn))
+            ]
+            if not candidates:
+                break
+            self.game.play_move(self.random.choice(candidates))
+            self._record_move(0.0, 0, None)
+            if self.game.is_game_over:
+                break
+
+    def _record_move(self, elapsed: float, nodes: int, score: float):
+        self.move_times.append(elapsed)
+        self.move_nodes.append(nodes)
+        self.move_scores.append(score)
+
+    def play(self) -> Game:
+        for agent, color in zip(self.agents, [BLACK, WHITE]):
+            agent.attach_arena(self)
+            agent.start_game(color)
+        self._play_opening()
+        while not self.game.is_game_over:
+            if self.max_moves is not None and len(self.game.moves) >= self.max_moves:
+                # out of budget, count it as a draw
+                self.game.force_win(None)
+                break
+            agent = self._get_next_agent()
+            agent.last_nodes = 0
+            start = time.perf_counter()
+            type, data = agent.select_move(self.game.board, self.game.rule, self.game.last_move)
+            if type == Arena.MOVE:
+                self.game.play_move(data)
+                # the opening move in the center and MCTSAgent have no search stats
+                stats = getattr(agent, 'last_stats', None)
+                score = agent.color * search_value(stats.score) if stats is not None and stats.score is not None else None
+                self._record_move(time.perf_counter() - start, agent.last_nodes, score)
+            else:
+                self.game.pass_move(agent.color)
+        return self.game
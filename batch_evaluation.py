@@ -0,0 +1,202 @@
+"""
+evaluation.get_score with NumPy over a stack of boards at once.
+
+The rows of get_rows are found by pattern matching along every line of the boards: a maximal run of 2 to 4 stones,
+or two maximal runs one blank apart with 2 to 4 stones together. The checks of the rows only ask whether a position
+is blank and on the board, which holds for rules without fouls, and under standard whether it makes an overline
+with the stones past it. Under renju the legality of a black move can depend
+on the whole board, so rules with fouls are scored with get_score one board at a time.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from container import Move
+from evaluation import SCORE_LENGTH, WEIGHTS, get_score
+from rule import Rule, directions
+
+# value of the positions off the board
+OFF = 2
+# off board positions around each line, the checks of a row look up to three positions past its ends
+PAD = 3
+# (stones before the blank, stones after it) of the rows, no blank when there are no stones after it
+PATTERNS = ((2, 0), (3, 0), (4, 0), (1, 1), (1, 2), (2, 1), (1, 3), (2, 2), (3, 1))
+
+
+@lru_cache(maxsize=None)
+def line_indexes(size: int):
+    """
+    Flat indexes of the positions of every line in the four directions, padded with size * size,
+    the index of an extra position that is off the board.
+    """
+    off = size * size
+    lines = []
+    for direction in directions:
+        # a line starts where the position before it is off the board
+        for i in range(size):
+            for j in range(size):
+                if 0 <= i - direction.i < size and 0 <= j - direction.j < size:
+                    continue
+                line = []
+                ii, jj = i, j
+                while 0 <= ii < size and 0 <= jj < size:
+                    line.append(ii * size + jj)
+                    ii, jj = ii + direction.i, jj + direction.j
+                lines.append([off] * PAD + line + [off] * (size - len(line) + PAD))
+    return np.array(lines, dtype=np.intp)
+
+
+def _lines(boards: np.ndarray):
+    """
+    (boards, lines, size + 2 * PAD) values of the lines of each board.
+    """
+    count, size, _ = boards.shape
+    flat = np.concatenate([boards.reshape(count, size * size), np.full((count, 1), OFF, dtype=boards.dtype)], axis=1)
+    return flat[:, line_indexes(size)]
+
+
+def _count_rows(lines: np.ndarray, colors: np.ndarray, exact: bool = False):
+    """
+    Counts of the rows of `colors`, one color for each board, as in evaluation.get_score. With `exact` five,
+    a blank that makes more than five with the stones past it does not complete a row.
+    """
+    color = colors.astype(lines.dtype)[:, None, None]
+    own = lines == color
+    blank = lines == 0
+    # an opponent stone or off the board
+    invalid = ~own & ~blank
+    width = lines.shape[-1]
+    # half open threes are counted with and without the open ones, the last player only scores the others
+    counts = dict(two=0, open_three=0, half_open_three=0, only_half_open_three=0, four=0, open_four=0)
+    for before, after in PATTERNS:
+        stones = before + after
+        span = stones + (after > 0)
+        # the row starts at p, for p in [PAD, width - PAD - span]
+        last = width - PAD - span + 1
+
+        def at(offset):
+            return slice(PAD + offset, last + offset)
+
+        def clear(offset):
+            # no stone at `offset` that a completion would join into an overline
+            return ~own[..., at(offset)] if exact else True
+
+        match = ~own[..., at(-1)] & ~own[..., at(span)]
+        for k in range(before):
+            match &= own[..., at(k)]
+        if after:
+            match &= blank[..., at(before)]
+            for k in range(before + 1, span):
+                match &= own[..., at(k)]
+        if stones == 2:
+            counts['two'] += match.sum(axis=(1, 2))
+            continue
+        front = blank[..., at(-1)]
+        rear = blank[..., at(span)]
+        if stones == 3:
+            front2 = blank[..., at(-2)]
+            rear2 = blank[..., at(span + 1)]
+            closed = invalid[..., at(-1)] | invalid[..., at(span)] | own[..., at(-2)] | own[..., at(span + 1)]
+            if after:
+                is_open = front & rear
+                half_open = (front & clear(-2)) | (rear & clear(span + 1))
+            else:
+                closed |= invalid[..., at(-2)] & invalid[..., at(span + 1)]
+                is_open = (front & front2 & clear(-3) & rear) | (rear & rear2 & clear(span + 2) & front)
+                # extended at the front if that is a move, at the rear otherwise
+                extends_front = front & (clear(-2) | clear(-3))
+                extends_rear = rear & (clear(span + 1) | clear(span + 2))
+                half_open = np.where(
+                    extends_front,
+                    (front2 & clear(-3)) | (rear & clear(-2) & clear(span + 1)),
+                    extends_rear & ((rear2 & clear(span + 2)) | (front & clear(-2) & clear(span + 1))),
+                )
+            is_open &= ~closed
+            counts['open_three'] += (match & is_open).sum(axis=(1, 2))
+            counts['half_open_three'] += (match & half_open).sum(axis=(1, 2))
+            counts['only_half_open_three'] += (match & ~is_open & half_open).sum(axis=(1, 2))
+        else:
+            if after:
+                counts['four'] += match.sum(axis=(1, 2))
+            else:
+                front = front & clear(-2)
+                rear = rear & clear(span + 1)
+                counts['four'] += (match & (front | rear)).sum(axis=(1, 2))
+                counts['open_four'] += (match & front & rear).sum(axis=(1, 2))
+    return counts
+
+
+def _is_win(boards: np.ndarray, last_moves: np.ndarray, colors: np.ndarray, rule: Rule):
+    """
+    Whether the last move of each board made five, or more than five for freestyle.
+    """
+    count, size, _ = boards.shape
+    reach = 5
+    padded = np.full((count, size + 2 * reach, size + 2 * reach), OFF, dtype=boards.dtype)
+    padded[:, reach:reach + size, reach:reach + size] = boards
+    index = np.arange(count)
+    steps = np.arange(1, reach + 1)
+    wins = np.zeros(count, dtype=bool)
+    for direction in directions:
+        length = np.ones(count, dtype=np.int64)
+        for sign in (1, -1):
+            cells = padded[
+                index[:, None],
+                last_moves[:, 0, None] + reach + sign * steps * direction.i,
+                last_moves[:, 1, None] + reach + sign * steps * direction.j,
+            ]
+            length += np.cumprod(cells == colors[:, None], axis=1).sum(axis=1)
+        wins |= length >= 5 if rule.variant == 'freestyle' else length == 5
+    return wins
+
+
+def batch_features(boards: np.ndarray, colors: np.ndarray, exact: bool = False):
+    """
+    (boards, len(evaluation.FEATURES)) counts of the rows for the heuristic sum of get_score, where `colors` is the color of the
+    last move of each board, under standard with `exact` five. Also returns the counts the tiers of the score are decided by.
+    """
+    lines = _lines(boards)
+    this_rows = _count_rows(lines, colors, exact)
+    next_rows = _count_rows(lines, -colors, exact)
+    features = np.stack([
+        this_rows['two'], this_rows['open_three'], this_rows['only_half_open_three'], this_rows['four'],
+        next_rows['two'], next_rows['half_open_three'],
+    ], axis=1).astype(np.int64)
+    tiers = dict(
+        open_three=this_rows['open_three'], four=this_rows['four'], open_four=this_rows['open_four'],
+        next_open_three=next_rows['open_three'], next_four=next_rows['four'],
+    )
+    return features, tiers
+
+
+def batch_scores(boards, last_moves: list[Move], rule: Rule, weights=WEIGHTS):
+    """
+    (boards, SCORE_LENGTH) scores of get_score for a stack of boards and the last move on each of them.
+    """
+    if rule.has_fouls or rule.variant is None:
+        scores = [get_score(board, rule, last_move, weights) for board, last_move in zip(boards, last_moves)]
+        return np.array(scores, dtype=np.int64).reshape(-1, SCORE_LENGTH)
+    boards = np.asarray(boards, dtype=np.int8)
+    scores = np.zeros((len(boards), SCORE_LENGTH), dtype=np.int64)
+    played = np.array([last_move is not None for last_move in last_moves], dtype=bool)
+    if not played.any():
+        return scores
+    boards = boards[played]
+    moves = np.array([(move.i, move.j) for move in last_moves if move is not None], dtype=np.intp)
+    colors = np.array([move.color for move in last_moves if move is not None], dtype=np.int64)
+
+    features, tiers = batch_features(boards, colors, rule.variant == 'standard')
+    weights = np.asarray(weights, dtype=np.int64)
+    this_score = np.zeros((len(boards), SCORE_LENGTH), dtype=np.int64)
+    this_score[:, -1] = features[:, :4] @ weights[:4]
+    threats = (tiers['open_four'] >= 1) | (tiers['open_three'] + tiers['four'] >= 2)
+    sure = (tiers['open_four'] >= 1) | (tiers['four'] >= 2)
+    this_score[:, 2] = threats & sure
+    this_score[:, 4] = threats & ~sure
+    this_score[_is_win(boards, moves, colors, rule)] = 1
+    next_score = np.zeros((len(boards), SCORE_LENGTH), dtype=np.int64)
+    next_score[:, -1] = features[:, 4:] @ weights[4:]
+    next_score[:, 3] = tiers['next_open_three'] >= 1
+    next_score[:, 1] = tiers['next_four'] >= 1
+    scores[played] = colors[:, None] * (this_score - next_score)
+    return scores
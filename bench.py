@@ -0,0 +1,385 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+from random import Random
+
+from agent import AIAgent, EnhancedJSONEncoder
+from batch_evaluation import batch_scores
+from container import GameState, Move
+from evaluation import get_score
+from game import Game
+from rule import BLACK, BLANK, WHITE, GomokuRule, RenjuRule, parse_board
+
+# positions of test.py, with the color to move
+BOARDS = {
+    'four': ('''
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        .....OO.OO.....
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+    ''', WHITE),
+    'double-threat': ('''
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        .....O.........
+        ......O........
+        .....OO.OO.....
+        ........O......
+        .........O.....
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+    ''', BLACK),
+    'crowded': ('''
+        ...............
+        ...............
+        ...............
+        ...............
+        .....XOXOOOO...
+        .......X.......
+        .....XXOX......
+        .....X.O.X.....
+        .....OOXX.X....
+        .......O...O...
+        .......O.......
+        ...............
+        ...............
+        ...............
+        ...............
+    ''', BLACK),
+    'three': ('''
+        ...............
+        ...............
+        ...............
+        ...............
+        .........O.....
+        .....O.........
+        .........O.....
+        ......OOO......
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+    ''', BLACK),
+    'defence': ('''
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        .......XX......
+        ......XO.......
+        ......OOX......
+        .....O.........
+        ....OO.........
+        ...X...........
+        ...............
+        ...............
+        ...............
+        ...............
+    ''', WHITE),
+    'rows': ('''
+        ...............
+        ...............
+        ...............
+        ....O.....O....
+        .....O...O.....
+        ......O........
+        .....O.OOO.....
+        .......O.......
+        .....O.O.O.....
+        ....O..........
+        ...O...........
+        ...............
+        ...............
+        ...............
+        ...............
+    ''', WHITE),
+}
+
+
+def sample_positions(count: int, seed: int, min_moves=10, max_moves=30):
+    """
+    Midgame positions of seeded random games, played near the existing stones.
+    """
+    random = Random(seed)
+    positions = dict()
+    while len(positions) < count:
+        game = Game()
+        game.play_move(Move(7, 7, BLACK))
+        for _ in range(random.randint(min_moves, max_moves)):
+            candidates = [
+                Move(i, j, game.next_turn)
+                for i in range(15) for j in range(15)
+                if game.board[i][j] == BLANK
+                and any(game.board[ii][jj] != BLANK for ii in range(max(i - 2, 0), min(i + 3, 15)) for jj in range(max(j - 2, 0), min(j + 3, 15)))
+                and game.rule.is_legal_move(game.board, Move(i, j, game.next_turn))
+            ]
+            game.play_move(random.choice(candidates))
+            if game.is_game_over:
+                break
+        if not game.is_game_over:
+            positions[f'sample-{len(positions)}'] = (game.board, game.next_turn)
+    return positions
+
+
+def corpus(samples: int, seed: int):
+    positions = {name: (parse_board(board), turn) for name, (board, turn) in BOARDS.items()}
+    positions.update(sample_positions(samples, seed))
+    return positions
+
+
+def stones(board):
+    return [(i, j, c) for i, row in enumerate(board) for j, c in enumerate(row) if c != BLANK]
+
+
+def bench_get_rows(positions):
+    rule = RenjuRule()
+    ops = 0
+    for board, _ in positions.values():
+        for i, j, c in stones(board):
+            rule.get_rows(board, Move(i, j, c))
+            ops += 1
+    return dict(ops=ops)
+
+
+def bench_is_legal_move(positions):
+    ops = 0
+    for board, _ in positions.values():
+        # a new rule for every position, so no call is answered from the memo of another position
+        rule = RenjuRule()
+        for i in range(len(board)):
+            for j in range(len(board[i])):
+                if board[i][j] == BLANK:
+                    rule.is_legal_move(board, Move(i, j, BLACK))
+                    ops += 1
+    return dict(ops=ops)
+
+
+def bench_is_open_three(positions):
+    ops = 0
+    for board, _ in positions.values():
+        rule = RenjuRule()
+        for i, j, c in stones(board):
+            for row in rule.get_rows(board, Move(i, j, c))[1]:
+                rule.is_open_three(board, row, c)
+                ops += 1
+    return dict(ops=ops)
+
+
+def _games(positions):
+    games = []
+    for board, turn in positions.values():
+        game = Game()
+        game.board = [row[:] for row in board]
+        game.moves = [Move(i, j, c) for i, j, c in stones(board)]
+        game.next_turn = turn
+        games.append(game)
+    return games
+
+
+def bench_game_state(positions, repeat=20):
+    games = _games(positions)
+    for _ in range(repeat):
+        for game in games:
+            GameState(game)
+    return dict(ops=repeat * len(games))
+
+
+def bench_json_encode(positions, repeat=20):
+    states = [GameState(game) for game in _games(positions)]
+    for _ in range(repeat):
+        for state in states:
+            json.dumps(dict(type='GAME_STATE', data=state, message=None), cls=EnhancedJSONEncoder)
+    return dict(ops=repeat * len(states))
+
+
+def _scored_positions(positions):
+    # every position with its last stone as the last move
+    scored = []
+    for board, turn in positions.values():
+        last = next(((i, j) for i in range(len(board)) for j in range(len(board)) if board[i][j] == -turn), None)
+        scored.append((board, Move(*last, -turn) if last else None))
+    return scored
+
+
+def bench_get_score(positions, repeat=20):
+    rule = GomokuRule()
+    scored = _scored_positions(positions)
+    for _ in range(repeat):
+        for board, last_move in scored:
+            get_score(board, rule, last_move)
+    return dict(ops=repeat * len(scored))
+
+
+def bench_batch_scores(positions, repeat=20):
+    rule = GomokuRule()
+    scored = _scored_positions(positions) * repeat
+    batch_scores([board for board, _ in scored], [last_move for _, last_move in scored], rule)
+    return dict(ops=len(scored))
+
+
+def bench_search(positions, depth: int, limit: int):
+    ops = 0
+    nodes = 0
+    for board, turn in list(positions.values())[:limit]:
+        agent = AIAgent(max_depth=depth, verbose=False)
+        agent.color = turn
+        agent._calc_best_move([row[:] for row in board], RenjuRule(), max_depth=depth)
+        ops += 1
+        nodes += agent.last_nodes
+    return dict(ops=ops, nodes=nodes)
+
+
+SEARCH_SWITCHES = ('pvs', 'aspiration', 'lmr')
+
+
+def compare_search_switches(positions, depth: int, limit: int):
+    """
+    Nodes, time and best moves of every combination of the search switches, and how many of the best moves
+    agree with the search without any of them.
+    """
+    results = dict()
+    reference = None
+    for values in itertools.product((False, True), repeat=len(SEARCH_SWITCHES)):
+        switches = dict(zip(SEARCH_SWITCHES, values))
+        nodes = 0
+        moves = []
+        start = time.perf_counter()
+        for board, turn in list(positions.values())[:limit]:
+            agent = AIAgent(max_depth=depth, verbose=False, **switches)
+            agent.color = turn
+            _, move = agent._calc_best_move([row[:] for row in board], RenjuRule(), max_depth=depth)
+            nodes += agent.last_nodes
+            moves.append((move.i, move.j) if move is not None else None)
+        reference = moves if reference is None else reference
+        name = '+'.join(key for key, value in switches.items() if value) or 'plain'
+        results[name] = dict(
+            nodes=nodes,
+            seconds=time.perf_counter() - start,
+            agreement=sum(move == expected for move, expected in zip(moves, reference)) / len(moves),
+            moves=moves,
+        )
+    return results
+
+
+def measure(function, *args, repeat=3):
+    """
+    Best wall time of `repeat` runs.
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    result['seconds'] = best
+    result['ops_per_second'] = result['ops'] / best
+    if 'nodes' in result:
+        result['nodes_per_second'] = result['nodes'] / best
+    return result
+
+
+def run(samples=6, seed=0, depths=(1, 2, 3, 4), search_limit=3, repeat=3):
+    positions = corpus(samples, seed)
+    results = dict(
+        get_rows=measure(bench_get_rows, positions, repeat=repeat),
+        is_legal_move=measure(bench_is_legal_move, positions, repeat=repeat),
+        is_open_three=measure(bench_is_open_three, positions, repeat=repeat),
+        game_state=measure(bench_game_state, positions, repeat=repeat),
+        json_encode=measure(bench_json_encode, positions, repeat=repeat),
+        get_score=measure(bench_get_score, positions, repeat=repeat),
+        batch_scores=measure(bench_batch_scores, positions, repeat=repeat),
+    )
+    for depth in depths:
+        # deeper searches are slow, one run is enough to see a regression
+        results[f'search_depth_{depth}'] = measure(bench_search, positions, depth, search_limit, repeat=repeat if depth <= 2 else 1)
+    return dict(
+        meta=dict(python=platform.python_version(), machine=platform.machine(), samples=samples, seed=seed, positions=len(positions)),
+        results=results,
+    )
+
+
+def compare(report: dict, baseline: dict, tolerance: float):
+    """
+    Ratio of the throughput to the baseline for every benchmark, and the names of the regressions.
+    """
+    ratios = dict()
+    regressions = []
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        key = 'nodes_per_second' if 'nodes_per_second' in result else 'ops_per_second'
+        ratio = result[key] / baseline['results'][name][key]
+        ratios[name] = ratio
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+        if 'nodes' in result and result['nodes'] != baseline['results'][name]['nodes']:
+            # the search itself changed, the throughput alone does not tell the whole story
+            ratios[f'{name}_nodes'] = result['nodes'] / baseline['results'][name]['nodes']
+    return ratios, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the rule checks and the AI search')
+    parser.add_argument('--samples', type=int, default=6, help='sampled midgame positions added to the fixed boards')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--depths', default='1,2,3,4')
+    parser.add_argument('--search-limit', type=int, default=3, help='positions searched at each depth')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='write the report to this file instead of stdout')
+    parser.add_argument('--baseline', default=None, help='report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown')
+    parser.add_argument('--switches', type=int, default=None, metavar='DEPTH',
+                        help='only compare the search switches at this depth on --search-limit positions')
+    args = parser.parse_args()
+
+    if args.switches is not None:
+        results = compare_search_switches(corpus(args.samples, args.seed), args.switches, args.search_limit)
+        for name, result in results.items():
+            print(f'{name:<22} {result["nodes"]:>8} nodes {result["seconds"]:>7.2f}s {result["agreement"]:>5.0%} agree')
+        return
+
+    report = run(args.samples, args.seed, tuple(int(d) for d in args.depths.split(',') if d), args.search_limit, args.repeat)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['comparison'], regressions = compare(report, baseline, args.tolerance)
+        report['regressions'] = regressions
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if regressions:
+        print(f'Regressions: {", ".join(regressions)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
 from __future__ import annotations
-import copy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from typing import TYPE_CHECKING
 
@@ -28,14 +27,37 @@ class GameState:
     winner: int
     moves: list[Move]
     board: list[list[int]]
+    version: int
 
     def __init__(self, game: Game):
         self.next_turn = game.next_turn
         self.last_move = game.last_move
         self.is_game_over = game.is_game_over
         self.winner = game.winner
-        self.moves = game.moves
-        self.board = copy.deepcopy(game.board)
+        self.moves = list(game.moves)
+        self.board = [row[:] for row in game.board]
+        self.version = game.version
+
+
+@dataclass
+class GameDelta:
+    """
+    The moves played since a client saw `since` moves, with the current turn and result.
+    """
+    since: int
+    moves: list[Move]
+    next_turn: int
+    is_game_over: bool
+    winner: int
+    version: int
+
+    def __init__(self, game: Game, since: int):
+        self.since = since
+        self.moves = game.moves[since:]
+        self.next_turn = game.next_turn
+        self.is_game_over = game.is_game_over
+        self.winner = game.winner
+        self.version = game.version
 
 
 @dataclass
@@ -46,6 +68,8 @@ class ArenaState:
     players: int
     agents: int
     spectators: int
+    board_size: int
+    rule: str
 
     def __init__(self, arena: Arena):
         self.id = arena.arena_id
@@ -54,6 +78,8 @@ class ArenaState:
         self.players = arena.player_num
         self.agents = len(arena.agents)
         self.spectators = len(arena.spectators)
+        self.board_size = len(arena.game.board)
+        self.rule = arena.game.rule.variant
 
 
 @dataclass
@@ -63,6 +89,26 @@ class Move:
     color: int
 
 
+@dataclass
+class AnalyzedMove:
+    move: Move
+    # score tuple of the search, see evaluation.unpack_score, positive is good for black
+    score: tuple
+    principal_variation: list[Move]
+
+
+@dataclass
+class Analysis:
+    """
+    The best moves of a position for the player to move, best first.
+    """
+    turn: int
+    depth: int
+    moves: list[AnalyzedMove]
+    nodes: int
+    cached: bool
+
+
 @dataclass
 class Direction:
     i: int
@@ -88,3 +134,81 @@ class Row:
     @property
     def rear_blank(self):
         return self.direction.rear_of(*self.move_list[-1])
+
+
+@dataclass
+class SearchStats:
+    max_depth: int = 0
+    nodes: int = 0
+    leaf_evaluations: int = 0
+    ordering_evaluations: int = 0
+    memo_hits: int = 0
+    # searches again after a null or aspiration window failed, and moves searched at a reduced depth
+    re_searches: int = 0
+    reductions: int = 0
+    # indexed by ply from the root
+    nodes_per_ply: list[int] = field(default_factory=list)
+    cutoffs: list[int] = field(default_factory=list)
+    width_cutoffs: list[int] = field(default_factory=list)
+    root_candidates: int = 0
+    root_searched: int = 0
+    best_rank: int = None
+    best_move: Move = None
+    score: tuple = None
+    principal_variation: list[Move] = field(default_factory=list)
+    # depth, nodes and elapsed seconds of each search iteration
+    iterations: list[dict] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @classmethod
+    def for_depth(cls, max_depth: int):
+        return cls(max_depth, nodes_per_ply=[0] * (max_depth + 1), cutoffs=[0] * (max_depth + 1), width_cutoffs=[0] * (max_depth + 1))
+
+    @property
+    def effective_branching_factor(self):
+        if self.max_depth <= 0 or self.nodes <= 1:
+            return 0.0
+        return self.nodes ** (1 / self.max_depth)
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        pv = ' '.join(f'({move.i},{move.j})' for move in self.principal_variation)
+        return f'depth {self.max_depth}, {self.nodes} nodes in {self.elapsed:.3f}s ({self.nodes_per_second:.0f}/s), ' \
+               f'{self.leaf_evaluations}+{self.ordering_evaluations} evaluations, {self.memo_hits} memo hits, ' \
+               f'cutoffs {self.cutoffs}, ebf {self.effective_branching_factor:.2f}, ' \
+               f'rank {self.best_rank}/{self.root_candidates}, score {self.score}, pv {pv}'
+
+
+@dataclass
+class SearchStatsAggregate:
+    moves: int = 0
+    nodes: int = 0
+    leaf_evaluations: int = 0
+    ordering_evaluations: int = 0
+    memo_hits: int = 0
+    elapsed: float = 0.0
+    max_elapsed: float = 0.0
+    cutoffs: list[int] = field(default_factory=list)
+
+    def add(self, stats: SearchStats):
+        self.moves += 1
+        self.nodes += stats.nodes
+        self.leaf_evaluations += stats.leaf_evaluations
+        self.ordering_evaluations += stats.ordering_evaluations
+        self.memo_hits += stats.memo_hits
+        self.elapsed += stats.elapsed
+        self.max_elapsed = max(self.max_elapsed, stats.elapsed)
+        if len(self.cutoffs) < len(stats.cutoffs):
+            self.cutoffs += [0] * (len(stats.cutoffs) - len(self.cutoffs))
+        for ply, cutoffs in enumerate(stats.cutoffs):
+            self.cutoffs[ply] += cutoffs
+
+    def __str__(self):
+        average = self.elapsed / self.moves if self.moves else 0.0
+        nodes_per_second = self.nodes / self.elapsed if self.elapsed else 0.0
+        return f'{self.moves} moves, {self.nodes} nodes ({nodes_per_second:.0f}/s), ' \
+               f'{average:.3f}s per move (max {self.max_elapsed:.3f}s), ' \
+               f'{self.leaf_evaluations}+{self.ordering_evaluations} evaluations, {self.memo_hits} memo hits, cutoffs {self.cutoffs}'
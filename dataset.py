@@ -0,0 +1,178 @@
+import json
+import math
+import os
+
+import numpy as np
+
+from container import Move
+from rule import BLANK, BOARD_SIZE
+from symmetry import TRANSFORMS, transform_point
+
+INDEX_FILE = 'index.json'
+PASS_MOVE = -1
+
+
+def record_dtype(board_size: int = BOARD_SIZE):
+    return np.dtype([
+        ('board', np.int8, (board_size, board_size)),
+        ('turn', np.int8),
+        ('move', np.int16),
+        ('score', np.float32),
+        ('outcome', np.int8),
+        ('game', np.int64),
+        ('ply', np.int16),
+    ])
+
+
+def encode_move(move: Move, board_size: int = BOARD_SIZE):
+    if move is None:
+        return PASS_MOVE
+    return move.i * board_size + move.j
+
+
+def decode_move(move: int, turn: int, board_size: int = BOARD_SIZE):
+    if move == PASS_MOVE:
+        return None
+    return Move(int(move) // board_size, int(move) % board_size, int(turn))
+
+
+def transform_record(record: np.ndarray, k: int):
+    """
+    Apply the k-th dihedral transform to the board and the move of a record.
+    """
+    board_size = record['board'].shape[-1]
+    transformed = record.copy()
+    board = record['board']
+    transformed['board'] = np.rot90(board.T if k >= 4 else board, k % 4)
+    if record['move'] != PASS_MOVE:
+        i, j = transform_point(int(record['move']) // board_size, int(record['move']) % board_size, board_size, k)
+        transformed['move'] = i * board_size + j
+    return transformed
+
+
+class DatasetWriter:
+    """
+    Streams positions into fixed-record .npy shards of `shard_size` records, listed in index.json.
+    """
+
+    def __init__(self, path: str, shard_size: int = 65536, augment: bool = False, board_size: int = BOARD_SIZE):
+        self.path = path
+        self.shard_size = shard_size
+        self.augment = augment
+        self.board_size = board_size
+        self.dtype = record_dtype(board_size)
+        os.makedirs(path, exist_ok=True)
+        self.index = self._load_index()
+        self._buffer = np.zeros(shard_size, dtype=self.dtype)
+        self._size = 0
+        self._next_game = self.index['games']
+
+    def _load_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if index['board_size'] != self.board_size:
+                raise ValueError(f'Dataset board size {index["board_size"]} does not match {self.board_size}')
+            return index
+        return dict(board_size=self.board_size, games=0, shards=[])
+
+    def _write_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+    def add_position(self, board: list[list[int]], turn: int, move: Move, score: float = math.nan,
+                     outcome: int = 0, game: int = 0, ply: int = 0):
+        record = self._buffer[self._size]
+        record['board'] = board
+        record['turn'] = turn
+        record['move'] = encode_move(move, self.board_size)
+        record['score'] = score
+        record['outcome'] = outcome
+        record['game'] = game
+        record['ply'] = ply
+        if self.augment:
+            original = record.copy()
+            self._advance()
+            for k in TRANSFORMS[1:]:
+                self._buffer[self._size] = transform_record(original, k)
+                self._advance()
+        else:
+            self._advance()
+
+    def _advance(self):
+        self._size += 1
+        if self._size == self.shard_size:
+            self.flush()
+
+    def add_game(self, moves: list[Move], winner: int, scores: list[float] = None):
+        """
+        Store every position of a game with the move played from it.
+        Outcome is +1/-1/0 from the view of the player to move.
+        """
+        game = self._next_game
+        self._next_game += 1
+        board = [[BLANK] * self.board_size for _ in range(self.board_size)]
+        for ply, move in enumerate(moves):
+            score = scores[ply] if scores is not None and scores[ply] is not None else math.nan
+            outcome = 0 if winner is None else (1 if winner == move.color else -1)
+            self.add_position(board, move.color, move, score, outcome, game, ply)
+            board[move.i][move.j] = move.color
+
+    def flush(self):
+        if self._size == 0:
+            return
+        name = f'shard-{len(self.index["shards"]):05d}.npy'
+        np.save(os.path.join(self.path, name), self._buffer[:self._size])
+        self.index['shards'].append(dict(file=name, records=self._size))
+        self.index['games'] = self._next_game
+        self._size = 0
+        self._write_index()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DatasetReader:
+    """
+    Random access over all shards of a dataset. Shards are opened as memmaps, so only sampled records are read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.board_size = self.index['board_size']
+        self.shards = [np.load(os.path.join(path, shard['file']), mmap_mode='r') for shard in self.index['shards']]
+        self.offsets = np.cumsum([0] + [shard['records'] for shard in self.index['shards']])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index: int):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        shard = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return self.shards[shard][index - self.offsets[shard]]
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield from shard
+
+    def sample(self, n: int, rng: np.random.Generator = None):
+        rng = rng or np.random.default_rng()
+        indices = np.sort(rng.integers(0, len(self), size=n))
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        records = np.empty(n, dtype=record_dtype(self.board_size))
+        for shard in np.unique(shard_ids):
+            mask = shard_ids == shard
+            records[mask] = self.shards[shard][indices[mask] - self.offsets[shard]]
+        return records
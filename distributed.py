@@ -0,0 +1,352 @@
+"""
+Self-play across machines. A coordinator hands out self-play jobs to workers that connect over TCP, and stores
+the games they send back. Messages are lines of JSON, dict(type=..., data=...):
+
+    worker -> coordinator: HELLO {worker, slots}, REQUEST_JOBS {count}, RESULTS {results}, HEARTBEAT {}
+    coordinator -> worker: JOBS {jobs}, WAIT {seconds}, DONE {}
+
+A job stays leased to its worker until the result arrives. The jobs of a worker that disconnects, or that sends
+nothing for `lease_timeout` seconds, go back to the front of the queue. Only the first result of a job is kept.
+Weights files named by the engines are read by the workers, so they need to exist on every worker.
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from container import Move
+from gamestore import GameRecord, GameStore
+from rule import BOARD_SIZE, RULES
+from selfplay import EngineConfig, SelfPlayJob, SelfPlayReport, SelfPlayResult, make_jobs, play_game
+from watchdog import run_off_loop
+
+PORT = 7000
+# lines longer than this are a broken peer, a batch of results is well below it
+LINE_LIMIT = 2 ** 24
+
+
+def encode_message(type: str, data: dict):
+    return json.dumps(dict(type=type, data=data)).encode() + b'\n'
+
+
+async def read_message(reader: asyncio.StreamReader):
+    """
+    The next message, or None once the connection is closed or the peer sent something else than a message.
+    """
+    try:
+        line = await reader.readline()
+    except (ConnectionError, ValueError):
+        return None
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def encode_job(job_id: str, job: SelfPlayJob):
+    return dict(id=job_id, **dataclasses.asdict(job))
+
+
+def decode_job(data: dict):
+    data = dict(data)
+    job_id = data.pop('id')
+    data['black'] = EngineConfig(**data['black'])
+    data['white'] = EngineConfig(**data['white'])
+    if data['opening'] is not None:
+        data['opening'] = [tuple(point) for point in data['opening']]
+    return job_id, SelfPlayJob(**data)
+
+
+def encode_result(job_id: str, result: SelfPlayResult):
+    return dict(id=job_id, **dataclasses.asdict(result))
+
+
+def decode_result(data: dict):
+    data = dict(data)
+    job_id = data.pop('id')
+    data['moves'] = [Move(**move) for move in data['moves']]
+    return job_id, SelfPlayResult(**data)
+
+
+@dataclasses.dataclass
+class WorkerState:
+    worker_id: str
+    name: str
+    writer: asyncio.StreamWriter
+    last_seen: float
+    jobs: set = dataclasses.field(default_factory=set)
+
+
+class Coordinator:
+    """
+    Serves `jobs` to workers until every job has a result. Results are appended to `store`, with the job id
+    as the game id, and passed to `on_result`.
+    """
+
+    def __init__(self, jobs: list[SelfPlayJob], store: GameStore = None, lease_timeout: float = 30.0,
+                 wait_seconds: float = 1.0, on_result=None, clock=time.monotonic):
+        self.jobs = {str(uuid.uuid4()): job for job in jobs}
+        self.pending = deque(self.jobs)
+        self.results: dict[str, SelfPlayResult] = dict()
+        self.workers: dict[str, WorkerState] = dict()
+        self.store = store
+        self.lease_timeout = lease_timeout
+        self.wait_seconds = wait_seconds
+        self.on_result = on_result
+        self.clock = clock
+        self.reassigned = 0
+        self.port = None
+        self._server = None
+        self._reaper = None
+        self._finished = asyncio.Event()
+        self._start = None
+        if not self.jobs:
+            self._finished.set()
+
+    @property
+    def in_flight(self):
+        return sum(len(worker.jobs) for worker in self.workers.values())
+
+    async def start(self, host: str = '0.0.0.0', port: int = PORT):
+        self._start = time.perf_counter()
+        self._server = await asyncio.start_server(self._accept, host, port, limit=LINE_LIMIT)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._reaper = asyncio.create_task(self._reap())
+        print(f'COORDINATOR Serving {len(self.jobs)} jobs on port {self.port}')
+        return self
+
+    async def wait(self) -> SelfPlayReport:
+        """
+        Wait for the results of all jobs. Results keep the order of the jobs.
+        """
+        await self._finished.wait()
+        report = SelfPlayReport([self.results[job_id] for job_id in self.jobs])
+        report.elapsed = time.perf_counter() - self._start if self._start is not None else 0.0
+        return report
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._server is not None:
+            self._server.close()
+            for worker in list(self.workers.values()):
+                worker.writer.close()
+            await self._server.wait_closed()
+        if self.store is not None:
+            await run_off_loop(self.store.sync)
+
+    def _release(self, worker: WorkerState):
+        """
+        Put the leased jobs of a lost worker back at the front of the queue.
+        """
+        if self.workers.pop(worker.worker_id, None) is None:
+            return
+        lost = [job_id for job_id in worker.jobs if job_id not in self.results]
+        if lost:
+            print(f'COORDINATOR[{worker.worker_id[:6]}] Lost {worker.name}, reassigning {len(lost)} jobs')
+            self.reassigned += len(lost)
+            self.pending.extendleft(reversed(lost))
+        worker.jobs.clear()
+        worker.writer.close()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.lease_timeout / 4)
+            now = self.clock()
+            for worker in list(self.workers.values()):
+                if now - worker.last_seen > self.lease_timeout:
+                    self._release(worker)
+
+    def _lease(self, worker: WorkerState, count: int):
+        jobs = []
+        while self.pending and len(jobs) < count:
+            job_id = self.pending.popleft()
+            if job_id in self.results:
+                continue
+            worker.jobs.add(job_id)
+            jobs.append(encode_job(job_id, self.jobs[job_id]))
+        return jobs
+
+    async def _store(self, job_id: str, result: SelfPlayResult):
+        job = self.jobs[job_id]
+        self.results[job_id] = result
+        for worker in self.workers.values():
+            worker.jobs.discard(job_id)
+        if self.store is not None:
+            finished = time.time()
+            record = GameRecord(
+                job_id, result.moves, result.winner, job.rule, finished - result.elapsed, finished, job.board_size,
+            )
+            await run_off_loop(self.store.append, record)
+        if self.on_result is not None:
+            self.on_result(result)
+        if len(self.results) == len(self.jobs):
+            self._finished.set()
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker = WorkerState(str(uuid.uuid4()), 'worker', writer, self.clock())
+        self.workers[worker.worker_id] = worker
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None or worker.worker_id not in self.workers:
+                    return
+                worker.last_seen = self.clock()
+                data = message['data']
+                if message['type'] == 'HELLO':
+                    worker.name = str(data.get('worker', worker.name))
+                    print(f'COORDINATOR[{worker.worker_id[:6]}] {worker.name} joined with {data.get("slots")} slots')
+                elif message['type'] == 'REQUEST_JOBS':
+                    jobs = self._lease(worker, int(data['count']))
+                    if jobs:
+                        reply = encode_message('JOBS', dict(jobs=jobs))
+                    elif self._finished.is_set():
+                        reply = encode_message('DONE', dict())
+                    else:
+                        # the other jobs are in flight, one may come back
+                        reply = encode_message('WAIT', dict(seconds=self.wait_seconds))
+                    writer.write(reply)
+                    await writer.drain()
+                elif message['type'] == 'RESULTS':
+                    for result in data['results']:
+                        job_id, result = decode_result(result)
+                        if job_id in self.jobs and job_id not in self.results:
+                            await self._store(job_id, result)
+                    print(f'COORDINATOR[{worker.worker_id[:6]}] {len(self.results)}/{len(self.jobs)} games')
+        except ConnectionError:
+            pass
+        finally:
+            self._release(worker)
+
+
+async def run_worker(host: str, port: int = PORT, processes: int = 1, batch_size: int = 8,
+                     heartbeat: float = 5.0, name: str = None):
+    """
+    Play the jobs of a coordinator in `processes` processes until it has none left, and send the results back
+    in batches of `batch_size`. Returns the number of games played.
+    """
+    name = name or f'{socket.gethostname()}-{os.getpid()}'
+    reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    lock = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+
+    async def send(type, data):
+        async with lock:
+            writer.write(encode_message(type, data))
+            await writer.drain()
+
+    async def beat():
+        while True:
+            await asyncio.sleep(heartbeat)
+            await send('HEARTBEAT', dict())
+
+    # a thread leaves the event loop free to send heartbeats while a single game is played
+    pool = ProcessPoolExecutor(processes) if processes > 1 else ThreadPoolExecutor(1)
+    running = dict()
+    results = []
+    played = 0
+    done = False
+    await send('HELLO', dict(worker=name, slots=processes))
+    beating = asyncio.create_task(beat())
+    try:
+        while True:
+            wait = None
+            if not done and len(running) < processes:
+                await send('REQUEST_JOBS', dict(count=processes - len(running)))
+                reply = await read_message(reader)
+                if reply is None:
+                    print(f'WORKER[{name}] Coordinator closed the connection')
+                    break
+                if reply['type'] == 'JOBS':
+                    for data in reply['data']['jobs']:
+                        job_id, job = decode_job(data)
+                        running[asyncio.ensure_future(loop.run_in_executor(pool, play_game, job))] = job_id
+                elif reply['type'] == 'WAIT':
+                    wait = reply['data']['seconds']
+                else:
+                    done = True
+            if running:
+                finished, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    results.append(encode_result(running.pop(future), future.result()))
+                    played += 1
+            elif done:
+                break
+            elif wait:
+                await asyncio.sleep(wait)
+            # results wait for a full batch while games are still being played
+            if results and (len(results) >= batch_size or not running):
+                await send('RESULTS', dict(results=results))
+                results = []
+    except ConnectionError:
+        print(f'WORKER[{name}] Lost the coordinator')
+    finally:
+        beating.cancel()
+        for future in running:
+            future.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+    print(f'WORKER[{name}] Played {played} games')
+    return played
+
+
+async def run_coordinator(jobs: list[SelfPlayJob], host: str = '0.0.0.0', port: int = PORT, store: GameStore = None,
+                          lease_timeout: float = 30.0, on_result=None) -> SelfPlayReport:
+    coordinator = Coordinator(jobs, store, lease_timeout, on_result=on_result)
+    await coordinator.start(host, port)
+    try:
+        return await coordinator.wait()
+    finally:
+        await coordinator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Self-play with a coordinator and workers on other machines')
+    modes = parser.add_subparsers(dest='mode', required=True)
+    coordinator = modes.add_parser('coordinator', help='hand out the games and store the results')
+    coordinator.add_argument('--host', default='0.0.0.0')
+    coordinator.add_argument('--port', type=int, default=PORT)
+    coordinator.add_argument('--games', type=int, default=8)
+    coordinator.add_argument('--seed', type=int, default=None)
+    coordinator.add_argument('--black-depth', type=int, default=2)
+    coordinator.add_argument('--white-depth', type=int, default=2)
+    coordinator.add_argument('--opening-moves', type=int, default=2)
+    coordinator.add_argument('--max-moves', type=int, default=None)
+    coordinator.add_argument('--board-size', type=int, default=BOARD_SIZE)
+    coordinator.add_argument('--rule', choices=tuple(RULES), default='renju')
+    coordinator.add_argument('--lease-timeout', type=float, default=30.0,
+                             help='seconds without a message after which the jobs of a worker are reassigned')
+    coordinator.add_argument('--store', default='games', help='game store directory to write the games to')
+    worker = modes.add_parser('worker', help='play the games of a coordinator')
+    worker.add_argument('--host', default='127.0.0.1')
+    worker.add_argument('--port', type=int, default=PORT)
+    worker.add_argument('--processes', type=int, default=os.cpu_count())
+    worker.add_argument('--batch-size', type=int, default=8, help='games sent back at once')
+    worker.add_argument('--name', default=None)
+    args = parser.parse_args()
+
+    if args.mode == 'worker':
+        asyncio.run(run_worker(args.host, args.port, args.processes, args.batch_size, name=args.name))
+        return
+
+    jobs = make_jobs(
+        args.games,
+        EngineConfig(f'alphabeta-d{args.black_depth}', args.black_depth),
+        EngineConfig(f'alphabeta-d{args.white_depth}', args.white_depth),
+        args.seed, args.opening_moves, args.max_moves, args.board_size, args.rule,
+    )
+    with GameStore(args.store) as store:
+        report = asyncio.run(run_coordinator(jobs, args.host, args.port, store, args.lease_timeout))
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
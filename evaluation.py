@@ -0,0 +1,197 @@
+import json
+import os
+from functools import lru_cache
+
+from container import Move, Row
+from rule import BLACK, Rule
+from tables import line_windows
+
+SCORE_LENGTH = 6
+# rows counted by the heuristic sum of get_score, of the last player and of the player to move
+FEATURES = ('two', 'open_three', 'half_open_three', 'four', 'next_two', 'next_half_open_three')
+# weight of each feature, a fitted set is loaded from the file named by WEIGHTS_ENV, see tune.py
+WEIGHTS = (1, 100, 10, 150, 1, 100)
+WEIGHTS_ENV = 'GOMOKU_WEIGHTS'
+# priority of the fullest five-cell window through a position by its stones, see threat_priority
+THREAT_WEIGHTS = (0, 1, 20, 1000, 100000)
+# the move makes a four, or stops one of the opponent
+FOUR_THREAT = THREAT_WEIGHTS[3]
+
+
+# the heuristic sum of a score is clamped to this, so it never reaches into the tiers above it
+HEURISTIC_LIMIT = 2 ** 20
+HEURISTIC_BASE = 2 * HEURISTIC_LIMIT + 1
+
+
+@lru_cache(maxsize=None)
+def load_weights(path: str):
+    """
+    Weights of a file written by tune.py, in the order of FEATURES.
+    """
+    with open(path) as f:
+        weights = json.load(f)['weights']
+    missing = [feature for feature in FEATURES if feature not in weights]
+    if missing:
+        raise ValueError(f'Weights of {", ".join(missing)} missing in {path}')
+    return tuple(int(weights[feature]) for feature in FEATURES)
+
+
+def default_weights():
+    path = os.environ.get(WEIGHTS_ENV)
+    return load_weights(path) if path else WEIGHTS
+
+
+def initial_score():
+    return [0] * SCORE_LENGTH
+
+
+def pack_score(score: tuple):
+    """
+    One integer ordered like the score tuple. All elements but the last are tiers in -1..1, packed as balanced
+    base-3 digits above the heuristic sum in the last element. A tier of 1 outweighs every lower tier and the
+    heuristic together, since 3 ** k * HEURISTIC_BASE > sum(2 * 3 ** i * HEURISTIC_BASE for i < k) + 2 * HEURISTIC_LIMIT.
+    Packing is linear, so pack_score(-score) == -pack_score(score).
+    """
+    value = 0
+    for tier in score[:-1]:
+        value = value * 3 + tier
+    return value * HEURISTIC_BASE + max(-HEURISTIC_LIMIT, min(score[-1], HEURISTIC_LIMIT))
+
+
+def unpack_score(value: int, length: int = SCORE_LENGTH):
+    """
+    The score tuple of a packed score, for logging.
+    """
+    tiers, heuristic = divmod(value + HEURISTIC_LIMIT, HEURISTIC_BASE)
+    digits = []
+    for _ in range(length - 1):
+        tiers, digit = divmod(tiers + 1, 3)
+        digits.append(digit - 1)
+    return tuple(reversed(digits)) + (heuristic - HEURISTIC_LIMIT,)
+
+
+def tier_sign(value: int):
+    """
+    Sign of the tiers of a packed score, compared with all zero tiers.
+    """
+    return (value > HEURISTIC_LIMIT) - (value < -HEURISTIC_LIMIT)
+
+
+def get_score(board: list[list[int]], rule: Rule, last_move: Move, weights: tuple = WEIGHTS):
+    """
+    score(BLACK) - score(WHITE)
+    """
+    w_two, w_open_three, w_half_open_three, w_four, w_next_two, w_next_half_open_three = weights
+
+    if last_move is None:
+        return tuple(initial_score())
+    color = last_move.color
+
+    def get_rows(color):
+        twos: dict[tuple, Row] = dict()
+        threes: dict[tuple, Row] = dict()
+        fours: dict[tuple, Row] = dict()
+        for i in range(len(board)):
+            for j in range(len(board[i])):
+                if board[i][j] != color:
+                    continue
+                move = Move(i, j, color)
+                _twos, _threes, _fours = rule.get_rows(board, move)
+                for row in _twos:
+                    key = tuple(row.move_list)
+                    twos[key] = row
+                for row in _threes:
+                    key = tuple(row.move_list)
+                    threes[key] = row
+                for row in _fours:
+                    key = tuple(row.move_list)
+                    fours[key] = row
+        return twos, threes, fours
+
+    def get_this_score(color):
+        if rule.is_win(board, last_move):
+            return (1,) * SCORE_LENGTH
+        this_score = initial_score()
+        this_twos, this_threes, this_fours = get_rows(color)
+        this_score[-1] += w_two * len(this_twos)
+        cnt_open_three = 0
+        for row in this_threes.values():
+            if not rule.is_explicitly_closed_three(board, row, color) and rule.is_open_three(board, row, color):
+                this_score[-1] += w_open_three
+                cnt_open_three += 1
+            elif rule.is_half_open_three(board, row, color):
+                this_score[-1] += w_half_open_three
+        cnt_four = 0
+        cnt_open_four = 0
+        for row in this_fours.values():
+            if rule.is_four(board, row, color):
+                this_score[-1] += w_four
+                cnt_four += 1
+                if rule.is_open_four(board, row, color):
+                    cnt_open_four += 1
+        if color == BLACK and rule.has_fouls:
+            # double fours and double threes are fouls of black, only a four with an open three is a sure win
+            if cnt_open_four >= 1:
+                this_score[2] = 1
+            if cnt_open_three == 1 and cnt_four == 1:
+                this_score[4] = 1
+        else:
+            if cnt_open_four >= 1 or cnt_open_three + cnt_four >= 2:
+                if cnt_open_four >= 1 or cnt_four >= 2:
+                    this_score[2] = 1
+                else:
+                    this_score[4] = 1
+        return tuple(this_score)
+
+    def get_next_score(color):
+        next_score = initial_score()
+        next_twos, next_threes, next_fours = get_rows(color)
+        next_score[-1] += w_next_two * len(next_twos)
+        cnt_open_three = 0
+        for row in next_threes.values():
+            if rule.is_half_open_three(board, row, color):
+                next_score[-1] += w_next_half_open_three
+            if not rule.is_explicitly_closed_three(board, row, color) and rule.is_open_three(board, row, color):
+                cnt_open_three += 1
+        cnt_four = 0
+        for row in next_fours.values():
+            if rule.is_four(board, row, color):
+                cnt_four += 1
+        if cnt_open_three >= 1:
+            next_score[3] = 1
+        if cnt_four >= 1:
+            next_score[1] = 1
+        return tuple(next_score)
+
+    score = tuple(map(lambda x: color * (x[0] - x[1]), zip(get_this_score(color), get_next_score(-color))))
+    return score
+
+
+def threat_priority(board: list[list[int]], i: int, j: int, color: int):
+    """
+    Cheap priority of a blank position for move ordering. In each direction, the five-cell windows
+    through the position without a stone of the opponent count for attack, and those without a stone
+    of `color` count for defence, by their most stones. Attack weighs twice as much as defence.
+    """
+    windows = line_windows(len(board))[i * len(board) + j]
+    attack = 0
+    defence = 0
+    for direction_windows in windows:
+        own = other = 0
+        for window in direction_windows:
+            mine = theirs = 0
+            for wi, wj in window:
+                stone = board[wi][wj]
+                if stone == color:
+                    mine += 1
+                elif stone:
+                    theirs += 1
+            if theirs == 0:
+                if mine > own:
+                    own = mine
+            elif mine == 0:
+                if theirs > other:
+                    other = theirs
+        attack += THREAT_WEIGHTS[own]
+        defence += THREAT_WEIGHTS[other]
+    return 2 * attack + defence
@@ -1,15 +1,19 @@
 from container import Move
-from rule import IllegalMoveError, BOARD_SIZE, BLACK, BLANK, Rule, GomokuRule, RenjuRule, WHITE
+from rule import IllegalMoveError, BOARD_SIZE, MAX_BOARD_SIZE, MIN_BOARD_SIZE, BLACK, BLANK, Rule, GomokuRule, RenjuRule, WHITE
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, board_size: int = BOARD_SIZE, rule: Rule = None):
+        if not MIN_BOARD_SIZE <= board_size <= MAX_BOARD_SIZE:
+            raise ValueError(f'Board size {board_size} is not in {MIN_BOARD_SIZE}..{MAX_BOARD_SIZE}')
         self.winner = None
-        self.board: list[list[int]] = [[BLANK for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
+        self.board: list[list[int]] = [[BLANK for _ in range(board_size)] for _ in range(board_size)]
         self.moves = []
         self.next_turn = BLACK
         self.is_game_over = False
-        self.rule: Rule = RenjuRule()
+        self.rule: Rule = rule if rule is not None else RenjuRule()
+        # bumped by every change of the game, so a client can tell which snapshot it has
+        self.version = 0
 
     @property
     def last_move(self):
@@ -23,6 +27,7 @@ class Game:
         self.rule.is_legal_move(self.board, move, raise_exception=True)
         self.board[move.i][move.j] = move.color
         self.moves.append(move)
+        self.version += 1
         self.is_game_over = self.rule.is_win(self.board, move)
         if self.is_game_over:
             self.next_turn = None
@@ -33,12 +38,14 @@ class Game:
     def pass_move(self, color: int):
         if self.next_turn != color:
             raise IllegalMoveError('It\'s not valid turn.')
+        self.version += 1
         if (self.last_move and self.last_move.color == self.next_turn) or (not self.last_move and self.next_turn == WHITE):
             self.is_game_over = True
         else:
             self.next_turn = -self.next_turn
 
     def force_win(self, winner: int):
+        self.version += 1
         self.is_game_over = True
         self.next_turn = None
         self.winner = winner
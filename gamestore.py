@@ -0,0 +1,275 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+
+from container import Move
+from rule import BLACK, BOARD_SIZE, Rule
+
+INDEX_FILE = 'index.bin'
+RULE_VARIANTS = ('freestyle', 'standard', 'renju')
+
+# game id, started, finished, rule, board size, winner, bytes of moves, crc32 of the moves
+RECORD_HEADER = struct.Struct('<16sddBBbHI')
+# game id, finished, segment, offset, length
+INDEX_ENTRY = struct.Struct('<16sdIQI')
+
+
+def variant_of(rule: Rule):
+    return rule.variant or 'freestyle'
+
+
+def _move_width(board_size: int):
+    # one byte a move up to 15x15, the last value of the width marks a pass
+    return 1 if board_size * board_size < 0xFF else 2
+
+
+def encode_moves(moves: list[Move], board_size: int = BOARD_SIZE):
+    """
+    Positions of the moves in order. Colors alternate from black, so only passes are stored explicitly.
+    """
+    width = _move_width(board_size)
+    pass_value = (1 << (8 * width)) - 1
+    values = []
+    expected = BLACK
+    for move in moves:
+        if move.color != expected:
+            values.append(pass_value)
+            expected = -expected
+        values.append(move.i * board_size + move.j)
+        expected = -expected
+    return struct.pack(f'<{len(values)}{"B" if width == 1 else "H"}', *values)
+
+
+def decode_moves(data: bytes, board_size: int = BOARD_SIZE):
+    width = _move_width(board_size)
+    pass_value = (1 << (8 * width)) - 1
+    moves = []
+    color = BLACK
+    for value in struct.unpack(f'<{len(data) // width}{"B" if width == 1 else "H"}', data):
+        if value != pass_value:
+            moves.append(Move(value // board_size, value % board_size, color))
+        color = -color
+    return moves
+
+
+@dataclass
+class GameRecord:
+    game_id: str
+    moves: list[Move] = field(default_factory=list)
+    # None for a draw
+    winner: int = None
+    rule: str = 'renju'
+    started: float = 0.0
+    finished: float = 0.0
+    board_size: int = BOARD_SIZE
+
+    @classmethod
+    def from_game(cls, game_id: str, game, started: float = None, finished: float = None):
+        finished = time.time() if finished is None else finished
+        return cls(
+            game_id=game_id,
+            moves=list(game.moves),
+            winner=game.winner,
+            rule=variant_of(game.rule),
+            started=finished if started is None else started,
+            finished=finished,
+            board_size=len(game.board),
+        )
+
+    def encode(self):
+        moves = encode_moves(self.moves, self.board_size)
+        header = RECORD_HEADER.pack(
+            uuid.UUID(self.game_id).bytes, self.started, self.finished, RULE_VARIANTS.index(self.rule),
+            self.board_size, self.winner or 0, len(moves), zlib.crc32(moves),
+        )
+        return header + moves
+
+    @classmethod
+    def decode(cls, data):
+        game_id, started, finished, rule, board_size, winner, length, crc = RECORD_HEADER.unpack_from(data)
+        moves = data[RECORD_HEADER.size:RECORD_HEADER.size + length]
+        if len(moves) != length or zlib.crc32(moves) != crc:
+            raise ValueError(f'Corrupt game record {uuid.UUID(bytes=game_id)}')
+        return cls(
+            game_id=str(uuid.UUID(bytes=game_id)),
+            moves=decode_moves(moves, board_size),
+            winner=winner or None,
+            rule=RULE_VARIANTS[rule],
+            started=started,
+            finished=finished,
+            board_size=board_size,
+        )
+
+
+@dataclass
+class IndexEntry:
+    game_id: str
+    finished: float
+    segment: int
+    offset: int
+    length: int
+
+
+class GameStore:
+    """
+    Append-only log of finished games in segment files of at most `segment_size` bytes, with an index file
+    of fixed-size entries mapping the game id and finish time to the record. Writes are fsynced in batches,
+    after `sync_every` games or once `sync_interval` seconds passed since the last sync. Reads use mmap.
+    Appending blocks on disk io, call it off the event loop.
+    """
+
+    def __init__(self, path: str, segment_size: int = 64 * 2 ** 20, sync_every: int = 64, sync_interval: float = 1.0):
+        self.path = path
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.entries: list[IndexEntry] = []
+        self.by_id: dict[str, IndexEntry] = dict()
+        self._finished: list[float] = []
+        self._maps: dict[int, mmap.mmap] = dict()
+        self._recover()
+        self._index = open(self._index_path, 'ab')
+        self._segment = None
+        self._segment_id = self.entries[-1].segment if self.entries else 0
+        self._open_segment(self._segment_id)
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.path, INDEX_FILE)
+
+    def _segment_path(self, segment: int):
+        return os.path.join(self.path, f'segment-{segment:05d}.log')
+
+    def _recover(self):
+        """
+        Load the index, dropping the entries of records that did not reach the disk,
+        and empty the segments after the last indexed record.
+        """
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, 'rb') as f:
+            data = f.read()
+        for offset in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            game_id, finished, segment, position, length = INDEX_ENTRY.unpack_from(data, offset)
+            entry = IndexEntry(str(uuid.UUID(bytes=game_id)), finished, segment, position, length)
+            segment_path = self._segment_path(segment)
+            if not os.path.exists(segment_path) or os.path.getsize(segment_path) < position + length:
+                break
+            self._add_entry(entry)
+        if len(self.entries) * INDEX_ENTRY.size != len(data):
+            with open(self._index_path, 'r+b') as f:
+                f.truncate(len(self.entries) * INDEX_ENTRY.size)
+        last = self.entries[-1] if self.entries else IndexEntry('', 0.0, 0, 0, 0)
+        segment = last.segment
+        while os.path.exists(self._segment_path(segment)):
+            with open(self._segment_path(segment), 'r+b') as f:
+                f.truncate(last.offset + last.length if segment == last.segment else 0)
+            segment += 1
+
+    def _add_entry(self, entry: IndexEntry):
+        self.entries.append(entry)
+        self.by_id[entry.game_id] = entry
+        self._finished.append(entry.finished)
+
+    def _open_segment(self, segment: int):
+        if self._segment is not None:
+            self._sync()
+            self._segment.close()
+        self._segment_id = segment
+        self._segment = open(self._segment_path(segment), 'ab')
+
+    def append(self, record: GameRecord):
+        data = record.encode()
+        with self._lock:
+            if self._segment.tell() and self._segment.tell() + len(data) > self.segment_size:
+                self._open_segment(self._segment_id + 1)
+            entry = IndexEntry(record.game_id, record.finished, self._segment_id, self._segment.tell(), len(data))
+            self._segment.write(data)
+            self._index.write(INDEX_ENTRY.pack(uuid.UUID(entry.game_id).bytes, entry.finished, entry.segment, entry.offset, entry.length))
+            self._add_entry(entry)
+            self._pending += 1
+            if self._pending >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        # the records before the index, so an indexed record is always on disk
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        self._index.flush()
+        os.fsync(self._index.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._segment.close()
+            self._index.close()
+            for view in self._maps.values():
+                view.close()
+            self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, game_id: str):
+        return game_id in self.by_id
+
+    def _view(self, entry: IndexEntry):
+        view = self._maps.get(entry.segment)
+        if view is None or len(view) < entry.offset + entry.length:
+            if entry.segment == self._segment_id:
+                with self._lock:
+                    self._segment.flush()
+            if view is not None:
+                view.close()
+            with open(self._segment_path(entry.segment), 'rb') as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[entry.segment] = view
+        return view
+
+    def read(self, entry: IndexEntry):
+        view = self._view(entry)
+        return GameRecord.decode(view[entry.offset:entry.offset + entry.length])
+
+    def get(self, game_id: str):
+        return self.read(self.by_id[game_id])
+
+    def entries_between(self, start: float = None, end: float = None):
+        """
+        Index entries of the games finished in [start, end). Games are appended as they finish,
+        so the entries are in the order of their finish time.
+        """
+        lo = 0 if start is None else bisect.bisect_left(self._finished, start)
+        hi = len(self._finished) if end is None else bisect.bisect_left(self._finished, end)
+        return self.entries[lo:hi]
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def iter_records(self, start: float = None, end: float = None):
+        """
+        Streams the records in the order they were stored, reading only one record at a time.
+        """
+        for entry in self.entries_between(start, end):
+            yield self.read(entry)
@@ -1,14 +1,62 @@
-import asyncio
+import argparse
 
-from arena import AIVAIArena
+from dataset import DatasetWriter
+from gamestore import GameStore
+from rule import BOARD_SIZE, RULES
+from selfplay import EngineConfig, run_self_play
 
 
-async def new_arena():
-    arena = AIVAIArena()
-    await arena.start_game()
-    # TODO
+def main():
+    parser = argparse.ArgumentParser(description='Headless AI vs AI self-play')
+    parser.add_argument('--games', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--black-depth', type=int, default=2)
+    parser.add_argument('--white-depth', type=int, default=2)
+    parser.add_argument('--opening-moves', type=int, default=2)
+    parser.add_argument('--max-moves', type=int, default=None)
+    parser.add_argument('--board-size', type=int, default=BOARD_SIZE)
+    parser.add_argument('--rule', choices=tuple(RULES), default='renju')
+    parser.add_argument('--output', default=None, help='directory to write the dataset shards to')
+    parser.add_argument('--shard-size', type=int, default=65536)
+    parser.add_argument('--augment', action='store_true', help='store all 8 symmetries of each position')
+    parser.add_argument('--from-store', default=None, help='write the games stored by the server instead of playing')
+    args = parser.parse_args()
+
+    writer = DatasetWriter(args.output, args.shard_size, args.augment, args.board_size) if args.output else None
+
+    if args.from_store:
+        with GameStore(args.from_store) as store:
+            for record in store:
+                if writer is not None and record.board_size == writer.board_size:
+                    writer.add_game(record.moves, record.winner)
+            print(f'{len(store)} stored games')
+        if writer is not None:
+            writer.close()
+        return
+
+    def on_result(result):
+        print(f'Game[{result.seed}] {len(result.moves)} moves, winner {result.winner}, {result.elapsed:.2f}s')
+        if writer is not None:
+            writer.add_game(result.moves, result.winner, result.move_scores)
+
+    report = run_self_play(
+        args.games,
+        black=EngineConfig(f'alphabeta-d{args.black_depth}', args.black_depth),
+        white=EngineConfig(f'alphabeta-d{args.white_depth}', args.white_depth),
+        seed=args.seed,
+        processes=args.processes,
+        opening_moves=args.opening_moves,
+        max_moves=args.max_moves,
+        on_result=on_result,
+        board_size=args.board_size,
+        rule=args.rule,
+    )
+    if writer is not None:
+        writer.close()
+    print(report)
 
 
 if __name__ == '__main__':
     print('Learning mode')
-    asyncio.run(new_arena())
+    main()
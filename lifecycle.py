@@ -0,0 +1,155 @@
+import asyncio
+import math
+import time
+
+from arena import Arena
+from metrics import ARENAS_EXPIRED
+
+EMPTY = 'empty'
+WAITING = 'waiting'
+PLAYING = 'playing'
+FINISHED = 'finished'
+STATES = (EMPTY, WAITING, PLAYING, FINISHED)
+
+
+class ArenaLimitError(ValueError):
+    pass
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel of `slots` buckets `tick` seconds apart. Scheduling and cancelling are O(1),
+    a deadline more than one turn away stays in its bucket until the wheel comes around again.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, now: float = 0.0):
+        self.tick = tick
+        self.slots: list[dict] = [dict() for _ in range(slots)]
+        self.start = now
+        self.ticks = 0
+        self._slot_of = dict()
+
+    @property
+    def time(self):
+        return self.start + self.ticks * self.tick
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def schedule(self, key, deadline: float):
+        self.cancel(key)
+        ticks = max(math.ceil((deadline - self.time) / self.tick), 1)
+        slot = (self.ticks + ticks) % len(self.slots)
+        self.slots[slot][key] = deadline
+        self._slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now: float):
+        """
+        Turn the wheel up to `now`, returns the keys whose deadline passed.
+        """
+        expired = []
+        while self.time + self.tick <= now:
+            self.ticks += 1
+            bucket = self.slots[self.ticks % len(self.slots)]
+            for key, deadline in list(bucket.items()):
+                if deadline <= self.time:
+                    del bucket[key]
+                    del self._slot_of[key]
+                    expired.append(key)
+        return expired
+
+
+class ArenaLifecycle:
+    """
+    Expires arenas of the registry that stay in one state without activity for too long, and caps their number.
+    Empty arenas are removed, waiting arenas send their agents away, and idle games end without a winner.
+    """
+
+    def __init__(self, arenas: dict[str, Arena], max_arenas: int = 1000, empty_timeout: float = 60.0,
+                 waiting_timeout: float = 600.0, idle_timeout: float = 1800.0, tick: float = 1.0,
+                 on_remove=None, clock=time.monotonic):
+        self.arenas = arenas
+        self.max_arenas = max_arenas
+        self.timeouts = {EMPTY: empty_timeout, WAITING: waiting_timeout, PLAYING: idle_timeout, FINISHED: empty_timeout}
+        self.on_remove = on_remove
+        self.clock = clock
+        self.wheel = TimerWheel(tick, now=clock())
+
+    @staticmethod
+    def state_of(arena: Arena):
+        if arena.game.is_game_over:
+            return FINISHED
+        if arena.is_game_started:
+            return PLAYING
+        return WAITING if arena.agents or arena.spectators else EMPTY
+
+    def counts(self):
+        counts = dict.fromkeys(STATES, 0)
+        for arena in self.arenas.values():
+            counts[self.state_of(arena)] += 1
+        return counts
+
+    def _schedule(self, arena: Arena, now: float = None):
+        # the state can change to one with a shorter timeout before the timer runs out,
+        # so arenas are checked again at least every shortest timeout
+        now = self.clock() if now is None else now
+        deadline = arena.last_active + self.timeouts[self.state_of(arena)]
+        self.wheel.schedule(arena.arena_id, min(deadline, now + min(self.timeouts.values())))
+
+    def add(self, arena: Arena):
+        if len(self.arenas) >= self.max_arenas and not self._evict_empty():
+            raise ArenaLimitError(f'No more than {self.max_arenas} arenas')
+        self.arenas[arena.arena_id] = arena
+        self._schedule(arena)
+
+    def _evict_empty(self):
+        empty = [arena for arena in self.arenas.values() if self.state_of(arena) == EMPTY]
+        if not empty:
+            return False
+        self.remove(min(empty, key=lambda arena: arena.last_active).arena_id)
+        return True
+
+    def remove(self, arena_id: str):
+        self.wheel.cancel(arena_id)
+        arena = self.arenas.pop(arena_id, None)
+        if arena is not None and self.on_remove is not None:
+            self.on_remove(arena)
+        return arena
+
+    def tick(self, now: float = None):
+        """
+        Expire the arenas whose timer ran out. Returns the ids of the expired arenas.
+        """
+        now = self.clock() if now is None else now
+        expired = []
+        for arena_id in self.wheel.advance(now):
+            arena = self.arenas.get(arena_id)
+            if arena is None:
+                continue
+            state = self.state_of(arena)
+            if arena.last_active + self.timeouts[state] > now:
+                # active since the timer was set, or in another state now
+                self._schedule(arena, now)
+                continue
+            print(f'Arena[{arena_id[:6]}] Expired, {state}')
+            ARENAS_EXPIRED.inc(state=state)
+            expired.append(arena_id)
+            if state == PLAYING:
+                # ends the game, the arena is removed once it is finished
+                arena.close()
+                self.wheel.schedule(arena_id, now + self.timeouts[FINISHED])
+                continue
+            if state == WAITING:
+                arena.close()
+            self.remove(arena_id)
+        return expired
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            self.tick()
@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from random import Random
+
+import websockets
+
+from rule import BLANK
+
+
+def rss_of(pid: int):
+    """
+    Resident set size of a process in bytes, from /proc. None where it is not available.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: list[float], p: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+@dataclass
+class LoadReport:
+    clients: int = 0
+    failed_clients: int = 0
+    elapsed: float = 0.0
+    connect_times: list[float] = field(default_factory=list)
+    move_latencies: list[float] = field(default_factory=list)
+    messages_sent: int = 0
+    messages_received: int = 0
+    games_finished: int = 0
+    # (seconds since the start, bytes)
+    rss: list[tuple[float, int]] = field(default_factory=list)
+
+    @property
+    def messages_per_second(self):
+        return (self.messages_sent + self.messages_received) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return dict(
+            clients=self.clients,
+            failed_clients=self.failed_clients,
+            elapsed=self.elapsed,
+            connect_p50=percentile(self.connect_times, 50),
+            connect_p99=percentile(self.connect_times, 99),
+            moves=len(self.move_latencies),
+            move_p50=percentile(self.move_latencies, 50),
+            move_p90=percentile(self.move_latencies, 90),
+            move_p99=percentile(self.move_latencies, 99),
+            messages_sent=self.messages_sent,
+            messages_received=self.messages_received,
+            messages_per_second=self.messages_per_second,
+            games_finished=self.games_finished,
+            rss_max=max((rss for _, rss in self.rss), default=None),
+            rss=self.rss,
+        )
+
+    def __str__(self):
+        s = self.summary()
+        lines = [
+            f'{s["clients"]} clients ({s["failed_clients"]} failed) in {s["elapsed"]:.1f}s, {s["games_finished"]} games finished',
+            f'connect: p50 {s["connect_p50"] * 1000:.1f}ms p99 {s["connect_p99"] * 1000:.1f}ms',
+            f'move round trip: {s["moves"]} moves, p50 {s["move_p50"] * 1000:.1f}ms p90 {s["move_p90"] * 1000:.1f}ms p99 {s["move_p99"] * 1000:.1f}ms',
+            f'messages: {s["messages_sent"]} sent, {s["messages_received"]} received, {s["messages_per_second"]:.0f}/s',
+        ]
+        if self.rss:
+            lines.append('rss: ' + ', '.join(f'{t:.0f}s {rss / 2 ** 20:.1f}MB' for t, rss in self.rss))
+        return '\n'.join(lines)
+
+
+class Client:
+    """
+    One simulated websocket client. Plays random moves near the stones on the board when it is asked for a move.
+    """
+
+    def __init__(self, url: str, report: LoadReport, random: Random, max_moves: int, think_time: float):
+        self.url = url
+        self.report = report
+        self.random = random
+        self.max_moves = max_moves
+        self.think_time = think_time
+        self.websocket = None
+        self.moves = 0
+        self._move_sent_at = None
+
+    async def connect(self):
+        start = time.perf_counter()
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        # the server greets every connection with the arena list
+        await self.receive()
+        self.report.connect_times.append(time.perf_counter() - start)
+
+    async def send(self, type: str, data: any = None):
+        await self.websocket.send(json.dumps(dict(type=type, data=data)))
+        self.report.messages_sent += 1
+
+    async def receive(self):
+        message = json.loads(await self.websocket.recv())
+        self.report.messages_received += 1
+        if self._move_sent_at is not None and message['type'] in ('GAME_STATE', 'REQUEST_MOVE'):
+            # the answer to our move, or a new request when the move was illegal
+            self.report.move_latencies.append(time.perf_counter() - self._move_sent_at)
+            self._move_sent_at = None
+        return message
+
+    def choose_move(self, board: list[list[int]]):
+        size = len(board)
+        stones = [(i, j) for i in range(size) for j in range(size) if board[i][j] != BLANK]
+        if not stones:
+            return size // 2, size // 2
+        for _ in range(100):
+            si, sj = self.random.choice(stones)
+            i, j = si + self.random.randint(-2, 2), sj + self.random.randint(-2, 2)
+            if 0 <= i < size and 0 <= j < size and board[i][j] == BLANK:
+                return i, j
+        return self.random.choice([(i, j) for i in range(size) for j in range(size) if board[i][j] == BLANK])
+
+    async def play(self, on_arena_state=None):
+        """
+        Answers move requests until the game is over or the client made `max_moves` moves.
+        """
+        while True:
+            message = await self.receive()
+            if message['type'] == 'ARENA_STATE' and on_arena_state is not None:
+                on_arena_state(message['data'])
+            elif message['type'] in ('GAME_STATE', 'REQUEST_MOVE') and message['data']['isGameOver']:
+                self.report.games_finished += 1
+                return
+            elif message['type'] == 'REQUEST_MOVE':
+                if self.moves >= self.max_moves:
+                    return
+                if self.think_time:
+                    await asyncio.sleep(self.think_time)
+                i, j = self.choose_move(message['data']['board'])
+                self._move_sent_at = time.perf_counter()
+                self.moves += 1
+                await self.send('MOVE', dict(i=i, j=j))
+
+    async def watch(self, until: float):
+        while time.perf_counter() < until:
+            try:
+                message = await asyncio.wait_for(self.receive(), until - time.perf_counter())
+            except asyncio.TimeoutError:
+                return
+            if message['type'] == 'GAME_STATE' and message['data']['isGameOver']:
+                return
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+
+
+async def run_client(report: LoadReport, scenario):
+    report.clients += 1
+    try:
+        await scenario()
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+        print(f'LOADGEN Client failed: {e!r}', file=sys.stderr)
+        report.failed_clients += 1
+
+
+async def human_vs_ai(url, report, random, max_moves, think_time):
+    client = Client(url, report, random, max_moves, think_time)
+    try:
+        await client.connect()
+        await client.send('CREATE_ARENA', dict(title='load human vs ai', players=1, spectator=False))
+        await client.play()
+    finally:
+        await client.close()
+
+
+async def human_vs_human(url, report, random, max_moves, think_time, spectators, duration):
+    """
+    The first client creates an arena, the second enters it when the arena id is known,
+    and the spectators watch it until the game is over or the run ends.
+    """
+    arena_id = asyncio.get_running_loop().create_future()
+
+    def on_arena_state(state):
+        if not arena_id.done():
+            arena_id.set_result(state['id'])
+
+    async def creator():
+        client = Client(url, report, random, max_moves, think_time)
+        try:
+            await client.connect()
+            await client.send('CREATE_ARENA', dict(title='load human vs human', players=2, spectator=True))
+            await client.play(on_arena_state)
+        finally:
+            await client.close()
+
+    async def opponent():
+        client = Client(url, report, random, max_moves, think_time)
+        try:
+            await client.connect()
+            await client.send('ENTER_ARENA', dict(id=await asyncio.wait_for(asyncio.shield(arena_id), duration)))
+            await client.play()
+        finally:
+            await client.close()
+
+    async def spectator():
+        client = Client(url, report, random, max_moves, think_time)
+        try:
+            await client.connect()
+            await client.send('SPECTATE_ARENA', dict(id=await asyncio.wait_for(asyncio.shield(arena_id), duration)))
+            await client.watch(time.perf_counter() + duration)
+        finally:
+            await client.close()
+
+    await asyncio.gather(
+        run_client(report, creator),
+        run_client(report, opponent),
+        *(run_client(report, spectator) for _ in range(spectators)),
+    )
+
+
+async def sample_rss(report: LoadReport, pid: int, start: float, interval: float):
+    while True:
+        rss = rss_of(pid)
+        if rss is not None:
+            report.rss.append((time.perf_counter() - start, rss))
+        await asyncio.sleep(interval)
+
+
+async def run_load(url: str, ai_arenas=2, pvp_arenas=4, spectators=4, max_moves=20, think_time=0.05,
+                   duration=60.0, ramp_up=1.0, server_pid: int = None, rss_interval=1.0, seed: int = None):
+    """
+    Runs the arenas against the server at `url` at once, starting the clients evenly over `ramp_up` seconds.
+    A client stops after `max_moves` moves, and every client is stopped after `duration` seconds.
+    """
+    report = LoadReport()
+    random = Random(seed)
+    start = time.perf_counter()
+    sampler = asyncio.create_task(sample_rss(report, server_pid, start, rss_interval)) if server_pid else None
+
+    scenarios = [
+        lambda: run_client(report, lambda: human_vs_ai(url, report, random, max_moves, think_time))
+        for _ in range(ai_arenas)
+    ] + [
+        lambda: human_vs_human(url, report, random, max_moves, think_time, spectators, duration)
+        for _ in range(pvp_arenas)
+    ]
+    random.shuffle(scenarios)
+
+    async def delayed(index, scenario):
+        await asyncio.sleep(ramp_up * index / max(len(scenarios), 1))
+        await scenario()
+
+    tasks = [asyncio.create_task(delayed(index, scenario)) for index, scenario in enumerate(scenarios)]
+    done, pending = await asyncio.wait(tasks, timeout=duration) if tasks else (set(), set())
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    report.elapsed = time.perf_counter() - start
+    if sampler is not None:
+        sampler.cancel()
+        rss = rss_of(server_pid)
+        if rss is not None:
+            report.rss.append((report.elapsed, rss))
+    return report
+
+
+def _serve(host: str, port: int):
+    # the server logs every message, which would only measure the terminal
+    sys.stdout = open(os.devnull, 'w')
+    import server
+    asyncio.run(server.serve(host, port))
+
+
+def start_local_server(host: str, port: int):
+    process = multiprocessing.Process(target=_serve, args=(host, port), daemon=True)
+    process.start()
+    return process
+
+
+async def wait_for_server(host: str, port: int, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated websocket clients against the gomoku server')
+    parser.add_argument('--url', default=None, help='server to load, a local server on --port is started if omitted')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--pid', type=int, default=None, help='pid of the server at --url, to sample its RSS')
+    parser.add_argument('--ai-arenas', type=int, default=10, help='arenas of one client against the AI')
+    parser.add_argument('--pvp-arenas', type=int, default=20, help='arenas of two clients against each other')
+    parser.add_argument('--spectators', type=int, default=5, help='spectators of each client arena')
+    parser.add_argument('--max-moves', type=int, default=30, help='moves of a client before it leaves')
+    parser.add_argument('--think-time', type=float, default=0.05, help='seconds before a client answers a move request')
+    parser.add_argument('--duration', type=float, default=60.0)
+    parser.add_argument('--ramp-up', type=float, default=5.0)
+    parser.add_argument('--rss-interval', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default=None, help='also write the summary as JSON to this file')
+    args = parser.parse_args()
+
+    process = None
+    url, pid = args.url, args.pid
+    if url is None:
+        process = start_local_server('127.0.0.1', args.port)
+        url, pid = f'ws://127.0.0.1:{args.port}', process.pid
+
+    async def run():
+        if process is not None:
+            await wait_for_server('127.0.0.1', args.port)
+        return await run_load(
+            url, args.ai_arenas, args.pvp_arenas, args.spectators, args.max_moves, args.think_time,
+            args.duration, args.ramp_up, pid, args.rss_interval, args.seed,
+        )
+
+    try:
+        report = asyncio.run(run())
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report.summary(), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+from __future__ import annotations
+import math
+
+import numpy as np
+
+from agent import Agent
+from container import GameState, Move
+from batch_evaluation import batch_scores
+from evaluation import SCORE_LENGTH
+from rule import BLANK, Rule
+from watchdog import run_off_loop
+
+# value of each tier of the score tuple from get_score, the last tier is the heuristic sum
+TIER_VALUES = (1.0, 0.9, 0.8, 0.7, 0.6)
+HEURISTIC_SCALE = 300
+
+
+def candidate_moves(board: list[list[int]], radius=2):
+    """
+    Blank positions within `radius` of any stone, with their chebyshev distance to the nearest stone.
+    Legality is not checked here, the search checks a move only when it is first selected.
+    """
+    size = len(board)
+    distance = dict()
+    for i in range(size):
+        for j in range(size):
+            if board[i][j] == BLANK:
+                continue
+            for ii in range(max(i - radius, 0), min(i + radius + 1, size)):
+                for jj in range(max(j - radius, 0), min(j + radius + 1, size)):
+                    if board[ii][jj] == BLANK:
+                        d = max(abs(i - ii), abs(j - jj))
+                        if distance.get((ii, jj), radius + 1) > d:
+                            distance[(ii, jj)] = d
+    if not distance and board[size // 2][size // 2] == BLANK:
+        distance[(size // 2, size // 2)] = 0
+    return distance
+
+
+class HeuristicEvaluator:
+    """
+    Values the positions of a batch with batch_scores and spreads the prior over the candidates by their distance to the stones.
+    """
+
+    def __call__(self, positions: list[tuple[list[list[int]], int, Move, dict]], rule: Rule):
+        results = []
+        scores = batch_scores([board for board, _, _, _ in positions], [last_move for _, _, last_move, _ in positions], rule)
+        for (board, turn, last_move, candidates), score in zip(positions, scores):
+            priors = {pos: 2.0 if d <= 1 else 1.0 for pos, d in candidates.items()}
+            total = sum(priors.values())
+            priors = {pos: p / total for pos, p in priors.items()}
+            results.append((priors, turn * score_value(tuple(int(x) for x in score))))
+        return results
+
+
+def score_value(score: tuple):
+    """
+    Map a score tuple of get_score to [-1, 1], score(BLACK) - score(WHITE).
+    """
+    for tier, value in zip(score, TIER_VALUES):
+        if tier:
+            return value * tier
+    return 0.5 * math.tanh(score[-1] / HEURISTIC_SCALE)
+
+
+def search_value(score: tuple):
+    """
+    Map a score tuple of the search of AIAgent, wins by ply followed by a score of get_score, to [-1, 1] for black.
+    """
+    for tier in score[:-SCORE_LENGTH]:
+        if tier:
+            return float(tier)
+    return score_value(score[-SCORE_LENGTH:])
+
+
+class NumpyPolicyValueNet:
+    """
+    Two-layer policy/value network evaluated on CPU with NumPy over a whole batch of positions.
+    Input planes are the stones of the player to move, the stones of the opponent and a constant plane.
+    """
+
+    def __init__(self, board_size=15, hidden=128, weights: str = None, seed: int = None):
+        self.board_size = board_size
+        if weights is not None:
+            params = np.load(weights)
+            self.w1, self.b1, self.wp, self.bp, self.wv, self.bv = (params[k] for k in ('w1', 'b1', 'wp', 'bp', 'wv', 'bv'))
+        else:
+            rng = np.random.default_rng(seed)
+            inputs = 3 * board_size * board_size
+            self.w1 = rng.normal(0, 1 / math.sqrt(inputs), (inputs, hidden)).astype(np.float32)
+            self.b1 = np.zeros(hidden, dtype=np.float32)
+            self.wp = rng.normal(0, 1 / math.sqrt(hidden), (hidden, board_size * board_size)).astype(np.float32)
+            self.bp = np.zeros(board_size * board_size, dtype=np.float32)
+            self.wv = rng.normal(0, 1 / math.sqrt(hidden), (hidden, 1)).astype(np.float32)
+            self.bv = np.zeros(1, dtype=np.float32)
+
+    def save(self, path: str):
+        np.savez(path, w1=self.w1, b1=self.b1, wp=self.wp, bp=self.bp, wv=self.wv, bv=self.bv)
+
+    def forward(self, boards: np.ndarray, turns: np.ndarray):
+        """
+        boards: (batch, size, size) int8, turns: (batch,) -> logits (batch, size * size), values (batch,)
+        """
+        own = boards == turns[:, None, None]
+        opponent = boards == -turns[:, None, None]
+        planes = np.stack([own, opponent, np.ones_like(own)], axis=1).reshape(len(boards), -1).astype(np.float32)
+        hidden = np.maximum(planes @ self.w1 + self.b1, 0)
+        return hidden @ self.wp + self.bp, np.tanh(hidden @ self.wv + self.bv)[:, 0]
+
+    def __call__(self, positions: list[tuple[list[list[int]], int, Move, dict]], rule: Rule):
+        boards = np.array([board for board, _, _, _ in positions], dtype=np.int8)
+        turns = np.array([turn for _, turn, _, _ in positions], dtype=np.int8)
+        logits, values = self.forward(boards, turns)
+        results = []
+        for (_, _, _, candidates), logit, value in zip(positions, logits, values):
+            if not candidates:
+                results.append((dict(), float(value)))
+                continue
+            moves = list(candidates)
+            masked = logit[[i * self.board_size + j for i, j in moves]]
+            p = np.exp(masked - masked.max())
+            p /= p.sum()
+            results.append((dict(zip(moves, p.tolist())), float(value)))
+        return results
+
+
+class Node:
+    __slots__ = ('parent', 'move', 'prior', 'children', 'visits', 'value_sum', 'virtual_loss', 'terminal_value', 'checked')
+
+    def __init__(self, parent: Node = None, move: Move = None, prior: float = 1.0):
+        self.parent = parent
+        self.move = move
+        self.prior = prior
+        self.children: dict[tuple[int, int], Node] = None
+        self.visits = 0
+        # sum of values from the view of the player who played `move`
+        self.value_sum = 0.0
+        self.virtual_loss = 0
+        self.terminal_value = None
+        self.checked = False
+
+    @property
+    def is_expanded(self):
+        return self.children is not None
+
+    def q(self):
+        visits = self.visits + self.virtual_loss
+        if visits == 0:
+            return 0.0
+        return (self.value_sum - self.virtual_loss) / visits
+
+    def select(self, c_puct: float):
+        sqrt_visits = math.sqrt(self.visits + self.virtual_loss + 1)
+        return max(
+            self.children.values(),
+            key=lambda child: child.q() + c_puct * child.prior * sqrt_visits / (1 + child.visits + child.virtual_loss),
+        )
+
+
+class MCTSAgent(Agent):
+    """
+    PUCT Monte Carlo Tree Search. Leaves are collected under virtual loss and evaluated in batches of `batch_size`.
+    The subtree of the played move is kept for the next search.
+    """
+
+    def __init__(self, simulations=400, batch_size=8, c_puct=1.5, evaluator=None, verbose=True):
+        super(MCTSAgent, self).__init__()
+        self.simulations = simulations
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.evaluator = evaluator or HeuristicEvaluator()
+        self.verbose = verbose
+        self.root: Node = None
+        self.root_board: list[list[int]] = None
+        self.last_nodes = 0
+
+    async def request_move(self, state: GameState):
+        type, data = await run_off_loop(self.select_move, state.board, self.arena.game.rule, state.last_move)
+        self.put_event(type, data)
+
+    def select_move(self, board, rule, last_move: Move = None):
+        from arena import Arena
+        root = self._reuse_root(board)
+        self._search(root, board, rule, last_move)
+        if not root.children:
+            self.root = None
+            return Arena.PASS, None
+        best = max(root.children.values(), key=lambda child: (child.checked, child.visits))
+        if not best.checked and not rule.is_legal_move(board, best.move):
+            self.root = None
+            return Arena.PASS, None
+        if self.verbose:
+            print(f'MCTS {self.last_nodes} simulations, best {best.move} visits {best.visits} q {best.q():.3f}')
+        self._advance_root(board, best)
+        return Arena.MOVE, Move(best.move.i, best.move.j, self.color)
+
+    def _reuse_root(self, board: list[list[int]]):
+        """
+        Find the subtree of the opponent's reply to our last move, or start a new tree.
+        """
+        if self.root is not None and self.root_board is not None and self.root.children:
+            diff = [
+                (i, j) for i in range(len(board)) for j in range(len(board[i]))
+                if board[i][j] != self.root_board[i][j]
+            ]
+            if len(diff) == 1 and diff[0] in self.root.children and board[diff[0][0]][diff[0][1]] == -self.color:
+                root = self.root.children[diff[0]]
+                root.parent = None
+                return root
+        return Node()
+
+    def _advance_root(self, board: list[list[int]], best: Node):
+        self.root = best
+        best.parent = None
+        self.root_board = [row[:] for row in board]
+        self.root_board[best.move.i][best.move.j] = self.color
+
+    def _search(self, root: Node, board: list[list[int]], rule: Rule, last_move: Move):
+        self.last_nodes = 0
+        if not root.is_expanded:
+            self._expand(rule, [(root, [row[:] for row in board], self.color, last_move)])
+        while self.last_nodes < self.simulations and root.children:
+            leaves = []
+            for _ in range(min(self.batch_size, self.simulations - self.last_nodes)):
+                node, leaf_board, turn = self._select_leaf(root, board, rule, self.color)
+                if node.terminal_value is not None:
+                    self.last_nodes += 1
+                    self._backup(node, node.terminal_value)
+                elif any(node is leaf[0] for leaf in leaves):
+                    # collision with a leaf already waiting in this batch
+                    self._backup(node, None)
+                    break
+                else:
+                    self.last_nodes += 1
+                    leaves.append((node, leaf_board, turn, node.move))
+            for node, value in zip([leaf[0] for leaf in leaves], self._expand(rule, leaves)):
+                self._backup(node, value)
+
+    def _select_leaf(self, root: Node, board: list[list[int]], rule: Rule, turn: int):
+        node = root
+        leaf_board = [row[:] for row in board]
+        node.virtual_loss += 1
+        while node.is_expanded and node.terminal_value is None:
+            child = node.select(self.c_puct)
+            if not child.checked:
+                if not rule.is_legal_move(leaf_board, child.move):
+                    del node.children[(child.move.i, child.move.j)]
+                    if not node.children:
+                        # no legal move left, the game is drawn
+                        node.terminal_value = 0.0
+                    continue
+                child.checked = True
+            node = child
+            leaf_board[node.move.i][node.move.j] = turn
+            turn = -turn
+            node.virtual_loss += 1
+        return node, leaf_board, turn
+
+    def _expand(self, rule: Rule, leaves: list[tuple[Node, list[list[int]], int, Move]]):
+        """
+        Expand the leaves with one batched evaluator call.
+        Returns the value of each leaf from the view of the player who moved into it.
+        """
+        values = [None] * len(leaves)
+        positions = []
+        expanded = []
+        for index, (node, leaf_board, turn, last_move) in enumerate(leaves):
+            if last_move is not None and rule.is_win(leaf_board, last_move):
+                node.terminal_value = 1.0
+            else:
+                candidates = candidate_moves(leaf_board)
+                if candidates:
+                    positions.append((leaf_board, turn, last_move, candidates))
+                    expanded.append(index)
+                    continue
+                node.terminal_value = 0.0
+            node.children = dict()
+            values[index] = node.terminal_value
+        if positions:
+            for index, (priors, value) in zip(expanded, self.evaluator(positions, rule)):
+                node, _, turn, _ = leaves[index]
+                node.children = {pos: Node(node, Move(*pos, turn), prior) for pos, prior in priors.items()}
+                values[index] = -value
+        return values
+
+    @staticmethod
+    def _backup(node: Node, value: float = None):
+        """
+        Remove the virtual loss along the path and, unless value is None, add the value.
+        """
+        while node is not None:
+            node.virtual_loss = max(node.virtual_loss - 1, 0)
+            if value is not None:
+                node.visits += 1
+                node.value_sum += value
+                value = -value
+            node = node.parent
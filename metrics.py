@@ -0,0 +1,140 @@
+import math
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _format_value(value: float):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+
+    def samples(self):
+        """
+        (name, labels, value) of every sample.
+        """
+        raise NotImplementedError()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str):
+        super(Counter, self).__init__(name, help)
+        self.values: dict[tuple, float] = dict()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value that is set directly, or collected when scraped by `collect`, which returns (labels, value) pairs.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, collect=None):
+        super(Gauge, self).__init__(name, help)
+        self.collect = collect
+        self.values: dict[tuple, float] = dict()
+
+    def set(self, value: float, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        if self.collect is not None:
+            return [(self.name, labels, value) for labels, value in self.collect()]
+        return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple):
+        super(Histogram, self).__init__(name, help)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append((f'{self.name}_bucket', dict(le=_format_value(float(bound))), cumulative))
+        samples.append((f'{self.name}_sum', dict(), self.sum))
+        samples.append((f'{self.name}_count', dict(), self.count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = dict()
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+registry = Registry()
+
+AI_MOVE_SECONDS = registry.register(Histogram(
+    'gomoku_ai_move_seconds', 'Time the AI spent searching a move.',
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+))
+AI_NODES = registry.register(Histogram(
+    'gomoku_ai_nodes', 'Nodes searched by the AI for a move.',
+    (10, 50, 100, 500, 1000, 5000, 10000, 50000),
+))
+MESSAGES_SENT = registry.register(Counter('gomoku_messages_sent_total', 'Websocket messages sent to agents.'))
+MESSAGE_BYTES = registry.register(Counter('gomoku_message_bytes_total', 'Bytes of websocket messages sent to agents.'))
+MESSAGE_SEND_SECONDS = registry.register(Histogram(
+    'gomoku_message_send_seconds', 'Time to encode and send a websocket message.',
+    (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5),
+))
+LOOP_LAG_SECONDS = registry.register(Histogram(
+    'gomoku_event_loop_lag_seconds', 'Delay of the event loop waking up a sleeping task.',
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+))
+LOOP_STALLS = registry.register(Counter('gomoku_event_loop_stalls_total', 'Times the event loop was blocked past the watchdog threshold.'))
+ARENAS_EXPIRED = registry.register(Counter('gomoku_arenas_expired_total', 'Arenas expired by the lifecycle manager, by their state.'))
+ANALYSES = registry.register(Counter('gomoku_analyses_total', 'ANALYZE requests, by whether the cache had the result.'))
@@ -0,0 +1,195 @@
+import argparse
+import importlib
+import time
+from dataclasses import dataclass, field
+
+from container import Move
+from rule import BLACK, BLANK, BOARD_SIZE, IllegalMoveError, RenjuRule, Rule, WHITE, parse_board
+
+FOULS = (
+    ('Overline', 'overline'),
+    ('fours', 'double-four'),
+    ('open threes', 'double-three'),
+)
+
+
+@dataclass
+class PerftResult:
+    depth: int
+    # positions reached at each ply, the root is ply 0
+    nodes: list[int] = field(default_factory=list)
+    leaves: int = 0
+    wins: int = 0
+    fouls: dict[str, int] = field(default_factory=dict)
+    patterns: dict[str, int] = field(default_factory=dict)
+    mismatches: list[tuple] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def moves_per_second(self):
+        return sum(self.nodes[1:]) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        lines = [f'perft {self.depth}: {self.leaves} leaves, {self.wins} wins in {self.elapsed:.2f}s ({self.moves_per_second:.0f} moves/s)']
+        lines += [f'  ply {ply}: {nodes}' for ply, nodes in enumerate(self.nodes)]
+        lines += [f'  foul {name}: {count}' for name, count in sorted(self.fouls.items())]
+        lines += [f'  pattern {name}: {count}' for name, count in sorted(self.patterns.items())]
+        if self.mismatches:
+            lines.append(f'  {len(self.mismatches)} mismatches, first: {self.mismatches[0]}')
+        return '\n'.join(lines)
+
+
+def foul_of(rule: Rule, board: list[list[int]], move: Move):
+    """
+    Name of the foul that makes a move on a blank position illegal.
+    """
+    try:
+        rule.is_legal_move(board, move, raise_exception=True)
+    except IllegalMoveError as e:
+        for text, name in FOULS:
+            if text in e.message:
+                return name
+        return e.message
+    return None
+
+
+def pattern_of(rule: Rule, board: list[list[int]], move: Move):
+    """
+    Strongest pattern made by the move, which is already on the board.
+    """
+    if rule.is_win(board, move):
+        return 'five'
+    _, threes, fours = rule.get_rows(board, move)
+    cnt_four = sum(1 for row in fours if rule.is_four(board, row, move.color))
+    cnt_open_three = sum(
+        1 for row in threes
+        if not rule.is_explicitly_closed_three(board, row, move.color) and rule.is_open_three(board, row, move.color)
+    )
+    if cnt_four >= 2:
+        return 'four-four'
+    if cnt_four and cnt_open_three:
+        return 'four-three'
+    if cnt_four:
+        return 'four'
+    if cnt_open_three >= 2:
+        return 'three-three'
+    if cnt_open_three:
+        return 'open-three'
+    return 'other'
+
+
+def candidates(board: list[list[int]], radius: int):
+    """
+    Blank positions, only those within `radius` of a stone unless radius is 0.
+    """
+    size = len(board)
+    stones = [(i, j) for i in range(size) for j in range(size) if board[i][j] != BLANK]
+    for i in range(size):
+        for j in range(size):
+            if board[i][j] != BLANK:
+                continue
+            if radius and stones and not any(max(abs(i - si), abs(j - sj)) <= radius for si, sj in stones):
+                continue
+            yield i, j
+
+
+def perft(board: list[list[int]], turn: int, depth: int, rule: Rule = None, radius=0, reference: Rule = None, patterns=True):
+    """
+    Enumerate every legal move sequence of `depth` moves. Sequences end early at a win.
+    With a reference rule, legality, wins and patterns of every move are compared with it.
+    """
+    rule = rule or RenjuRule()
+    result = PerftResult(depth, nodes=[0] * (depth + 1))
+    moves = []
+    start = time.perf_counter()
+
+    def compare(name, move, value, expected):
+        if value != expected:
+            result.mismatches.append((name, [(m.i, m.j, m.color) for m in moves], (move.i, move.j, move.color), value, expected))
+
+    def visit(ply: int, turn: int):
+        result.nodes[ply] += 1
+        if ply == depth:
+            result.leaves += 1
+            return
+        for i, j in candidates(board, radius):
+            move = Move(i, j, turn)
+            legal = rule.is_legal_move(board, move)
+            if reference is not None:
+                compare('is_legal_move', move, legal, reference.is_legal_move(board, move))
+            if not legal:
+                foul = foul_of(rule, board, move)
+                result.fouls[foul] = result.fouls.get(foul, 0) + 1
+                continue
+            board[i][j] = turn
+            moves.append(move)
+            try:
+                win = rule.is_win(board, move)
+                if reference is not None:
+                    compare('is_win', move, win, reference.is_win(board, move))
+                if patterns and ply + 1 == depth:
+                    pattern = pattern_of(rule, board, move)
+                    result.patterns[pattern] = result.patterns.get(pattern, 0) + 1
+                    if reference is not None:
+                        compare('pattern', move, pattern, pattern_of(reference, board, move))
+                if win:
+                    result.wins += 1
+                    result.nodes[ply + 1] += 1
+                    if ply + 1 == depth:
+                        result.leaves += 1
+                else:
+                    visit(ply + 1, -turn)
+            finally:
+                moves.pop()
+                board[i][j] = BLANK
+
+    visit(0, turn)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def load_rule(spec: str):
+    """
+    module:Class
+    """
+    module, name = spec.split(':')
+    return getattr(importlib.import_module(module), name)()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count legal move sequences and fouls to a fixed depth')
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--board', default=None, help='file with a board, "." blank, "O" black, "X" white')
+    parser.add_argument('--moves', default='', help='moves from the empty board, e.g. "7,7 7,8"')
+    parser.add_argument('--turn', choices=('black', 'white'), default=None, help='color to move, by the stone count if omitted')
+    parser.add_argument('--radius', type=int, default=2, help='only moves within this distance of a stone, 0 for all')
+    parser.add_argument('--rule', default='rule:RenjuRule', help='module:Class of the rule to count with')
+    parser.add_argument('--compare', default=None, help='module:Class of a reference rule to compare with')
+    parser.add_argument('--no-patterns', action='store_true', help='skip the pattern classification of the leaves')
+    args = parser.parse_args()
+
+    if args.board:
+        with open(args.board) as f:
+            board = parse_board(f.read())
+    else:
+        board = [[BLANK] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+        color = BLACK
+        for move in args.moves.split():
+            i, j = map(int, move.split(','))
+            board[i][j] = color
+            color = -color
+    if args.turn:
+        turn = BLACK if args.turn == 'black' else WHITE
+    else:
+        stones = sum(c != BLANK for row in board for c in row)
+        turn = BLACK if stones % 2 == 0 else WHITE
+
+    reference = load_rule(args.compare) if args.compare else None
+    result = perft(board, turn, args.depth, load_rule(args.rule), args.radius, reference, not args.no_patterns)
+    print(result)
+    if reference is not None and result.mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import cProfile
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from random import Random
+
+PROFILE_RATE_ENV = 'GOMOKU_PROFILE_RATE'
+PROFILE_DIR_ENV = 'GOMOKU_PROFILE_DIR'
+PROFILE_MAX_PER_MINUTE_ENV = 'GOMOKU_PROFILE_MAX_PER_MINUTE'
+
+
+class Profiler:
+    """
+    Profiles a sampled fraction of moves with cProfile and dumps one pstats file per profiled section,
+    named {arena_id}-{move number}-{kind}.prof. At most `max_per_minute` dumps are written,
+    so it can stay on in production at a low rate.
+    """
+
+    def __init__(self, rate: float = 0.0, directory: str = 'profiles', max_per_minute: int = 6, seed: int = None):
+        self.rate = rate
+        self.directory = directory
+        self.max_per_minute = max_per_minute
+        self.random = Random(seed)
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            rate=float(os.environ.get(PROFILE_RATE_ENV, 0.0)),
+            directory=os.environ.get(PROFILE_DIR_ENV, 'profiles'),
+            max_per_minute=int(os.environ.get(PROFILE_MAX_PER_MINUTE_ENV, 6)),
+        )
+
+    @property
+    def settings(self):
+        return dict(rate=self.rate, directory=self.directory, max_per_minute=self.max_per_minute)
+
+    def configure(self, rate: float = None, max_per_minute: int = None):
+        with self._lock:
+            if rate is not None:
+                self.rate = min(max(float(rate), 0.0), 1.0)
+            if max_per_minute is not None:
+                self.max_per_minute = int(max_per_minute)
+
+    def should_sample(self):
+        if self.rate <= 0:
+            return False
+        with self._lock:
+            if self.random.random() >= self.rate:
+                return False
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_per_minute:
+                return False
+            self._recent.append(now)
+            return True
+
+    def path_of(self, arena_id: str, move_number: int, kind: str):
+        return os.path.join(self.directory, f'{arena_id}-{move_number:03d}-{kind}.prof')
+
+    @contextmanager
+    def profile(self, arena_id: str, move_number: int, kind: str):
+        if not self.should_sample():
+            yield None
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active on this interpreter
+            yield None
+            return
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(self.path_of(arena_id, move_number, kind))
+
+
+profiler = Profiler.from_env()
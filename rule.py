@@ -1,9 +1,13 @@
 from container import Direction, Move, Row
+from symmetry import canonical_key
 
 BLACK = 1
 WHITE = -1
 BLANK = 0
 BOARD_SIZE = 15
+# a five has to fit, and a move has to fit in the two bytes of a stored game
+MIN_BOARD_SIZE = 5
+MAX_BOARD_SIZE = 25
 
 directions = [
     Direction(1, 0),
@@ -19,6 +23,13 @@ def name_of(color: int):
     return ['BLANK', 'BLACK', 'WHITE'][color]
 
 
+def parse_board(board_string: str):
+    """
+    '.' is blank, 'O' is black and 'X' is white.
+    """
+    return [[BLANK if c == '.' else BLACK if c == 'O' else WHITE for c in r.strip()] for r in board_string.strip().splitlines()]
+
+
 class IllegalMoveError(ValueError):
     def __init__(self, message):
         self.message = message
@@ -29,6 +40,14 @@ class IllegalMoveError(ValueError):
 
 
 class Rule:
+    """
+    Moves on a blank position of the board are legal. The pattern helpers below check the moves
+    that complete a pattern with is_legal_move, so they follow the fouls of a subclass.
+    """
+    variant: str = None
+    # whether a move on a blank position can still be illegal, rules without fouls skip the legality checks
+    has_fouls = False
+
     @staticmethod
     def is_valid_position(board: list[list], i: int, j: int):
         return 0 <= i < len(board) and 0 <= j < len(board[i])
@@ -63,72 +82,6 @@ class Rule:
     def is_win(self, board: list[list[int]], move: Move):
         raise NotImplementedError()
 
-
-class GomokuRule(Rule):
-    def _five_in_a_row(self, board: list[list[int]], move: Move):
-        return any(self.count_succession(board, move, d) >= 5 for d in directions)
-
-    def is_win(self, board: list[list[int]], move: Move):
-        return self._five_in_a_row(board, move)
-
-
-class RenjuRule(Rule):
-    def __init__(self):
-        self.legal_memo = dict()
-
-    def is_win(self, board: list[list[int]], move: Move):
-        for direction in directions:
-            succession = self.count_succession(board, move, direction)
-            if succession == 5 or (move.color == WHITE and succession >= 6):
-                return True
-        return False
-
-    def is_legal_move(self, board: list[list[int]], move: Move, raise_exception=False):
-        board_move_string = ''.join(''.join(str(c) for c in row) for row in board)+f'|{move.i},{move.j},{move.color}'
-        if not raise_exception:
-            if board_move_string in self.legal_memo:
-                return self.legal_memo[board_move_string]
-        if not super(RenjuRule, self).is_legal_move(board, move, raise_exception=raise_exception):
-            self.legal_memo[board_move_string] = False
-            return False
-        if move.color == WHITE:
-            # self.legal_memo[board_move_string] = True
-            return True
-        try:
-            board[move.i][move.j] = move.color
-            if any(self.is_overline(board, move, d) for d in directions):
-                if raise_exception:
-                    raise IllegalMoveError('Overline not allowed for Black.')
-                # self.legal_memo[board_move_string] = False
-                return False
-            _, threes, fours = self.get_rows(board, move)
-            if len(fours) >= 2:
-                cnt_four = 0
-                for row in fours:
-                    if self.is_four(board, row, move.color):
-                        cnt_four += 1
-                        if cnt_four >= 2:
-                            if raise_exception:
-                                raise IllegalMoveError(f'more than two fours not allowed for Black.')
-                            self.legal_memo[board_move_string] = False
-                            return False
-            if len(threes) >= 2:
-                maybe_open_threes = [row for row in threes if not self.is_explicitly_closed_three(board, row, move.color)]
-                if len(maybe_open_threes) >= 2:
-                    cnt_open_three = 0
-                    for row in maybe_open_threes:
-                        if self.is_open_three(board, row, move.color):
-                            cnt_open_three += 1
-                            if cnt_open_three >= 2:
-                                if raise_exception:
-                                    raise IllegalMoveError(f'more than two open threes not allowed for Black.')
-                                self.legal_memo[board_move_string] = False
-                                return False
-            self.legal_memo[board_move_string] = True
-            return True
-        finally:
-            board[move.i][move.j] = BLANK
-
     def get_rows(self, board: list[list[int]], move: Move):
         twos = []
         threes = []
@@ -218,42 +171,48 @@ class RenjuRule(Rule):
                 return True
         return False
 
+    def is_completion(self, board: list[list[int]], move: Move, direction: Direction):
+        """
+        Whether `move` is a legal move that extends a row along `direction`, in the checks of the rows.
+        """
+        return self.is_legal_move(board, move)
+
     def is_four(self, board: list[list[int]], row: Row, color: int):
         if row.inner_blank is not None:
-            return self.is_legal_move(board, Move(*row.inner_blank, color))
+            return self.is_completion(board, Move(*row.inner_blank, color), row.direction)
         else:
-            if self.is_legal_move(board, Move(*row.front_blank, color)):
+            if self.is_completion(board, Move(*row.front_blank, color), row.direction):
                 return True
-            if self.is_legal_move(board, Move(*row.rear_blank, color)):
+            if self.is_completion(board, Move(*row.rear_blank, color), row.direction):
                 return True
             return False
 
     def is_open_three(self, board: list[list[int]], row: Row, color: int):
         if row.inner_blank is not None:
-            if not self.is_legal_move(board, Move(*row.inner_blank, color)):
+            if not self.is_completion(board, Move(*row.inner_blank, color), row.direction):
                 return False
             try:
                 board[row.inner_blank[0]][row.inner_blank[1]] = color
-                if not self.is_legal_move(board, Move(*row.front_blank, color)):
+                if not self.is_completion(board, Move(*row.front_blank, color), row.direction):
                     return False
-                if not self.is_legal_move(board, Move(*row.rear_blank, color)):
+                if not self.is_completion(board, Move(*row.rear_blank, color), row.direction):
                     return False
             finally:
                 board[row.inner_blank[0]][row.inner_blank[1]] = BLANK
             return True
         else:
-            if self.is_legal_move(board, Move(*row.front_blank, color)):
+            if self.is_completion(board, Move(*row.front_blank, color), row.direction):
                 try:
                     board[row.front_blank[0]][row.front_blank[1]] = color
-                    if self.is_legal_move(board, Move(*row.direction.front_of(*row.front_blank), color)) and self.is_legal_move(board, Move(*row.rear_blank, color)):
+                    if self.is_completion(board, Move(*row.direction.front_of(*row.front_blank), color), row.direction) and self.is_completion(board, Move(*row.rear_blank, color), row.direction):
                         return True
                 finally:
                     board[row.front_blank[0]][row.front_blank[1]] = BLANK
 
-            if self.is_legal_move(board, Move(*row.rear_blank, color)):
+            if self.is_completion(board, Move(*row.rear_blank, color), row.direction):
                 try:
                     board[row.rear_blank[0]][row.rear_blank[1]] = color
-                    if self.is_legal_move(board, Move(*row.direction.rear_of(*row.rear_blank), color)) and self.is_legal_move(board, Move(*row.front_blank, color)):
+                    if self.is_completion(board, Move(*row.direction.rear_of(*row.rear_blank), color), row.direction) and self.is_completion(board, Move(*row.front_blank, color), row.direction):
                         return True
                 finally:
                     board[row.rear_blank[0]][row.rear_blank[1]] = BLANK
@@ -261,24 +220,24 @@ class RenjuRule(Rule):
 
     def is_half_open_three(self, board: list[list[int]], row: Row, color: int):
         if row.inner_blank is not None:
-            if not self.is_legal_move(board, Move(*row.inner_blank, color)):
+            if not self.is_completion(board, Move(*row.inner_blank, color), row.direction):
                 return False
             try:
                 board[row.inner_blank[0]][row.inner_blank[1]] = color
-                return self.is_legal_move(board, Move(*row.front_blank, color)) or self.is_legal_move(board, Move(*row.rear_blank, color))
+                return self.is_completion(board, Move(*row.front_blank, color), row.direction) or self.is_completion(board, Move(*row.rear_blank, color), row.direction)
             finally:
                 board[row.inner_blank[0]][row.inner_blank[1]] = BLANK
         else:
-            if self.is_legal_move(board, Move(*row.front_blank, color)):
+            if self.is_completion(board, Move(*row.front_blank, color), row.direction):
                 try:
                     board[row.front_blank[0]][row.front_blank[1]] = color
-                    return self.is_legal_move(board, Move(*row.direction.front_of(*row.front_blank), color)) or self.is_legal_move(board, Move(*row.rear_blank, color))
+                    return self.is_completion(board, Move(*row.direction.front_of(*row.front_blank), color), row.direction) or self.is_completion(board, Move(*row.rear_blank, color), row.direction)
                 finally:
                     board[row.front_blank[0]][row.front_blank[1]] = BLANK
-            if self.is_legal_move(board, Move(*row.rear_blank, color)):
+            if self.is_completion(board, Move(*row.rear_blank, color), row.direction):
                 try:
                     board[row.rear_blank[0]][row.rear_blank[1]] = color
-                    return self.is_legal_move(board, Move(*row.direction.rear_of(*row.rear_blank), color)) or self.is_legal_move(board, Move(*row.front_blank, color))
+                    return self.is_completion(board, Move(*row.direction.rear_of(*row.rear_blank), color), row.direction) or self.is_completion(board, Move(*row.front_blank, color), row.direction)
                 finally:
                     board[row.rear_blank[0]][row.rear_blank[1]] = BLANK
             return False
@@ -286,4 +245,111 @@ class RenjuRule(Rule):
     def is_open_four(self, board: list[list[int]], row: Row, color: int):
         if row.inner_blank is not None:
             return False
-        return self.is_legal_move(board, Move(*row.front_blank, color)) and self.is_legal_move(board, Move(*row.rear_blank, color))
+        return self.is_completion(board, Move(*row.front_blank, color), row.direction) and self.is_completion(board, Move(*row.rear_blank, color), row.direction)
+
+
+class GomokuRule(Rule):
+    """
+    Freestyle, five or more in a row wins.
+    """
+    variant = 'freestyle'
+
+    def _five_in_a_row(self, board: list[list[int]], move: Move):
+        return any(self.count_succession(board, move, d) >= 5 for d in directions)
+
+    def is_win(self, board: list[list[int]], move: Move):
+        return self._five_in_a_row(board, move)
+
+
+class StandardRule(Rule):
+    """
+    Exactly five in a row wins for both colors, an overline does not.
+    """
+    variant = 'standard'
+
+    def is_win(self, board: list[list[int]], move: Move):
+        return any(self.is_five_in_a_row(board, move, d) for d in directions)
+
+    def is_completion(self, board: list[list[int]], move: Move, direction: Direction):
+        # a move that makes an overline along the row neither completes nor extends it
+        if not self.is_legal_move(board, move):
+            return False
+        try:
+            board[move.i][move.j] = move.color
+            return self.count_succession(board, move, direction) <= 5
+        finally:
+            board[move.i][move.j] = BLANK
+
+
+class RenjuRule(Rule):
+    variant = 'renju'
+    has_fouls = True
+
+    def __init__(self):
+        self.legal_memo = dict()
+
+    def is_win(self, board: list[list[int]], move: Move):
+        for direction in directions:
+            succession = self.count_succession(board, move, direction)
+            if succession == 5 or (move.color == WHITE and succession >= 6):
+                return True
+        return False
+
+    def is_legal_move(self, board: list[list[int]], move: Move, raise_exception=False):
+        memo_key = canonical_key(board, move)
+        if memo_key in self.legal_memo:
+            # a known illegal move is checked again to raise the error with its reason
+            if self.legal_memo[memo_key] or not raise_exception:
+                return self.legal_memo[memo_key]
+        if not super(RenjuRule, self).is_legal_move(board, move, raise_exception=raise_exception):
+            self.legal_memo[memo_key] = False
+            return False
+        if move.color == WHITE:
+            # self.legal_memo[memo_key] = True
+            return True
+        try:
+            board[move.i][move.j] = move.color
+            if any(self.is_overline(board, move, d) for d in directions):
+                if raise_exception:
+                    raise IllegalMoveError('Overline not allowed for Black.')
+                # self.legal_memo[memo_key] = False
+                return False
+            _, threes, fours = self.get_rows(board, move)
+            if len(fours) >= 2:
+                cnt_four = 0
+                for row in fours:
+                    if self.is_four(board, row, move.color):
+                        cnt_four += 1
+                        if cnt_four >= 2:
+                            if raise_exception:
+                                raise IllegalMoveError(f'more than two fours not allowed for Black.')
+                            self.legal_memo[memo_key] = False
+                            return False
+            if len(threes) >= 2:
+                maybe_open_threes = [row for row in threes if not self.is_explicitly_closed_three(board, row, move.color)]
+                if len(maybe_open_threes) >= 2:
+                    cnt_open_three = 0
+                    for row in maybe_open_threes:
+                        if self.is_open_three(board, row, move.color):
+                            cnt_open_three += 1
+                            if cnt_open_three >= 2:
+                                if raise_exception:
+                                    raise IllegalMoveError(f'more than two open threes not allowed for Black.')
+                                self.legal_memo[memo_key] = False
+                                return False
+            self.legal_memo[memo_key] = True
+            return True
+        finally:
+            board[move.i][move.j] = BLANK
+
+
+RULES = {rule.variant: rule for rule in (GomokuRule, StandardRule, RenjuRule)}
+
+
+def rule_of(variant: str):
+    """
+    A new rule of a variant name, 'freestyle', 'standard' or 'renju'.
+    """
+    if variant not in RULES:
+        raise ValueError(f'Unknown rule {variant}')
+    return RULES[variant]()
@@ -0,0 +1,141 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from random import Random
+
+from container import Move
+from rule import BOARD_SIZE, rule_of
+
+
+@dataclass
+class EngineConfig:
+    name: str = 'alphabeta'
+    max_depth: int = 2
+    max_width: int = 10
+    engine: str = 'alphabeta'
+    simulations: int = 400
+    batch_size: int = 8
+    # weights file of the evaluation, the default weights if None
+    weights: str = None
+
+    def create_agent(self):
+        if self.engine == 'mcts':
+            from mcts import MCTSAgent
+            return MCTSAgent(self.simulations, self.batch_size, verbose=False)
+        from agent import AIAgent
+        from evaluation import load_weights
+        weights = load_weights(self.weights) if self.weights else None
+        return AIAgent(max_depth=self.max_depth, max_width=self.max_width, verbose=False, weights=weights)
+
+
+@dataclass
+class SelfPlayJob:
+    black: EngineConfig
+    white: EngineConfig
+    seed: int
+    opening_moves: int = 2
+    max_moves: int = None
+    opening: list[tuple[int, int]] = None
+    board_size: int = BOARD_SIZE
+    # variant name of the rule, see rule.RULES
+    rule: str = 'renju'
+
+
+@dataclass
+class SelfPlayResult:
+    seed: int
+    black: str
+    white: str
+    winner: int
+    moves: list[Move]
+    elapsed: float
+    move_times: list[float] = field(default_factory=list)
+    move_nodes: list[int] = field(default_factory=list)
+    # search value for the player who moved, see AIVAIArena.move_scores
+    move_scores: list[float] = field(default_factory=list)
+
+
+@dataclass
+class SelfPlayReport:
+    results: list[SelfPlayResult] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def games(self):
+        return len(self.results)
+
+    @property
+    def positions(self):
+        return sum(len(result.moves) for result in self.results)
+
+    @property
+    def games_per_second(self):
+        return self.games / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def positions_per_second(self):
+        return self.positions / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return f'{self.games} games, {self.positions} positions in {self.elapsed:.2f}s ' \
+               f'({self.games_per_second:.2f} games/s, {self.positions_per_second:.2f} positions/s)'
+
+
+def play_game(job: SelfPlayJob) -> SelfPlayResult:
+    from arena import AIVAIArena
+    start = time.perf_counter()
+    arena = AIVAIArena(
+        job.black.create_agent(),
+        job.white.create_agent(),
+        seed=job.seed,
+        opening_moves=job.opening_moves,
+        max_moves=job.max_moves,
+        opening=job.opening,
+        board_size=job.board_size,
+        rule=rule_of(job.rule),
+    )
+    game = arena.play()
+    return SelfPlayResult(
+        job.seed, job.black.name, job.white.name, game.winner, game.moves, time.perf_counter() - start,
+        arena.move_times, arena.move_nodes, arena.move_scores,
+    )
+
+
+def make_jobs(games: int, black: EngineConfig, white: EngineConfig, seed: int = None, opening_moves=2, max_moves=None,
+              board_size=BOARD_SIZE, rule='renju'):
+    if seed is None:
+        seed = Random().getrandbits(32)
+    return [
+        SelfPlayJob(black, white, seed + index, opening_moves, max_moves, board_size=board_size, rule=rule)
+        for index in range(games)
+    ]
+
+
+def run_jobs(jobs: list[SelfPlayJob], processes: int = None, on_result=None) -> SelfPlayReport:
+    """
+    Play the jobs in a process pool. Results keep the order of the jobs.
+    """
+    report = SelfPlayReport()
+    start = time.perf_counter()
+
+    def collect(results):
+        for result in results:
+            report.results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+    if processes == 1:
+        collect(map(play_game, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as pool:
+            collect(pool.map(play_game, jobs))
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def run_self_play(games: int, black: EngineConfig = None, white: EngineConfig = None, seed: int = None,
+                  processes: int = None, opening_moves=2, max_moves=None, on_result=None, board_size=BOARD_SIZE,
+                  rule='renju') -> SelfPlayReport:
+    jobs = make_jobs(games, black or EngineConfig(), white or EngineConfig(), seed, opening_moves, max_moves, board_size, rule)
+    return run_jobs(jobs, processes, on_result)
@@ -1,19 +1,72 @@
 import asyncio
 import dataclasses
+import hmac
 import json
+import os
 import uuid
+from http import HTTPStatus
 from json import JSONDecodeError
 
 import websockets
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
 from websockets.legacy.server import WebSocketServerProtocol
 
-from agent import PlayerAgent
+from agent import EnhancedJSONEncoder, PlayerAgent
+from analysis import analyze_message
 from arena import Arena
-from container import ArenaState
+from container import ArenaState, SearchStats, SearchStatsAggregate
+from gamestore import GameRecord, GameStore
+from lifecycle import ArenaLifecycle
+from metrics import AI_MOVE_SECONDS, AI_NODES, Gauge, registry
+from profiling import profiler
+from rule import BOARD_SIZE, rule_of
+from watchdog import LoopWatchdog, run_off_loop
+
+ADMIN_TOKEN_ENV = 'GOMOKU_ADMIN_TOKEN'
+GAME_DIR_ENV = 'GOMOKU_GAME_DIR'
+RECONNECT_GRACE_ENV = 'GOMOKU_RECONNECT_GRACE'
+MAX_ARENAS_ENV = 'GOMOKU_MAX_ARENAS'
 
 arenas: dict[Arena] = dict()
 remove_task = dict()
+search_stats = SearchStatsAggregate()
+game_store: GameStore = None
+# players by their reconnect token
+players: dict[str, PlayerAgent] = dict()
+reconnect_grace = float(os.environ.get(RECONNECT_GRACE_ENV, 30))
+
+
+def forget_arena(arena):
+    remove_task.pop(arena.arena_id, None)
+    for token, player in list(players.items()):
+        if player.arena is arena:
+            del players[token]
+
+
+lifecycle = ArenaLifecycle(arenas, max_arenas=int(os.environ.get(MAX_ARENAS_ENV, 1000)), on_remove=forget_arena)
+
+
+def collect_arenas():
+    return [(dict(state=state), count) for state, count in lifecycle.counts().items()]
+
+
+def collect_event_queue_depth():
+    return [
+        (dict(arena=arena.arena_id), arena._event_queue.qsize())
+        for arena in arenas.values() if arena._event_queue is not None
+    ]
+
+
+registry.register(Gauge('gomoku_arenas', 'Arenas in the registry.', collect_arenas))
+registry.register(Gauge('gomoku_players', 'Players attached to arenas, including AI agents.', lambda: [(dict(), sum(len(arena.agents) for arena in arenas.values()))]))
+registry.register(Gauge('gomoku_spectators', 'Spectators attached to arenas.', lambda: [(dict(), sum(len(arena.spectators) for arena in arenas.values()))]))
+registry.register(Gauge('gomoku_arena_event_queue_depth', 'Events waiting in the queue of each arena.', collect_event_queue_depth))
+
+
+def record_search_stats(stats: SearchStats):
+    search_stats.add(stats)
+    AI_MOVE_SECONDS.observe(stats.elapsed)
+    AI_NODES.observe(stats.nodes)
 
 
 def remove_arena_on_closed(arena):
@@ -22,14 +75,17 @@ def remove_arena_on_closed(arena):
 
     async def remove_arena():
         await arena.game_task
-        del arenas[arena.arena_id]
-        del remove_task[arena.arena_id]
+        print(f'SERVER Search stats: {search_stats}')
+        if game_store is not None and arena.game.moves:
+            await run_off_loop(game_store.append, GameRecord.from_game(arena.arena_id, arena.game, arena.started_at))
+        lifecycle.remove(arena.arena_id)
     remove_task[arena.arena_id] = asyncio.create_task(remove_arena())
 
 
 async def attach_agent_to_arena(websocket, connection_id, arena):
-    agent = PlayerAgent(websocket, connection_id)
+    agent = PlayerAgent(websocket, connection_id, grace_period=reconnect_grace)
     arena.attach_agent(agent)
+    players[agent.token] = agent
     if arena.is_game_started:
         remove_arena_on_closed(arena)
     return await agent.start_receive_message()
@@ -43,21 +99,42 @@ async def attach_spectator_to_arena(websocket, connection_id, arena):
     return await spectator.start_receive_message()
 
 
-def new_arena(title, player_num, allow_spectator):
-    arena = Arena(title, player_num, allow_spectator)
+def is_admin(data):
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    return bool(token) and isinstance(data, dict) and hmac.compare_digest(str(data.get('token', '')), token)
+
+
+def new_arena(title, player_num, allow_spectator, board_size=BOARD_SIZE, rule='renju'):
+    arena = Arena(title, player_num, allow_spectator, board_size, rule_of(rule))
+    arena.search_stats_listener = record_search_stats
     if not arena.title:
         arena.title = f'Arena_{arena.arena_id[:6]}'
-    arenas[arena.arena_id] = arena
+    lifecycle.add(arena)
     return arena
 
 
+async def analysis_reply(data, game=None):
+    """
+    The ANALYSIS message for an ANALYZE message, with the reason in `message` when it cannot be analyzed.
+    """
+    try:
+        reply = dict(type='ANALYSIS', data=await analyze_message(data, game))
+    except ValueError as e:
+        reply = dict(type='ANALYSIS', data=None, message=str(e))
+    return json.dumps(reply, cls=EnhancedJSONEncoder)
+
+
 async def accept(websocket: WebSocketServerProtocol, path):
     connection_id = str(uuid.uuid4())
 
-    def send_arena_list():
-        _arenas = [dataclasses.asdict(ArenaState(_arena)) for _arena in arenas.values()]
-        print(f'SERVER{connection_id[:6]} Send arena list {_arenas}')
-        return websocket.send(json.dumps(dict(type='ARENA_LIST', data=dict(arenas=_arenas))))
+    def encode_arena_list(states: list[ArenaState]):
+        _arenas = [dataclasses.asdict(state) for state in states]
+        return json.dumps(dict(type='ARENA_LIST', data=dict(arenas=_arenas)))
+
+    async def send_arena_list():
+        states = [ArenaState(_arena) for _arena in arenas.values()]
+        print(f'SERVER{connection_id[:6]} Send arena list of {len(states)} arenas')
+        await websocket.send(await run_off_loop(encode_arena_list, states))
 
     await send_arena_list()
 
@@ -72,12 +149,23 @@ async def accept(websocket: WebSocketServerProtocol, path):
             message = json.loads(message)
         except JSONDecodeError:
             continue
-        print(f'SERVER[{connection_id[:6]}] Received: {message["type"]} {message["data"]}')
+        if message['type'] in ('PROFILE', 'RECONNECT'):
+            # these carry a token, don't log it
+            print(f'SERVER[{connection_id[:6]}] Received: {message["type"]}')
+        else:
+            print(f'SERVER[{connection_id[:6]}] Received: {message["type"]} {message["data"]}')
         if message['type'] == 'CREATE_ARENA':
             title = message['data']['title']
             player_num = int(message['data']['players'])
             allow_spectator = bool(message['data']['spectator'])
-            arena = new_arena(title, player_num, allow_spectator)
+            try:
+                board_size = int(message['data'].get('boardSize', BOARD_SIZE))
+                arena = new_arena(title, player_num, allow_spectator, board_size, message['data'].get('rule', 'renju'))
+            except ValueError as e:
+                # too many arenas, a board size out of range or an unknown rule
+                print(f'SERVER[{connection_id[:6]}] {e}')
+                await send_arena_list()
+                continue
             print(f'Arena[{arena.arena_id[:6]}] Created')
             if not arena.is_game_started:
                 return await attach_agent_to_arena(websocket, connection_id, arena)
@@ -105,14 +193,50 @@ async def accept(websocket: WebSocketServerProtocol, path):
             except ValueError:
                 await send_arena_list()
             print(f'Spectate Arena[{arena.arena_id[:6]}]')
+        elif message['type'] == 'RECONNECT':
+            agent = players.get(message['data'].get('token'))
+            if agent is None or agent not in agent.arena.agents or agent.arena.game.is_game_over:
+                await send_arena_list()
+                continue
+            print(f'Reconnected to Arena[{agent.arena.arena_id[:6]}]')
+            return await agent.resume(websocket, message['data'].get('moves'))
+        elif message['type'] == 'PROFILE':
+            if not is_admin(message['data']):
+                await send_arena_list()
+                continue
+            profiler.configure(message['data'].get('rate'), message['data'].get('maxPerMinute'))
+            print(f'SERVER Profiling {profiler.settings}')
+            await websocket.send(json.dumps(dict(type='PROFILE', data=profiler.settings)))
+        elif message['type'] == 'ANALYZE':
+            await websocket.send(await analysis_reply(message['data']))
         else:
             await send_arena_list()
 
 
-async def serve():
-    async with websockets.serve(accept, '0.0.0.0', 5000):
+async def process_request(path, request_headers):
+    """
+    Serve the metrics over plain HTTP next to the websocket.
+    """
+    if path == '/metrics':
+        return HTTPStatus.OK, [('Content-Type', 'text/plain; version=0.0.4')], registry.render().encode()
+    return None
+
+
+async def serve(host='0.0.0.0', port=5000, game_dir: str = None):
+    global game_store
+    game_store = GameStore(game_dir or os.environ.get(GAME_DIR_ENV, 'games'))
+    print(f'SERVER Finished games are stored in {game_store.path}, {len(game_store)} so far')
+    async with websockets.serve(accept, host, port, process_request=process_request):
         print('Server started.')
-        await asyncio.Future()
+        watchdog = LoopWatchdog().start()
+        reaper = asyncio.create_task(lifecycle.run())
+        try:
+            await asyncio.Future()
+        finally:
+            reaper.cancel()
+            await watchdog.stop()
+            game_store.close()
+            game_store = None
 
 if __name__ == '__main__':
     asyncio.run(serve())
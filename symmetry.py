@@ -0,0 +1,130 @@
+"""
+The 8 dihedral symmetries of a square board.
+
+Transform k transposes the board when k >= 4 and then rotates it counterclockwise (k % 4) times,
+which matches numpy.rot90(numpy.transpose(board) if k >= 4 else board, k % 4).
+"""
+from functools import lru_cache
+from random import Random
+
+from container import Move
+
+# BLACK and WHITE of rule, which imports this module
+COLORS = (1, -1)
+
+TRANSFORMS = range(8)
+
+
+def transform_point(i: int, j: int, size: int, k: int):
+    if k >= 4:
+        i, j = j, i
+    for _ in range(k % 4):
+        i, j = size - 1 - j, i
+    return i, j
+
+
+def inverse_transform(k: int):
+    if k >= 4:
+        return k
+    return (4 - k) % 4
+
+
+def transform_board(board: list[list[int]], k: int):
+    size = len(board)
+    transformed = [[0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(size):
+            ti, tj = transform_point(i, j, size, k)
+            transformed[ti][tj] = board[i][j]
+    return transformed
+
+
+@lru_cache(maxsize=None)
+def zobrist_table(size: int):
+    """
+    table[k][color][i * size + j] is the key of a stone at (i, j) seen through transform k.
+    Colors index the table directly, so WHITE (-1) uses the last entry.
+    """
+    random = Random(size)
+    keys = {color: [random.getrandbits(64) for _ in range(size * size)] for color in COLORS}
+    table = []
+    for k in TRANSFORMS:
+        by_color = [None, [0] * (size * size), [0] * (size * size)]
+        for color in COLORS:
+            for i in range(size):
+                for j in range(size):
+                    ti, tj = transform_point(i, j, size, k)
+                    by_color[color][i * size + j] = keys[color][ti * size + tj]
+        table.append(by_color)
+    return table
+
+
+def board_hashes(board: list[list[int]]):
+    size = len(board)
+    table = zobrist_table(size)
+    hashes = [0] * 8
+    for i, row in enumerate(board):
+        for j, color in enumerate(row):
+            if color:
+                index = i * size + j
+                for k in TRANSFORMS:
+                    hashes[k] ^= table[k][color][index]
+    return hashes
+
+
+def canonical_key(board: list[list[int]], move: Move):
+    """
+    Key of a position and a move on it that is the same for all 8 symmetric versions of them.
+    """
+    hashes = board_hashes(board)
+    key = min(hashes)
+    k = hashes.index(key)
+    return key, transform_point(move.i, move.j, len(board), k), move.color
+
+
+def canonical_moves(moves: list[Move], size: int):
+    """
+    Orientation of a game record with the smallest move sequence, and the record in that orientation.
+    """
+    best = None
+    for k in TRANSFORMS:
+        transformed = [Move(*transform_point(move.i, move.j, size, k), move.color) for move in moves]
+        key = [(move.i, move.j) for move in transformed]
+        if best is None or key < best[0]:
+            best = key, k, transformed
+    return best[1], best[2]
+
+
+class SymmetricHash:
+    """
+    Zobrist hashes of a board under all 8 transforms, maintained incrementally.
+    The smallest one is the canonical key, and moves map between the board and the canonical orientation.
+    """
+
+    def __init__(self, board: list[list[int]]):
+        self.size = len(board)
+        self.table = zobrist_table(self.size)
+        self.hashes = board_hashes(board)
+
+    def toggle(self, i: int, j: int, color: int):
+        """
+        Place or remove a stone.
+        """
+        index = i * self.size + j
+        hashes = self.hashes
+        for k in TRANSFORMS:
+            hashes[k] ^= self.table[k][color][index]
+
+    @property
+    def key(self):
+        return min(self.hashes)
+
+    @property
+    def transform(self):
+        return self.hashes.index(min(self.hashes))
+
+    def to_canonical(self, i: int, j: int):
+        return transform_point(i, j, self.size, self.transform)
+
+    def from_canonical(self, i: int, j: int):
+        return transform_point(i, j, self.size, inverse_transform(self.transform))
@@ -0,0 +1,51 @@
+"""
+Lookup tables that only depend on the board size, like zobrist_table of symmetry. Each is built on first use
+and cached for the size, so boards of different sizes can be played in one process without rebuilding them.
+"""
+from functools import lru_cache
+
+from rule import directions
+
+# blank positions up to this far from a stone are search candidates
+NEIGHBOURHOOD_RADIUS = 2
+WINDOW = 5
+
+
+@lru_cache(maxsize=None)
+def neighbourhood(size: int):
+    """
+    table[i * size + j] is ((ni, nj, distance), ...) of the positions within NEIGHBOURHOOD_RADIUS of (i, j)
+    on the board, by Chebyshev distance.
+    """
+    r = NEIGHBOURHOOD_RADIUS
+    table = []
+    for i in range(size):
+        for j in range(size):
+            table.append(tuple(
+                (ni, nj, max(abs(ni - i), abs(nj - j)))
+                for ni in range(max(i - r, 0), min(i + r + 1, size))
+                for nj in range(max(j - r, 0), min(j + r + 1, size))
+                if (ni, nj) != (i, j)
+            ))
+    return table
+
+
+@lru_cache(maxsize=None)
+def line_windows(size: int):
+    """
+    table[i * size + j] has a tuple for each direction of the WINDOW-cell windows through (i, j)
+    that fit on the board, each a tuple of positions.
+    """
+    table = []
+    for i in range(size):
+        for j in range(size):
+            by_direction = []
+            for direction in directions:
+                windows = []
+                for start in range(-WINDOW + 1, 1):
+                    window = tuple((i + (start + k) * direction.i, j + (start + k) * direction.j) for k in range(WINDOW))
+                    if all(0 <= wi < size and 0 <= wj < size for wi, wj in window):
+                        windows.append(window)
+                by_direction.append(tuple(windows))
+            table.append(tuple(by_direction))
+    return table
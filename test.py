@@ -1,13 +1,43 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import socket
+import tempfile
 import unittest
+import uuid
 
-from agent import AIAgent
-from arena import Arena
-from container import Move, Row, Direction
-from rule import RenjuRule, WHITE, BLACK, BLANK
+import numpy as np
 
-
-def parse_board(board_string: str):
-    return [[BLANK if c == '.' else BLACK if c == 'O' else WHITE for c in r.strip()] for r in board_string.strip().splitlines()]
+import annotate
+import bench
+import loadgen
+import tune
+from agent import AIAgent, Agent
+from analysis import AnalysisCache
+from arena import Arena, AIVAIArena
+from container import Move, Row, Direction, SearchStatsAggregate
+from metrics import Counter, Histogram, Registry
+from lifecycle import ArenaLifecycle, ArenaLimitError, TimerWheel
+from gamestore import RECORD_HEADER, GameRecord, GameStore
+from game import Game
+from tables import line_windows, neighbourhood
+from batch_evaluation import batch_scores
+from evaluation import (FEATURES, FOUR_THREAT, HEURISTIC_LIMIT, SCORE_LENGTH, WEIGHTS, get_score, load_weights, pack_score,
+                        threat_priority, unpack_score)
+from dataset import DatasetReader, DatasetWriter, decode_move
+from distributed import Coordinator, encode_message, read_message, run_worker
+from mcts import MCTSAgent, NumpyPolicyValueNet
+from perft import perft
+from profiling import Profiler
+from rule import GomokuRule, RenjuRule, Rule, WHITE, BLACK, BLANK, parse_board, rule_of
+from selfplay import EngineConfig, SelfPlayResult, make_jobs as make_selfplay_jobs, run_jobs, run_self_play
+from symmetry import TRANSFORMS, SymmetricHash, board_hashes, canonical_key, canonical_moves, transform_board, transform_point
+import server
+from tournament import GAUNTLET, OPENINGS, compute_standings, fit_elo, make_jobs
+from watchdog import LoopWatchdog
 
 
 class AIAgentTest(unittest.TestCase):
@@ -233,6 +263,139 @@ class AIAgentTest(unittest.TestCase):
         result = self.white_agent._calc_best_move(board, self.renju)
         self.assertEqual((Arena.MOVE, Move(4, 8, WHITE)), result)
 
+    def test_search_stats(self):
+        board_string = '''
+            ...............
+            ...............
+            ...............
+            ...............
+            .........O.....
+            .....O.........
+            .........O.....
+            ......OOO......
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+        '''
+        board = parse_board(board_string)
+        progress = []
+        type, move, stats = self.black_agent._calc_best_move(board, self.renju, max_depth=2, progress=lambda s: progress.append(s.root_searched), with_stats=True)
+        self.assertEqual(stats.nodes, sum(stats.nodes_per_ply))
+        # the root is searched once by each iteration
+        self.assertEqual([iteration['depth'] for iteration in stats.iterations], [1, 2])
+        self.assertEqual(stats.nodes_per_ply[0], 2)
+        self.assertEqual(sum(iteration['nodes'] for iteration in stats.iterations), stats.nodes)
+        self.assertEqual(stats.principal_variation[0], move)
+        self.assertEqual(len(stats.principal_variation), 2)
+        self.assertEqual(progress, list(range(1, stats.root_searched + 1)))
+        self.assertEqual(board, parse_board(board_string))
+        aggregate = SearchStatsAggregate()
+        aggregate.add(stats)
+        aggregate.add(stats)
+        self.assertEqual(aggregate.nodes, 2 * stats.nodes)
+        self.assertEqual(aggregate.cutoffs, [2 * c for c in stats.cutoffs])
+
+    def test_search_switches(self):
+        positions = {name: (parse_board(board), turn) for name, (board, turn) in bench.BOARDS.items()}
+        results = bench.compare_search_switches(positions, 3, len(positions))
+        for name, result in results.items():
+            # the switches only change the search effort, not the best move of the test positions
+            self.assertEqual(result['agreement'], 1.0, name)
+        self.assertLessEqual(results['lmr']['nodes'], results['plain']['nodes'])
+
+    def test_threat_priority(self):
+        board = parse_board('''
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+            ...XXXX........
+            ...............
+            ...OOOO........
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+        ''')
+        win = threat_priority(board, 8, 7, BLACK)
+        block = threat_priority(board, 6, 7, BLACK)
+        quiet = threat_priority(board, 10, 10, BLACK)
+        self.assertGreater(win, block)
+        self.assertGreater(block, quiet)
+        self.assertGreaterEqual(block, FOUR_THREAT)
+        self.assertLess(quiet, FOUR_THREAT)
+
+    def test_packed_scores_keep_the_order(self):
+        rng = random.Random(0)
+        length = 4 + SCORE_LENGTH
+        scores = [(0,) * ply + (1,) * (length - ply) for ply in range(4)]
+        scores += [tuple(-x for x in score) for score in scores]
+        for _ in range(300):
+            scores.append(tuple(rng.choice((-1, 0, 1)) for _ in range(length - 1)) + (rng.randint(-HEURISTIC_LIMIT, HEURISTIC_LIMIT),))
+        for score in scores:
+            self.assertEqual(unpack_score(pack_score(score), length), score)
+            self.assertEqual(pack_score(tuple(-x for x in score)), -pack_score(score))
+        self.assertEqual(sorted(scores), sorted(scores, key=pack_score))
+        # the heuristic sum never outweighs a tier
+        self.assertLess(pack_score((0, 0, 10 ** 9)), pack_score((0, 1, -10 ** 9)))
+
+
+class MCTSAgentTest(unittest.TestCase):
+    renju = RenjuRule()
+    board_string = '''
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        .....OO.OO.....
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+    '''
+
+    def test_win(self):
+        agent = MCTSAgent(simulations=100, verbose=False)
+        agent.color = BLACK
+        result = agent.select_move(parse_board(self.board_string), self.renju, Move(0, 0, WHITE))
+        self.assertEqual((Arena.MOVE, Move(7, 7, BLACK)), result)
+
+    def test_block(self):
+        agent = MCTSAgent(simulations=200, verbose=False)
+        agent.color = WHITE
+        result = agent.select_move(parse_board(self.board_string), self.renju, Move(7, 9, BLACK))
+        self.assertEqual((Arena.MOVE, Move(7, 7, WHITE)), result)
+
+    def test_network_evaluator_and_subtree_reuse(self):
+        agent = MCTSAgent(simulations=64, batch_size=16, evaluator=NumpyPolicyValueNet(seed=0), verbose=False)
+        agent.color = WHITE
+        board = parse_board(self.board_string)
+        board[7][8] = BLANK
+        _, move = agent.select_move(board, self.renju, Move(7, 9, BLACK))
+        self.assertEqual(agent.last_nodes, 64)
+        board[move.i][move.j] = WHITE
+        reply = next(child for child in agent.root.children.values() if child.visits)
+        board[reply.move.i][reply.move.j] = BLACK
+        visits = reply.visits
+        agent.select_move(board, self.renju, reply.move)
+        # the search continued in the subtree of the reply
+        self.assertEqual(reply.visits, visits + 64)
+        self.assertIn(agent.root, reply.children.values())
+
 
 class RuleTest(unittest.TestCase):
     renju = RenjuRule()
@@ -260,6 +423,52 @@ class RuleTest(unittest.TestCase):
         _, threes, fours = self.renju.get_rows(board, move)
         self.assertEqual((len(threes), len(fours)), (3, 3))
 
+    def test_variants(self):
+        board = parse_board('''
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+            ...............
+            ...OOOO.OO.....
+            ...............
+            ...............
+            ......O........
+            ......O........
+            ....OO.........
+            ...............
+            ...............
+        ''')
+        overline = Move(7, 7, BLACK)
+        double_three = Move(12, 6, BLACK)
+        for variant, wins, legal in (('freestyle', True, True), ('standard', False, True), ('renju', False, False)):
+            rule = rule_of(variant)
+            self.assertEqual(rule.variant, variant)
+            self.assertEqual(rule.has_fouls, variant == 'renju')
+            self.assertEqual(rule.is_legal_move(board, double_three), legal, variant)
+            board[overline.i][overline.j] = BLACK
+            self.assertEqual(rule.is_win(board, overline), wins, variant)
+            board[overline.i][overline.j] = BLANK
+        # the four of standard is closed by the overline of its rear, not a sure win as in freestyle
+        board = parse_board('''
+            .........
+            .........
+            .........
+            .........
+            .OOOO.O..
+            .........
+            .........
+            .........
+            .........
+        ''')
+        for variant, sure_win in (('freestyle', 1), ('standard', 0)):
+            score = get_score(board, rule_of(variant), Move(4, 4, BLACK))
+            self.assertEqual(score[:-1], (0, 0, sure_win, 0, 0), variant)
+        with self.assertRaises(ValueError):
+            rule_of('caro')
+
     def test_is_explicitly_closed_three(self):
         def assert_explicitly_closed(move_list, inner_blank, direction, result):
             self.assertEqual(self.renju.is_explicitly_closed_three(board, Row(move_list, inner_blank, direction), BLACK), result)
@@ -293,5 +502,863 @@ class RuleTest(unittest.TestCase):
         assert_explicitly_closed([(1, 9), (1, 10), (1, 12)], (1, 11), Direction(0, 1), False)
 
 
+class BatchEvaluationTest(unittest.TestCase):
+    def test_matches_get_score(self):
+        rng = random.Random(0)
+        boards = []
+        last_moves = []
+        for board, _ in bench.corpus(20, 0).values():
+            stones = [(i, j) for i in range(len(board)) for j in range(len(board)) if board[i][j] != BLANK]
+            for i, j in rng.sample(stones, min(3, len(stones))):
+                boards.append(board)
+                last_moves.append(Move(i, j, board[i][j]))
+        for _ in range(50):
+            # crowded boards have many more rows
+            board = [[rng.choice((BLANK, BLANK, BLACK, WHITE)) for _ in range(15)] for _ in range(15)]
+            i, j = rng.choice([(i, j) for i in range(15) for j in range(15) if board[i][j] != BLANK])
+            boards.append(board)
+            last_moves.append(Move(i, j, board[i][j]))
+        # rows completed into overlines, which standard does not count
+        board = parse_board('''
+            ...............
+            ...............
+            ...............
+            ..OOOO.O.......
+            ...............
+            .XX.XX.X.......
+            ...............
+            ........O......
+            ........O......
+            ...O.OOO.......
+            ........O......
+            .O.OOO..X.XXX.X
+            ...............
+            ..OO.OO.O......
+            ...............
+        ''')
+        for i, j in [(i, j) for i in range(15) for j in range(15) if board[i][j] != BLANK]:
+            boards.append(board)
+            last_moves.append(Move(i, j, board[i][j]))
+        boards.append(boards[0])
+        last_moves.append(None)
+        for variant in ('freestyle', 'standard', 'renju'):
+            rule = rule_of(variant)
+            scores = batch_scores(boards, last_moves, rule)
+            for board, last_move, score in zip(boards, last_moves, scores):
+                self.assertEqual(tuple(score), get_score(board, rule, last_move), (variant, last_move))
+
+
+class AIVAIArenaTest(unittest.TestCase):
+    def test_play_until_win(self):
+        arena = AIVAIArena(AIAgent(max_depth=1, verbose=False), AIAgent(max_depth=1, verbose=False), seed=0, opening_moves=2)
+        game = arena.play()
+        self.assertTrue(game.is_game_over)
+        self.assertIn(game.winner, (BLACK, WHITE))
+        self.assertEqual(game.winner, game.last_move.color)
+
+    def test_small_board(self):
+        arena = AIVAIArena(AIAgent(max_depth=2, verbose=False), AIAgent(max_depth=2, verbose=False), seed=0, opening_moves=2,
+                           max_moves=30, board_size=9)
+        game = arena.play()
+        self.assertEqual(len(game.board), 9)
+        self.assertTrue(all(0 <= move.i < 9 and 0 <= move.j < 9 for move in game.moves))
+        # the tables of each size are built once
+        self.assertIs(neighbourhood(9), neighbourhood(9))
+        self.assertEqual(len(neighbourhood(9)[0]), 8)
+        self.assertEqual([len(windows) for windows in line_windows(9)[4 * 9 + 4]], [5, 5, 5, 5])
+        self.assertEqual([len(windows) for windows in line_windows(9)[0]], [1, 1, 1, 0])
+        with self.assertRaises(ValueError):
+            Game(4)
+
+    def test_self_play_is_reproducible(self):
+        config = EngineConfig('alphabeta-d1', 1)
+        first = run_self_play(2, config, config, seed=3, processes=2, max_moves=12)
+        second = run_self_play(2, config, config, seed=3, processes=1, max_moves=12)
+        self.assertEqual([r.moves for r in first.results], [r.moves for r in second.results])
+        self.assertEqual(first.positions, sum(len(r.moves) for r in first.results))
+        self.assertGreater(first.positions_per_second, 0)
+
+
+class DatasetTest(unittest.TestCase):
+    moves = [Move(7, 7, BLACK), Move(7, 8, WHITE), Move(8, 8, BLACK), Move(6, 6, WHITE), Move(9, 9, BLACK)]
+
+    def test_write_and_read_shards(self):
+        with tempfile.TemporaryDirectory() as path:
+            with DatasetWriter(path, shard_size=3) as writer:
+                writer.add_game(self.moves, BLACK)
+                writer.add_game(self.moves[:2], None)
+            reader = DatasetReader(path)
+            self.assertEqual(len(reader), 7)
+            self.assertEqual(len(reader.shards), 3)
+            self.assertEqual(reader.index['games'], 2)
+            record = reader[2]
+            self.assertEqual(decode_move(record['move'], record['turn']), self.moves[2])
+            self.assertEqual(record['outcome'], 1)
+            self.assertEqual(reader[3]['outcome'], -1)
+            self.assertEqual(reader[6]['outcome'], 0)
+            self.assertEqual(int(abs(record['board']).sum()), 2)
+            self.assertEqual(len(reader.sample(10)), 10)
+
+    def test_augmentation_keeps_move_on_board(self):
+        with tempfile.TemporaryDirectory() as path:
+            with DatasetWriter(path, augment=True) as writer:
+                writer.add_game(self.moves, WHITE)
+            reader = DatasetReader(path)
+            self.assertEqual(len(reader), 8 * len(self.moves))
+            for record in reader:
+                move = decode_move(record['move'], record['turn'])
+                self.assertEqual(record['board'][move.i][move.j], BLANK)
+                self.assertEqual(int((record['board'] != BLANK).sum()), record['ply'])
+            boards = {reader[index]['board'].tobytes() for index in range(8 * 3, 8 * 4)}
+            self.assertEqual(len(boards), 8)
+
+    def test_self_play_scores(self):
+        config = EngineConfig('alphabeta-d1', 1)
+        results = run_self_play(2, config, config, seed=0, processes=1, opening_moves=2, max_moves=20, board_size=9, rule='freestyle').results
+        with tempfile.TemporaryDirectory() as path:
+            with DatasetWriter(path, board_size=9) as writer:
+                for result in results:
+                    writer.add_game(result.moves, result.winner, result.move_scores)
+            records = np.concatenate([np.asarray(shard) for shard in DatasetReader(path).shards])
+        # the random opening moves are not searched
+        opening = records['ply'] < 2
+        self.assertTrue(np.isnan(records['score'][opening]).all())
+        scores = records['score'][~opening]
+        self.assertTrue(len(scores) and np.isfinite(scores).all())
+        self.assertTrue((np.abs(scores) <= 1).all())
+        # the winner's last move is scored as a win
+        for result in results:
+            if result.winner is not None:
+                self.assertEqual(result.move_scores[-1], 1.0)
+
+
+class TuneTest(unittest.TestCase):
+    def test_fit_recovers_coefficients(self):
+        rng = np.random.default_rng(0)
+        x = rng.integers(0, 4, size=(20000, 3)).astype(np.float64)
+        coefficients = np.array([0.5, -0.25, 1.0])
+        y = (rng.random(len(x)) < 1 / (1 + np.exp(-(x @ coefficients - 1)))).astype(np.float64)
+        fitted, intercept = tune.fit_logistic(x, y, l2=0)
+        np.testing.assert_allclose(fitted, coefficients, atol=0.08)
+        self.assertAlmostEqual(intercept, -1, delta=0.15)
+
+    def test_weights_file_from_dataset(self):
+        path = enter_context(self, tempfile.TemporaryDirectory())
+        config = EngineConfig('alphabeta-d1', 1)
+        games = run_self_play(4, config, config, seed=0, processes=1, max_moves=40, board_size=9, rule='freestyle')
+        with DatasetWriter(path, board_size=9) as writer:
+            for result in games.results:
+                writer.add_game(result.moves, result.winner)
+        boards, colors, outcomes = tune.positions_from_dataset(DatasetReader(path))
+        self.assertEqual(len(boards), sum(len(result.moves) for result in games.results if result.winner is not None))
+        weights, report = tune.tune(boards, colors, outcomes)
+        self.assertEqual(len(weights), len(WEIGHTS))
+        self.assertLessEqual(report['log_loss'], report['default_log_loss'] + 1e-9)
+
+        weights_path = os.path.join(path, 'weights.json')
+        with open(weights_path, 'w') as f:
+            json.dump(dict(weights=dict(zip(FEATURES, weights))), f)
+        self.assertEqual(load_weights(weights_path), weights)
+        self.assertEqual(EngineConfig('tuned', 1, weights=weights_path).create_agent().weights, weights)
+        self.assertEqual(AIAgent(verbose=False).weights, WEIGHTS)
+        # the batch evaluator scores with the same weights
+        rule = rule_of('freestyle')
+        last_moves = [Move(i, j, BLACK) for i, j in zip(*np.nonzero(boards[-1] == BLACK))][:1]
+        self.assertEqual(tuple(batch_scores([boards[-1]], last_moves, rule, weights)[0]),
+                         get_score(boards[-1].tolist(), rule, last_moves[0], weights))
+
+
+class AnnotateTest(unittest.TestCase):
+    # black makes a four at the edge, white does not block it and black wins
+    MOVES = [(4, 0), (0, 8), (4, 1), (8, 0), (4, 2), (8, 8), (4, 3), (0, 4), (4, 4)]
+
+    def blunder_record(self):
+        moves = [Move(i, j, BLACK if index % 2 == 0 else WHITE) for index, (i, j) in enumerate(self.MOVES)]
+        return GameRecord(str(uuid.uuid4()), moves, BLACK, 'freestyle', 0.0, 1.0, 9)
+
+    def make_store(self, path):
+        store = enter_context(self, GameStore(path))
+        store.append(self.blunder_record())
+        config = EngineConfig('alphabeta-d1', 1)
+        for result in run_self_play(2, config, config, seed=0, processes=1, max_moves=20, board_size=9, rule='freestyle').results:
+            store.append(GameRecord(str(uuid.uuid4()), result.moves, result.winner, 'freestyle', 0.0, 2.0, 9))
+        return store
+
+    def test_blunder(self):
+        annotation = annotate.annotate_game(self.blunder_record(), depth=2)
+        moves = annotation['moves']
+        self.assertIsNone(moves[0]['best'])
+        self.assertEqual(moves[7]['best'], dict(i=4, j=4))
+        self.assertTrue(moves[7]['blunder'])
+        self.assertEqual(moves[8]['best'], dict(i=4, j=4))
+        self.assertEqual(moves[8]['drop'], 0)
+        self.assertGreaterEqual(annotation['blunders']['white'], 1)
+        self.assertLess(annotation['accuracy']['white'], annotation['accuracy']['black'])
+
+    def test_resume_from_checkpoint(self):
+        path = enter_context(self, tempfile.TemporaryDirectory())
+        store = self.make_store(os.path.join(path, 'games'))
+        output = os.path.join(path, 'annotated.jsonl')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(annotate.annotate_store(store, output, processes=1, checkpoint_every=1, limit=2), 2)
+            # interrupted while writing the third game
+            with open(output, 'ab') as f:
+                f.write(b'{"game_id": ')
+            self.assertEqual(annotate.annotate_store(store, output, processes=2), 3)
+            fresh = os.path.join(path, 'fresh.jsonl')
+            annotate.annotate_store(store, fresh, processes=1)
+        with open(output) as f, open(fresh) as g:
+            annotated = [json.loads(line) for line in f]
+            self.assertEqual(annotated, [json.loads(line) for line in g])
+        self.assertEqual([game['game_id'] for game in annotated], [entry.game_id for entry in store.entries])
+        self.assertEqual(annotate.read_checkpoint(output + '.checkpoint'), (3, os.path.getsize(output)))
+
+
+class GameStoreTest(unittest.TestCase):
+    def record(self, index: int, moves: list[Move], winner=BLACK):
+        return GameRecord(str(uuid.UUID(int=index)), moves, winner, 'renju', started=100.0 + index, finished=110.0 + index)
+
+    def test_round_trip(self):
+        moves = [Move(7, 7, BLACK), Move(7, 8, WHITE), Move(8, 8, WHITE), Move(0, 14, BLACK)]
+        with tempfile.TemporaryDirectory() as path:
+            with GameStore(path) as store:
+                store.append(self.record(1, moves))
+                store.append(self.record(2, [], None))
+                # readable before the batch is synced
+                self.assertEqual(store.get(str(uuid.UUID(int=1))).moves, moves)
+            with GameStore(path) as store:
+                records = list(store)
+                self.assertEqual([r.game_id for r in records], [str(uuid.UUID(int=1)), str(uuid.UUID(int=2))])
+                # the pass of black before the second white move is kept
+                self.assertEqual(records[0].moves, moves)
+                self.assertEqual(records[0].winner, BLACK)
+                self.assertIsNone(records[1].winner)
+                self.assertEqual(records[0].started, 101.0)
+                self.assertEqual([e.game_id for e in store.entries_between(111.5, 200)], [str(uuid.UUID(int=2))])
+                # header and one byte a move
+                self.assertEqual(store.entries[0].length, RECORD_HEADER.size + 5)
+
+    def test_segments_and_recovery(self):
+        moves = [Move(7, j, BLACK if j % 2 == 0 else WHITE) for j in range(10)]
+        with tempfile.TemporaryDirectory() as path:
+            with GameStore(path, segment_size=100, sync_every=2) as store:
+                for index in range(5):
+                    store.append(self.record(index, moves))
+            self.assertEqual(len([name for name in os.listdir(path) if name.startswith('segment-')]), 5)
+            # a torn write at the end of the last segment and the index
+            with open(os.path.join(path, 'segment-00004.log'), 'r+b') as f:
+                f.truncate(20)
+            with open(os.path.join(path, 'index.bin'), 'ab') as f:
+                f.write(b'\0' * 7)
+            with GameStore(path, segment_size=100) as store:
+                self.assertEqual(len(store), 4)
+                self.assertEqual([r.moves for r in store], [moves] * 4)
+                store.append(self.record(9, moves))
+            # the torn record is gone, the new one takes its place
+            self.assertEqual(os.path.getsize(os.path.join(path, 'segment-00004.log')), RECORD_HEADER.size + 10)
+            with GameStore(path) as store:
+                self.assertEqual(len(store), 5)
+                self.assertIn(str(uuid.UUID(int=9)), store)
+
+
+class TournamentTest(unittest.TestCase):
+    engines = [EngineConfig('a', 1), EngineConfig('b', 1), EngineConfig('c', 2)]
+
+    def test_colors_are_balanced(self):
+        jobs = make_jobs(self.engines, GAUNTLET)
+        self.assertEqual(len(jobs), 2 * 2 * len(OPENINGS))
+        for engine in self.engines[1:]:
+            self.assertEqual(sum(job.black is engine for job in jobs), sum(job.white is engine for job in jobs))
+        self.assertEqual(len({job.seed for job in jobs}), len(jobs))
+
+    def test_elo(self):
+        ratings = fit_elo(['a', 'b'], [('a', 'b', 1.0)] * 3 + [('b', 'a', 1.0)])
+        self.assertEqual(ratings['a'], 0)
+        self.assertLess(ratings['b'], 0)
+        ratings = fit_elo(['a', 'b'], [('a', 'b', 0.5)] * 4)
+        self.assertAlmostEqual(ratings['b'], 0)
+
+    def test_standings(self):
+        moves = [Move(7, 7, BLACK), Move(7, 8, WHITE), Move(8, 8, BLACK)]
+        results = [
+            SelfPlayResult(0, 'a', 'b', BLACK, moves, 1.0, [0.0, 0.2, 0.4], [0, 10, 30]),
+            SelfPlayResult(1, 'b', 'a', BLACK, moves, 1.0, [0.0, 0.2, 0.4], [0, 10, 30]),
+            SelfPlayResult(2, 'a', 'b', None, moves, 1.0, [0.0, 0.2, 0.4], [0, 10, 30]),
+        ]
+        standings = {s.name: s for s in compute_standings(self.engines[:2], results, bootstrap=20)}
+        self.assertEqual((standings['a'].wins, standings['a'].draws, standings['a'].losses), (1, 1, 1))
+        self.assertEqual(standings['a'].moves, 3)
+        self.assertEqual(standings['a'].nodes, 30 + 10 + 30)
+        self.assertLessEqual(standings['b'].elo_low, standings['b'].elo_high)
+
+
+class SymmetryTest(unittest.TestCase):
+    board = parse_board('''
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        .......XX......
+        ......XO.......
+        ......OOX......
+        .....O.........
+        ....OO.........
+        ...X...........
+        ...............
+        ...............
+        ...............
+        ...............
+    ''')
+
+    def test_canonical_key_is_symmetric(self):
+        keys = set()
+        for k in TRANSFORMS:
+            board = transform_board(self.board, k)
+            keys.add(canonical_key(board, Move(*transform_point(4, 8, 15, k), WHITE)))
+        self.assertEqual(len(keys), 1)
+        self.assertNotEqual(canonical_key(self.board, Move(4, 8, WHITE)), canonical_key(self.board, Move(4, 8, BLACK)))
+
+    def test_incremental_hash(self):
+        board = [row[:] for row in self.board]
+        position_hash = SymmetricHash(board)
+        key = position_hash.key
+        position_hash.toggle(4, 8, WHITE)
+        board[4][8] = WHITE
+        self.assertEqual(position_hash.hashes, board_hashes(board))
+        position_hash.toggle(4, 8, WHITE)
+        self.assertEqual(position_hash.key, key)
+
+    def test_move_mapping(self):
+        for k in TRANSFORMS:
+            position_hash = SymmetricHash(transform_board(self.board, k))
+            canonical = position_hash.to_canonical(*transform_point(4, 8, 15, k))
+            self.assertEqual(position_hash.from_canonical(*canonical), transform_point(4, 8, 15, k))
+            self.assertEqual(canonical, SymmetricHash(self.board).to_canonical(4, 8))
+
+    def test_canonical_moves(self):
+        moves = [Move(7, 7, BLACK), Move(6, 8, WHITE), Move(8, 8, BLACK)]
+        k, canonical = canonical_moves(moves, 15)
+        for transform in TRANSFORMS:
+            transformed = [Move(*transform_point(m.i, m.j, 15, transform), m.color) for m in moves]
+            self.assertEqual(canonical_moves(transformed, 15)[1], canonical)
+
+
+class BenchTest(unittest.TestCase):
+    def test_corpus_is_reproducible(self):
+        self.assertEqual(bench.sample_positions(2, seed=1), bench.sample_positions(2, seed=1))
+        self.assertEqual(len(bench.corpus(2, seed=1)), len(bench.BOARDS) + 2)
+
+    def test_compare(self):
+        baseline = dict(results=dict(a=dict(ops=10, ops_per_second=100.0), b=dict(ops=1, nodes=50, ops_per_second=1.0, nodes_per_second=50.0)))
+        report = dict(results=dict(a=dict(ops=10, ops_per_second=80.0), b=dict(ops=1, nodes=50, ops_per_second=1.0, nodes_per_second=55.0)))
+        ratios, regressions = bench.compare(report, baseline, tolerance=0.1)
+        self.assertEqual(regressions, ['a'])
+        self.assertAlmostEqual(ratios['b'], 1.1)
+
+
+class PerftTest(unittest.TestCase):
+    board = parse_board('''
+        ...............
+        ...............
+        ...............
+        ...............
+        ...............
+        .......O.......
+        .......O.......
+        .....OO........
+        ...............
+        ...............
+        ..OOO.OO.......
+        ...............
+        ...............
+        .........X.X...
+        ...............
+    ''')
+
+    def test_fouls_and_counts(self):
+        result = perft([row[:] for row in self.board], BLACK, 1, radius=1)
+        self.assertEqual(result.fouls, {'double-three': 1, 'overline': 1})
+        self.assertEqual(result.nodes[1], result.leaves)
+        self.assertEqual(result.wins, 0)
+        self.assertEqual(sum(result.patterns.values()), result.leaves)
+        self.assertEqual(perft([row[:] for row in self.board], BLACK, 2, radius=1, patterns=False).nodes[1], result.leaves)
+
+    def test_differential(self):
+        class NoFoulRule(RenjuRule):
+            is_legal_move = Rule.is_legal_move
+
+        board = [row[:] for row in self.board]
+        self.assertEqual(perft(board, BLACK, 1, radius=1, reference=RenjuRule()).mismatches, [])
+        mismatches = perft(board, BLACK, 1, NoFoulRule(), radius=1, reference=RenjuRule()).mismatches
+        self.assertEqual({(m[0], m[2]) for m in mismatches if m[0] == 'is_legal_move'}, {('is_legal_move', (7, 7, BLACK)), ('is_legal_move', (10, 5, BLACK))})
+        self.assertEqual(board, self.board)
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_throttle(self):
+        with tempfile.TemporaryDirectory() as path:
+            profiler = Profiler(rate=1.0, directory=path, max_per_minute=2)
+            for move_number in range(1, 4):
+                with profiler.profile('arena', move_number, 'search'):
+                    sum(range(100))
+            self.assertEqual(sorted(os.listdir(path)), ['arena-001-search.prof', 'arena-002-search.prof'])
+
+    def test_disabled(self):
+        with tempfile.TemporaryDirectory() as path:
+            profiler = Profiler(rate=0.0, directory=path)
+            with profiler.profile('arena', 1, 'search') as profile:
+                self.assertIsNone(profile)
+            profiler.configure(rate=5)
+            self.assertEqual(profiler.rate, 1.0)
+            self.assertEqual(os.listdir(path), [])
+
+
+def enter_context(test: unittest.TestCase, context):
+    """
+    Enter a context manager until the test is cleaned up, TestCase.enterContext before Python 3.11.
+    """
+    result = context.__enter__()
+    test.addCleanup(context.__exit__, None, None, None)
+    return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def start_server(game_dir: str):
+    port = free_port()
+    task = asyncio.create_task(server.serve('127.0.0.1', port, game_dir))
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return task, port
+        except OSError:
+            await asyncio.sleep(0.02)
+    raise RuntimeError('server did not start')
+
+
+class MetricsTest(unittest.IsolatedAsyncioTestCase):
+    def test_render(self):
+        registry = Registry()
+        counter = registry.register(Counter('c_total', 'help'))
+        counter.inc(3, type='MOVE')
+        histogram = registry.register(Histogram('h', 'help', (1, 2)))
+        histogram.observe(1.5)
+        text = registry.render()
+        self.assertIn('c_total{type="MOVE"} 3', text)
+        self.assertIn('h_bucket{le="1"} 0', text)
+        self.assertIn('h_bucket{le="2"} 1', text)
+        self.assertIn('h_bucket{le="+Inf"} 1', text)
+        self.assertIn('# TYPE h histogram', text)
+
+    async def test_metrics_endpoint(self):
+        import websockets
+        task, port = await start_server(enter_context(self, tempfile.TemporaryDirectory()))
+        try:
+            async with websockets.connect(f'ws://127.0.0.1:{port}') as websocket:
+                self.assertEqual(json.loads(await websocket.recv())['type'], 'ARENA_LIST')
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            response = (await reader.read()).decode()
+            writer.close()
+            self.assertIn('200 OK', response)
+            self.assertIn('gomoku_arenas{state="waiting"}', response)
+            self.assertIn('gomoku_event_loop_lag_seconds_count', response)
+        finally:
+            task.cancel()
+
+
+async def receive_until(websocket, type: str):
+    while True:
+        message = json.loads(await websocket.recv())
+        if message['type'] == type:
+            return message['data']
+
+
+class ArenaOptionsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.task, self.port = await start_server(enter_context(self, tempfile.TemporaryDirectory()))
+        enter_context(self, contextlib.redirect_stdout(io.StringIO()))
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+
+    async def test_create_arena_with_board_size(self):
+        import websockets
+        async with websockets.connect(f'ws://127.0.0.1:{self.port}') as websocket:
+            await receive_until(websocket, 'ARENA_LIST')
+            await websocket.send(json.dumps(dict(type='CREATE_ARENA', data=dict(title='small', players=1, spectator=False, boardSize=3))))
+            # rejected, the arena list is sent again without it
+            self.assertNotIn('small', [arena['title'] for arena in (await receive_until(websocket, 'ARENA_LIST'))['arenas']])
+            await websocket.send(json.dumps(dict(type='CREATE_ARENA', data=dict(title='small', players=1, spectator=False, boardSize=9))))
+            self.assertEqual((await receive_until(websocket, 'ARENA_STATE'))['boardSize'], 9)
+            # the player gets the board with a move request when it plays black
+            while True:
+                message = json.loads(await websocket.recv())
+                if message['type'] in ('GAME_STATE', 'REQUEST_MOVE'):
+                    break
+            self.assertEqual(len(message['data']['board']), 9)
+
+    async def test_create_arena_with_rule(self):
+        import websockets
+        async with websockets.connect(f'ws://127.0.0.1:{self.port}') as websocket:
+            await receive_until(websocket, 'ARENA_LIST')
+            await websocket.send(json.dumps(dict(type='CREATE_ARENA', data=dict(title='rule', players=1, spectator=False, rule='caro'))))
+            # rejected, the arena list is sent again without it
+            self.assertNotIn('rule', [arena['title'] for arena in (await receive_until(websocket, 'ARENA_LIST'))['arenas']])
+            await websocket.send(json.dumps(dict(type='CREATE_ARENA', data=dict(title='rule', players=1, spectator=False, rule='freestyle'))))
+            self.assertEqual((await receive_until(websocket, 'ARENA_STATE'))['rule'], 'freestyle')
+            self.assertIsInstance(server.arenas[(await receive_until(websocket, 'ARENA_STATE'))['id']].game.rule, GomokuRule)
+
+
+class AnalysisTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        enter_context(self, contextlib.redirect_stdout(io.StringIO()))
+
+    async def test_top_moves(self):
+        board, turn = parse_board(bench.BOARDS['double-threat'][0]), bench.BOARDS['double-threat'][1]
+        analysis = await AnalysisCache().analyze(board, RenjuRule(), turn, 2, 3)
+        self.assertEqual(len(analysis.moves), 3)
+        self.assertEqual(len({(move.move.i, move.move.j) for move in analysis.moves}), 3)
+        agent = AIAgent(max_depth=2, verbose=False)
+        agent.color = turn
+        _, best = agent.select_move(board, RenjuRule(), Move(8, 8, -turn))
+        self.assertEqual(analysis.moves[0].move, best)
+        for move in analysis.moves:
+            self.assertEqual(move.principal_variation[0], move.move)
+            self.assertTrue(all(board[pv.i][pv.j] == BLANK for pv in move.principal_variation))
+        scores = [pack_score(move.score) for move in analysis.moves]
+        self.assertEqual(scores, sorted(scores, reverse=turn == BLACK))
+
+    async def test_cache_is_shared_by_symmetric_positions(self):
+        cache = AnalysisCache()
+        board, turn = parse_board(bench.BOARDS['crowded'][0]), bench.BOARDS['crowded'][1]
+        # concurrent requests wait for the same search
+        first, second = await asyncio.gather(*[cache.analyze(board, RenjuRule(), turn, 2, 2) for _ in range(2)])
+        self.assertEqual(cache.searches, 1)
+        self.assertEqual((first.cached, second.cached), (False, True))
+        self.assertEqual(first.moves, second.moves)
+        size = len(board)
+        for k in TRANSFORMS:
+            transformed = await cache.analyze(transform_board(board, k), RenjuRule(), turn, 2, 1)
+            self.assertTrue(transformed.cached)
+            move = first.moves[0].move
+            self.assertEqual(transformed.moves[0].move, Move(*transform_point(move.i, move.j, size, k), move.color))
+        self.assertEqual(cache.searches, 1)
+        # another depth, rule or more moves are another search
+        await cache.analyze(board, RenjuRule(), turn, 1, 2)
+        await cache.analyze(board, GomokuRule(), turn, 2, 2)
+        self.assertFalse((await cache.analyze(board, RenjuRule(), turn, 2, 3)).cached)
+        self.assertEqual(cache.searches, 4)
+
+    async def test_analyze_message(self):
+        import websockets
+        task, port = await start_server(enter_context(self, tempfile.TemporaryDirectory()))
+        try:
+            async with websockets.connect(f'ws://127.0.0.1:{port}') as websocket:
+                await receive_until(websocket, 'ARENA_LIST')
+                moves = [dict(i=4, j=4), dict(i=4, j=5), dict(i=5, j=5)]
+                await websocket.send(json.dumps(dict(type='ANALYZE', data=dict(moves=moves, boardSize=9, rule='freestyle', depth=2, top=2))))
+                analysis = await receive_until(websocket, 'ANALYSIS')
+                self.assertEqual(analysis['turn'], WHITE)
+                self.assertEqual(len(analysis['moves']), 2)
+                self.assertEqual(analysis['moves'][0]['principalVariation'][0], analysis['moves'][0]['move'])
+                # the same position as a board
+                board = [[0] * 9 for _ in range(9)]
+                board[4][4] = board[5][5] = BLACK
+                board[4][5] = WHITE
+                await websocket.send(json.dumps(dict(type='ANALYZE', data=dict(board=board, rule='freestyle', depth=2, top=1))))
+                cached = await receive_until(websocket, 'ANALYSIS')
+                self.assertTrue(cached['cached'])
+                self.assertEqual(cached['moves'], analysis['moves'][:1])
+                for data in (dict(moves=moves, depth=99), dict(board=[[0, 1], [1]]), dict(moves=[dict(i=0, j=0)] * 2)):
+                    await websocket.send(json.dumps(dict(type='ANALYZE', data=data)))
+                    message = json.loads(await websocket.recv())
+                    self.assertEqual(message['type'], 'ANALYSIS')
+                    self.assertIsNone(message['data'])
+                    self.assertTrue(message['message'])
+
+                # spectators ask about the game they watch
+                await websocket.send(json.dumps(dict(type='CREATE_ARENA', data=dict(title='analysis', players=0, spectator=True))))
+                await receive_until(websocket, 'START_GAME')
+                await websocket.send(json.dumps(dict(type='ANALYZE', data=dict(depth=1, top=1))))
+                while True:
+                    message = json.loads(await websocket.recv())
+                    if message['type'] == 'ANALYSIS':
+                        break
+                self.assertTrue(message['data'] is not None or message['message'] == 'The game is over')
+        finally:
+            task.cancel()
+
+
+class ReconnectTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.task, self.port = await start_server(enter_context(self, tempfile.TemporaryDirectory()))
+        enter_context(self, contextlib.redirect_stdout(io.StringIO()))
+        self.addCleanup(setattr, server, 'reconnect_grace', server.reconnect_grace)
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+
+    async def start_game(self):
+        """
+        Two clients in a new arena, returns (websocket, START_GAME data) of black and white.
+        """
+        import websockets
+        first = await websockets.connect(f'ws://127.0.0.1:{self.port}')
+        second = await websockets.connect(f'ws://127.0.0.1:{self.port}')
+        await first.send(json.dumps(dict(type='CREATE_ARENA', data=dict(title='reconnect', players=2, spectator=False))))
+        self.arena_id = (await receive_until(first, 'ARENA_STATE'))['id']
+        await second.send(json.dumps(dict(type='ENTER_ARENA', data=dict(id=self.arena_id))))
+        clients = [(first, await receive_until(first, 'START_GAME')), (second, await receive_until(second, 'START_GAME'))]
+        clients.sort(key=lambda client: -client[1]['color'])
+        return clients
+
+    async def test_resume_with_missed_moves(self):
+        import websockets
+        (black, black_start), (white, _) = await self.start_game()
+        await receive_until(black, 'REQUEST_MOVE')
+        await black.send(json.dumps(dict(type='MOVE', data=dict(i=7, j=7))))
+        await receive_until(black, 'GAME_STATE')
+        # dropped without a close frame
+        black.transport.abort()
+        await receive_until(white, 'REQUEST_MOVE')
+        await white.send(json.dumps(dict(type='MOVE', data=dict(i=7, j=8))))
+        await asyncio.sleep(0.1)
+
+        async with websockets.connect(f'ws://127.0.0.1:{self.port}') as black:
+            await black.send(json.dumps(dict(type='RECONNECT', data=dict(token=black_start['token'], moves=1))))
+            self.assertEqual(await receive_until(black, 'START_GAME'), black_start)
+            delta = await receive_until(black, 'GAME_DELTA')
+            self.assertEqual(delta['moves'], [dict(i=7, j=8, color=WHITE)])
+            self.assertEqual(delta['version'], 2)
+            self.assertEqual(delta['nextTurn'], BLACK)
+            self.assertEqual(len((await receive_until(black, 'REQUEST_MOVE'))['moves']), 2)
+            await black.send(json.dumps(dict(type='MOVE', data=dict(i=8, j=8))))
+            state = await receive_until(white, 'REQUEST_MOVE')
+            self.assertEqual(state['moves'][-1], dict(i=8, j=8, color=BLACK))
+            self.assertFalse(state['isGameOver'])
+        await white.close()
+
+    async def test_forfeit_after_grace_period(self):
+        import websockets
+        server.reconnect_grace = 0.2
+        (black, black_start), (white, _) = await self.start_game()
+        black.transport.abort()
+        state = await receive_until(white, 'GAME_STATE')
+        while not state['isGameOver']:
+            state = await receive_until(white, 'GAME_STATE')
+        self.assertEqual(state['winner'], WHITE)
+        await white.close()
+        for _ in range(20):
+            if self.arena_id not in server.arenas:
+                break
+            await asyncio.sleep(0.05)
+        self.assertNotIn(self.arena_id, server.arenas)
+        # the token is gone with the arena
+        async with websockets.connect(f'ws://127.0.0.1:{self.port}') as black:
+            await receive_until(black, 'ARENA_LIST')
+            await black.send(json.dumps(dict(type='RECONNECT', data=dict(token=black_start['token']))))
+            self.assertEqual(json.loads(await black.recv())['type'], 'ARENA_LIST')
+
+
+class LifecycleTest(unittest.IsolatedAsyncioTestCase):
+    def test_timer_wheel(self):
+        wheel = TimerWheel(tick=1.0, slots=4)
+        wheel.schedule('a', 2.5)
+        wheel.schedule('b', 9.0)
+        wheel.schedule('c', 1.0)
+        wheel.cancel('c')
+        self.assertEqual(wheel.advance(2.0), [])
+        self.assertEqual(wheel.advance(3.0), ['a'])
+        # two turns of the wheel away
+        self.assertEqual(wheel.advance(8.5), [])
+        self.assertEqual(wheel.advance(9.0), ['b'])
+        self.assertEqual(len(wheel), 0)
+
+    async def test_expire_and_cap(self):
+        now = [0.0]
+        arenas = dict()
+        removed = []
+        lifecycle = ArenaLifecycle(arenas, max_arenas=3, empty_timeout=10, waiting_timeout=100, idle_timeout=100,
+                                   on_remove=removed.append, clock=lambda: now[0])
+        first, second, third = Arena('first', 2, False), Arena('second', 2, False), Arena('third', 2, False)
+        for arena, active in ((first, 0.0), (second, 5.0), (third, 6.0)):
+            arena.last_active = active
+            lifecycle.add(arena)
+        third.attach_agent(RandomMoveAgent(0))
+        third.last_active = 6.0
+        self.assertEqual(lifecycle.counts(), dict(empty=2, waiting=1, playing=0, finished=0))
+
+        # the oldest empty arena makes room
+        fourth = Arena('fourth', 2, False)
+        fourth.last_active = 7.0
+        lifecycle.add(fourth)
+        self.assertNotIn(first.arena_id, arenas)
+        self.assertEqual(removed, [first])
+
+        second.last_active = 12.0
+        self.assertEqual(lifecycle.tick(now=18.0), [fourth.arena_id])
+        # touched after its timer was set, so it lives on
+        self.assertIn(second.arena_id, arenas)
+        self.assertEqual(lifecycle.tick(now=23.0), [second.arena_id])
+        self.assertEqual(lifecycle.tick(now=106.0), [third.arena_id])
+        self.assertEqual(arenas, dict())
+
+        for index in range(3):
+            arena = Arena(f'waiting {index}', 2, False)
+            arena.attach_agent(RandomMoveAgent(index))
+            lifecycle.add(arena)
+        with self.assertRaises(ArenaLimitError):
+            lifecycle.add(Arena('too many', 2, False))
+
+    async def test_idle_game_ends(self):
+        arenas = dict()
+        lifecycle = ArenaLifecycle(arenas, empty_timeout=0.1, idle_timeout=0.1, tick=0.05)
+        with contextlib.redirect_stdout(io.StringIO()):
+            arena = Arena('idle', 2, False)
+            lifecycle.add(arena)
+            arena.attach_agent(IdleAgent())
+            arena.attach_agent(IdleAgent())
+            for _ in range(20):
+                await asyncio.sleep(0.05)
+                lifecycle.tick()
+                if not arenas:
+                    break
+        self.assertTrue(arena.game.is_game_over)
+        self.assertIsNone(arena.game.winner)
+        self.assertEqual(arenas, dict())
+
+
+class IdleAgent(Agent):
+    async def request_move(self, state):
+        pass
+
+
+class LoadGenTest(unittest.IsolatedAsyncioTestCase):
+    async def test_run_load(self):
+        task, port = await start_server(enter_context(self, tempfile.TemporaryDirectory()))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                report = await loadgen.run_load(
+                    f'ws://127.0.0.1:{port}', ai_arenas=1, pvp_arenas=1, spectators=2, max_moves=2, think_time=0,
+                    duration=30, ramp_up=0, server_pid=os.getpid(), seed=0,
+                )
+                for _ in range(50):
+                    if len(server.game_store) == 2:
+                        break
+                    await asyncio.sleep(0.1)
+            stored = list(server.game_store)
+        finally:
+            task.cancel()
+        self.assertEqual(report.clients, 5)
+        self.assertEqual(report.failed_clients, 0)
+        self.assertEqual(len(report.connect_times), 5)
+        self.assertGreaterEqual(len(report.move_latencies), 4)
+        # the client that leaves first gives up, its opponent sees the end of the game
+        self.assertGreaterEqual(report.games_finished, 1)
+        self.assertTrue(report.rss)
+        self.assertLess(report.elapsed, 30)
+        # both games end when a client leaves, and are stored with the moves played until then
+        self.assertEqual(len(stored), 2)
+        self.assertTrue(all(record.moves and record.rule == 'renju' for record in stored))
+
+
+class DistributedSelfPlayTest(unittest.IsolatedAsyncioTestCase):
+    def make_jobs(self, games):
+        config = EngineConfig('alphabeta-d1', 1)
+        return make_selfplay_jobs(games, config, config, seed=0, max_moves=20, board_size=9, rule='freestyle')
+
+    async def test_workers_play_all_jobs(self):
+        jobs = self.make_jobs(4)
+        store = enter_context(self, GameStore(enter_context(self, tempfile.TemporaryDirectory())))
+        with contextlib.redirect_stdout(io.StringIO()):
+            coordinator = await Coordinator(jobs, store).start('127.0.0.1', 0)
+            try:
+                played = await asyncio.gather(*[
+                    run_worker('127.0.0.1', coordinator.port, batch_size=2, name=f'worker-{index}') for index in range(2)
+                ])
+                report = await coordinator.wait()
+            finally:
+                await coordinator.close()
+        self.assertEqual(sum(played), 4)
+        self.assertEqual(coordinator.reassigned, 0)
+        # the same games as played locally, stored under the job ids
+        local = run_jobs(jobs, processes=1)
+        self.assertEqual([(result.seed, result.moves, result.winner) for result in report.results],
+                         [(result.seed, result.moves, result.winner) for result in local.results])
+        self.assertEqual({record.game_id for record in store}, set(coordinator.jobs))
+        self.assertTrue(all(record.board_size == 9 and record.rule == 'freestyle' for record in store))
+
+    async def test_jobs_of_lost_workers_are_reassigned(self):
+        jobs = self.make_jobs(3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            coordinator = await Coordinator(jobs, lease_timeout=0.4, wait_seconds=0.1).start('127.0.0.1', 0)
+            try:
+                # one worker hangs with two jobs, another disconnects with the last one
+                silent = await asyncio.open_connection('127.0.0.1', coordinator.port)
+                silent[1].write(encode_message('REQUEST_JOBS', dict(count=2)))
+                self.assertEqual(len((await read_message(silent[0]))['data']['jobs']), 2)
+                reader, writer = await asyncio.open_connection('127.0.0.1', coordinator.port)
+                writer.write(encode_message('REQUEST_JOBS', dict(count=2)))
+                self.assertEqual(len((await read_message(reader))['data']['jobs']), 1)
+                writer.close()
+                played = await run_worker('127.0.0.1', coordinator.port, heartbeat=0.1)
+                report = await coordinator.wait()
+                silent[1].close()
+            finally:
+                await coordinator.close()
+        self.assertEqual(played, 3)
+        self.assertEqual(coordinator.reassigned, 3)
+        self.assertEqual([result.seed for result in report.results], [job.seed for job in jobs])
+
+
+class RandomMoveAgent(Agent):
+    """
+    Plays a random blank position after a short delay, like a client on the network.
+    """
+
+    def __init__(self, seed: int):
+        super(RandomMoveAgent, self).__init__()
+        self.random = random.Random(seed)
+
+    async def request_move(self, state):
+        await asyncio.sleep(0.01)
+        blanks = [(i, j) for i, row in enumerate(state.board) for j, c in enumerate(row) if c == BLANK]
+        i, j = self.random.choice(blanks)
+        self.put_event(Arena.MOVE, Move(i, j, self.color))
+
+
+class LoopLagTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # the debug mode of the test loop slows down every callback, which is not the lag under test
+        asyncio.get_running_loop().set_debug(False)
+
+    async def test_simulated_arenas(self):
+        arenas = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for index in range(100):
+                arena = Arena(f'arena {index}', 2, False)
+                arena.attach_agent(RandomMoveAgent(2 * index))
+                arena.attach_agent(RandomMoveAgent(2 * index + 1))
+                arenas.append(arena)
+            watchdog = LoopWatchdog(threshold=0.25, log=lambda message: None).start()
+            try:
+                await asyncio.sleep(2)
+            finally:
+                for arena in arenas:
+                    if arena.game_task is not None:
+                        arena.game_task.cancel()
+                await watchdog.stop()
+        self.assertTrue(any(len(arena.game.moves) > 5 for arena in arenas))
+        self.assertGreater(len(watchdog.lags), 10)
+        self.assertLess(watchdog.lag_percentile(99), 0.1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,196 @@
+import argparse
+import math
+from dataclasses import dataclass
+from itertools import combinations
+from random import Random
+
+from rule import BLACK, WHITE
+from selfplay import EngineConfig, SelfPlayJob, SelfPlayResult, run_jobs
+
+# Stones are given as (di, dj) offsets from the center, played alternately starting with black.
+OPENINGS = {
+    'direct-a': [(0, 0), (-1, 0), (-2, 1)],
+    'direct-b': [(0, 0), (-1, 0), (-1, 1)],
+    'direct-c': [(0, 0), (-1, 0), (0, 2)],
+    'indirect-a': [(0, 0), (-1, 1), (-2, 0)],
+    'indirect-b': [(0, 0), (-1, 1), (0, 1)],
+    'indirect-c': [(0, 0), (-1, 1), (1, 1)],
+}
+
+ROUND_ROBIN = 'round-robin'
+GAUNTLET = 'gauntlet'
+
+
+@dataclass
+class Standing:
+    name: str
+    games: int = 0
+    wins: int = 0
+    draws: int = 0
+    losses: int = 0
+    elo: float = 0.0
+    elo_low: float = 0.0
+    elo_high: float = 0.0
+    moves: int = 0
+    time: float = 0.0
+    nodes: int = 0
+
+    @property
+    def score(self):
+        return self.wins + self.draws / 2
+
+    @property
+    def time_per_move(self):
+        return self.time / self.moves if self.moves else 0.0
+
+    @property
+    def nodes_per_move(self):
+        return self.nodes / self.moves if self.moves else 0.0
+
+    def __str__(self):
+        return f'{self.name:<16} {self.games:>5} {self.wins:>4}/{self.draws:>3}/{self.losses:<4} ' \
+               f'{self.elo:>+7.1f} [{self.elo_low:>+7.1f}, {self.elo_high:>+7.1f}] ' \
+               f'{self.time_per_move * 1000:>9.1f}ms {self.nodes_per_move:>9.1f}'
+
+
+def pairings(engines: list[EngineConfig], mode: str):
+    if mode == ROUND_ROBIN:
+        return list(combinations(engines, 2))
+    if mode == GAUNTLET:
+        return [(engines[0], engine) for engine in engines[1:]]
+    raise ValueError(f'Unknown tournament mode: {mode}')
+
+
+def make_jobs(engines: list[EngineConfig], mode=ROUND_ROBIN, openings: dict = None, rounds=1, seed=0, max_moves=None):
+    """
+    Every pairing plays every opening once with each color.
+    """
+    openings = OPENINGS if openings is None else openings
+    jobs = []
+    for a, b in pairings(engines, mode):
+        for _ in range(rounds):
+            for opening in openings.values():
+                for black, white in ((a, b), (b, a)):
+                    jobs.append(SelfPlayJob(black, white, seed + len(jobs), 0, max_moves, opening))
+    return jobs
+
+
+def game_scores(results: list[SelfPlayResult]):
+    """
+    (player, opponent, score of player) for each game.
+    """
+    scores = []
+    for result in results:
+        if result.winner is None:
+            score = 0.5
+        else:
+            score = 1.0 if result.winner == BLACK else 0.0
+        scores.append((result.black, result.white, score))
+    return scores
+
+
+def fit_elo(names: list[str], scores: list[tuple[str, str, float]], iterations=100):
+    """
+    Bradley-Terry ratings fitted by minorization-maximization, in Elo relative to names[0].
+    A virtual draw is added for every pair that met, so unbeaten engines keep a finite rating.
+    """
+    met = {tuple(sorted((a, b))) for a, b, _ in scores}
+    games = scores + [(a, b, 0.5) for a, b in met]
+    wins = {name: 0.0 for name in names}
+    for a, b, score in games:
+        wins[a] += score
+        wins[b] += 1 - score
+    gamma = {name: 1.0 for name in names}
+    for _ in range(iterations):
+        denominator = {name: 0.0 for name in names}
+        for a, b, _ in games:
+            d = 1 / (gamma[a] + gamma[b])
+            denominator[a] += d
+            denominator[b] += d
+        for name in names:
+            if denominator[name]:
+                gamma[name] = max(wins[name], 1e-9) / denominator[name]
+    anchor = math.log10(gamma[names[0]])
+    return {name: 400 * (math.log10(gamma[name]) - anchor) for name in names}
+
+
+def compute_standings(engines: list[EngineConfig], results: list[SelfPlayResult], bootstrap=200, seed=0, confidence=0.95):
+    names = [engine.name for engine in engines]
+    standings = {name: Standing(name) for name in names}
+    for result in results:
+        for name, color in ((result.black, BLACK), (result.white, WHITE)):
+            standing = standings[name]
+            standing.games += 1
+            if result.winner is None:
+                standing.draws += 1
+            elif result.winner == color:
+                standing.wins += 1
+            else:
+                standing.losses += 1
+            for move, elapsed, nodes in zip(result.moves, result.move_times, result.move_nodes):
+                # opening stones are not searched
+                if move.color == color and nodes:
+                    standing.moves += 1
+                    standing.time += elapsed
+                    standing.nodes += nodes
+
+    scores = game_scores(results)
+    ratings = fit_elo(names, scores)
+    random = Random(seed)
+    samples = {name: [] for name in names}
+    for _ in range(bootstrap):
+        sample = [random.choice(scores) for _ in scores]
+        for name, rating in fit_elo(names, sample).items():
+            samples[name].append(rating)
+    low_index = int(bootstrap * (1 - confidence) / 2)
+    high_index = max(bootstrap - 1 - low_index, 0)
+    for name in names:
+        standings[name].elo = ratings[name]
+        if bootstrap:
+            sample = sorted(samples[name])
+            standings[name].elo_low = sample[low_index]
+            standings[name].elo_high = sample[high_index]
+    return sorted(standings.values(), key=lambda standing: standing.elo, reverse=True)
+
+
+def run_tournament(engines: list[EngineConfig], mode=ROUND_ROBIN, openings: dict = None, rounds=1, seed=0,
+                   max_moves=None, processes=None, on_result=None):
+    jobs = make_jobs(engines, mode, openings, rounds, seed, max_moves)
+    report = run_jobs(jobs, processes, on_result)
+    return compute_standings(engines, report.results, seed=seed), report
+
+
+def parse_engine(spec: str):
+    """
+    name:depth[:width][@weights] or name:mcts[:simulations[:batch_size]]
+    """
+    spec, _, weights = spec.partition('@')
+    name, *values = spec.split(':')
+    if values and values[0] == 'mcts':
+        return EngineConfig(name, engine='mcts', **dict(zip(('simulations', 'batch_size'), map(int, values[1:]))))
+    return EngineConfig(name, *map(int, values), weights=weights or None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tournament between AI engine configurations')
+    parser.add_argument('--engine', action='append', type=parse_engine, required=True,
+                        help='name:depth[:width][@weights] or name:mcts[:simulations[:batch_size]], the first engine is the gauntlet player and the Elo anchor')
+    parser.add_argument('--mode', choices=(ROUND_ROBIN, GAUNTLET), default=ROUND_ROBIN)
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-moves', type=int, default=None)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    standings, report = run_tournament(
+        args.engine, args.mode, rounds=args.rounds, seed=args.seed, max_moves=args.max_moves, processes=args.processes,
+        on_result=lambda result: print(f'{result.black} vs {result.white}: winner {result.winner}, {len(result.moves)} moves'),
+    )
+    print(report)
+    print(f'{"engine":<16} {"games":>5} {"W/D/L":^13} {"elo":>7} {"95% interval":^18} {"time/move":>11} {"nodes/move":>9}')
+    for standing in standings:
+        print(standing)
+
+
+if __name__ == '__main__':
+    main()
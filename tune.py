@@ -0,0 +1,151 @@
+import argparse
+import json
+import math
+
+import numpy as np
+
+from batch_evaluation import batch_features
+from dataset import PASS_MOVE, DatasetReader
+from evaluation import FEATURES, WEIGHTS
+from gamestore import GameStore
+from rule import BOARD_SIZE
+
+
+def positions_from_dataset(reader: DatasetReader, sample: int = None, rng: np.random.Generator = None):
+    """
+    (boards after the move, colors of the move, outcomes for the player who moved) of the decided positions.
+    """
+    records = reader.sample(sample, rng) if sample else np.concatenate([np.asarray(shard) for shard in reader.shards])
+    records = records[(records['move'] != PASS_MOVE) & (records['outcome'] != 0)]
+    boards = records['board'].copy()
+    size = reader.board_size
+    index = np.arange(len(records))
+    boards[index, records['move'] // size, records['move'] % size] = records['turn']
+    return boards, records['turn'].astype(np.int64), records['outcome'].astype(np.int64)
+
+
+def positions_from_store(store: GameStore, board_size: int):
+    boards = []
+    colors = []
+    outcomes = []
+    for record in store:
+        if record.winner is None or record.board_size != board_size:
+            continue
+        board = np.zeros((board_size, board_size), dtype=np.int8)
+        for move in record.moves:
+            board[move.i, move.j] = move.color
+            boards.append(board.copy())
+            colors.append(move.color)
+            outcomes.append(1 if move.color == record.winner else -1)
+    return (
+        np.array(boards, dtype=np.int8).reshape(-1, board_size, board_size),
+        np.array(colors, dtype=np.int64),
+        np.array(outcomes, dtype=np.int64),
+    )
+
+
+def feature_matrix(boards: np.ndarray, colors: np.ndarray, chunk: int = 4096):
+    """
+    Features of get_score for the player who moved, with the features of the opponent negated,
+    so the heuristic sum is feature_matrix @ weights.
+    """
+    rows = []
+    for start in range(0, len(boards), chunk):
+        features, _ = batch_features(boards[start:start + chunk], colors[start:start + chunk])
+        rows.append(features)
+    features = np.concatenate(rows) if rows else np.zeros((0, len(FEATURES)), dtype=np.int64)
+    return (features * np.array([1, 1, 1, 1, -1, -1])).astype(np.float64)
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-np.clip(x, -30, 30)))
+
+
+def fit_logistic(x: np.ndarray, y: np.ndarray, l2: float = 1e-4, iterations: int = 50):
+    """
+    Logistic regression of y in {0, 1} on x and an intercept by Newton's method.
+    Returns (coefficients, intercept).
+    """
+    x = np.concatenate([x, np.ones((len(x), 1))], axis=1)
+    beta = np.zeros(x.shape[1])
+    penalty = np.full(x.shape[1], l2)
+    # the intercept is not penalized
+    penalty[-1] = 0
+    for _ in range(iterations):
+        p = _sigmoid(x @ beta)
+        gradient = x.T @ (p - y) / len(x) + penalty * beta
+        hessian = (x * (p * (1 - p))[:, None]).T @ x / len(x) + np.diag(penalty + 1e-9)
+        step = np.linalg.solve(hessian, gradient)
+        beta -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return beta[:-1], beta[-1]
+
+
+def log_loss(x: np.ndarray, y: np.ndarray, coefficients: np.ndarray, intercept: float):
+    p = np.clip(_sigmoid(x @ coefficients + intercept), 1e-12, 1 - 1e-12)
+    return float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)))
+
+
+def to_weights(coefficients: np.ndarray, total: int = sum(WEIGHTS)):
+    """
+    Integer weights in proportion to the coefficients, scaled to the total of the default weights,
+    so the heuristic sum stays in the range the search was tuned for.
+    """
+    scale = total / max(float(np.abs(coefficients).sum()), 1e-12)
+    return tuple(int(round(c * scale)) for c in coefficients)
+
+
+def tune(boards: np.ndarray, colors: np.ndarray, outcomes: np.ndarray, l2: float = 1e-4):
+    """
+    Fit the weights to the outcomes of the positions. Returns the weights and a report comparing the fit
+    with the default weights, whose scale is fitted alone.
+    """
+    x = feature_matrix(boards, colors)
+    y = (outcomes > 0).astype(np.float64)
+    coefficients, intercept = fit_logistic(x, y, l2)
+    weights = to_weights(coefficients)
+    default = x @ np.array(WEIGHTS, dtype=np.float64)
+    default_scale, default_intercept = fit_logistic(default[:, None], y, l2)
+    report = dict(
+        positions=len(x),
+        log_loss=log_loss(x, y, coefficients, intercept),
+        default_log_loss=log_loss(default[:, None], y, default_scale, default_intercept),
+        baseline_log_loss=log_loss(x, y, np.zeros(x.shape[1]), math.log(y.mean() / (1 - y.mean()))) if 0 < y.mean() < 1 else None,
+        intercept=float(intercept),
+    )
+    return weights, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the evaluation weights to the outcomes of recorded games')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dataset', default=None, help='dataset directory written by learn.py')
+    source.add_argument('--games', default=None, help='game store directory of the server')
+    parser.add_argument('--board-size', type=int, default=BOARD_SIZE, help='size of the stored games to use, or of the dataset')
+    parser.add_argument('--sample', type=int, default=None, help='positions sampled from the dataset, all if omitted')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--l2', type=float, default=1e-4)
+    parser.add_argument('--output', default='weights.json')
+    args = parser.parse_args()
+
+    if args.dataset:
+        reader = DatasetReader(args.dataset)
+        if reader.board_size != args.board_size:
+            parser.error(f'the dataset is of board size {reader.board_size}, not {args.board_size}')
+        boards, colors, outcomes = positions_from_dataset(reader, args.sample, np.random.default_rng(args.seed))
+    else:
+        with GameStore(args.games) as store:
+            boards, colors, outcomes = positions_from_store(store, args.board_size)
+    if not len(boards):
+        parser.error('no decided positions to fit')
+    weights, report = tune(boards, colors, outcomes, args.l2)
+    for feature, default, weight in zip(FEATURES, WEIGHTS, weights):
+        print(f'{feature:<22} {default:>6} -> {weight:>6}')
+    print(f'{report["positions"]} positions, log loss {report["log_loss"]:.4f}, default weights {report["default_log_loss"]:.4f}')
+    with open(args.output, 'w') as f:
+        json.dump(dict(weights=dict(zip(FEATURES, weights)), **report), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from metrics import LOOP_LAG_SECONDS, LOOP_STALLS
+
+executor = ThreadPoolExecutor(thread_name_prefix='off-loop')
+
+
+async def run_off_loop(function, *args, **kwargs):
+    """
+    Run heavy synchronous work on the shared executor instead of the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(function, *args, **kwargs))
+
+
+class LoopWatchdog:
+    """
+    Measures how late the event loop wakes up a heartbeat task. A thread watches the heartbeat
+    and logs the stack of the loop thread once the loop has been blocked longer than `threshold`.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.02, history: int = 10000, log=print):
+        self.threshold = threshold
+        self.interval = interval
+        self.lags = deque(maxlen=history)
+        self.stalls = 0
+        self.log = log
+        self._last_beat = time.monotonic()
+        self._reported_beat = None
+        self._loop_thread_id = None
+        self._heartbeat_task = None
+        self._watcher = None
+        self._running = False
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._running = True
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._watcher = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watcher.start()
+        return self
+
+    async def stop(self):
+        self._running = False
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+        if self._watcher is not None:
+            self._watcher.join()
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            self._last_beat = start
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - start - self.interval, 0.0)
+            self.lags.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def _watch(self):
+        while self._running:
+            time.sleep(self.interval)
+            beat = self._last_beat
+            blocked = time.monotonic() - beat
+            if blocked > self.threshold and self._reported_beat != beat:
+                self._reported_beat = beat
+                self.stalls += 1
+                LOOP_STALLS.inc()
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+                self.log(f'WATCHDOG Event loop blocked for {blocked:.3f}s\n{stack}')
+
+    def lag_percentile(self, percentile: float):
+        if not self.lags:
+            return 0.0
+        lags = sorted(self.lags)
+        return lags[min(int(len(lags) * percentile / 100), len(lags) - 1)]